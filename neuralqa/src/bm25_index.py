@@ -0,0 +1,167 @@
+import os
+import re
+import json
+import mmap
+import math
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+from src.document_store import DocumentStore
+
+
+# Must match tools/bm25-index-generator/create_bm25_index.py, the queries are tokenized like the documents
+TOKEN_PATTERN = re.compile(r"\w+")
+STOPWORDS = frozenset("a an and are as at be by for from has in is it of on or that the to was were with".split())
+
+
+def tokenize(text: str):
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+def decode_varints(data: bytes):
+    values = []
+    value = 0
+    shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = 0
+            shift = 0
+    return values
+
+
+class BM25Shard:
+    """
+    One shard of a BM25Index, an inverted index of a contiguous block of the documents.
+
+    Files of a shard directory:
+        terms.bin       - the UTF-8 terms, sorted bytewise, concatenated
+        terms.idx       - uint64 offsets into terms.bin (terms + 1 entries)
+        postings.bin    - per term, varint (doc id delta, term frequency) pairs ordered by doc id
+        postings.idx    - uint64 offsets into postings.bin (terms + 1 entries)
+        df.bin          - uint32 document frequency of every term
+        lengths.bin     - uint32 number of tokens of every document
+        docs.bin        - the documents (see DocumentStore)
+        docs.idx
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._terms_idx = self._map(os.path.join(directory, "terms.idx"), "Q")
+        self._postings_idx = self._map(os.path.join(directory, "postings.idx"), "Q")
+        self._df = self._map(os.path.join(directory, "df.bin"), "I")
+        self._lengths = self._map(os.path.join(directory, "lengths.bin"), "I")
+        self._terms = self._map(os.path.join(directory, "terms.bin"))
+        self._postings = self._map(os.path.join(directory, "postings.bin"))
+        self.documents = DocumentStore(directory)
+        self.term_count = len(self._df)
+
+    def _map(self, filepath: str, typecode: str = None):
+        if os.path.getsize(filepath) == 0:
+            return memoryview(b"").cast(typecode) if typecode is not None else b""
+        with open(filepath, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(data).cast(typecode) if typecode is not None else data
+
+    def _term(self, i: int) -> bytes:
+        return self._terms[self._terms_idx[i]:self._terms_idx[i + 1]]
+
+    def term_id(self, term: str):
+        key = term.encode("utf-8")
+        low, high = 0, self.term_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._term(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.term_count and self._term(low) == key:
+            return low
+        return None
+
+    def df(self, term_id: int):
+        return self._df[term_id]
+
+    def postings(self, term_id: int):
+        """
+        (doc id, term frequency) pairs of a term.
+        """
+        values = decode_varints(self._postings[self._postings_idx[term_id]:self._postings_idx[term_id + 1]])
+        doc_id = 0
+        pairs = []
+        for i in range(0, len(values), 2):
+            doc_id += values[i]
+            pairs.append((doc_id, values[i + 1]))
+        return pairs
+
+    def top_k(self, term_ids: dict, idfs: dict, top_k: int, k1: float, b: float, average_length: float):
+        """
+        The top_k (score, doc id) of the shard, term_ids maps each query term to its id in this shard.
+        """
+        scores = {}
+        for term, term_id in term_ids.items():
+            idf = idfs[term]
+            for doc_id, tf in self.postings(term_id):
+                norm = k1 * (1 - b + b * self._lengths[doc_id] / average_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+        return heapq.nlargest(top_k, ((score, doc_id) for doc_id, score in scores.items()))
+
+
+class BM25Index:
+    """
+    Out-of-core BM25 index (built by tools/bm25-index-generator), split in shards that are memory-mapped
+    when the index is opened. The IDF and the average document length are those of the whole collection,
+    so the merged top-k of the shards is the top-k of a single index.
+
+    meta.json of the index directory: {"shards": [...], "count": ..., "total_length": ..., "k1": ..., "b": ..., "format": 1}
+    """
+    def __init__(self, directory: str, max_workers: int = 1):
+        """
+        :param max_workers: shards searched concurrently by retrieve
+        """
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.shards = [BM25Shard(os.path.join(directory, shard)) for shard in self.meta["shards"]]
+        self.count = self.meta["count"]
+        self.k1 = self.meta["k1"]
+        self.b = self.meta["b"]
+        self.average_length = max(self.meta["total_length"] / max(self.count, 1), 1e-9)
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers) if max_workers > 1 and len(self.shards) > 1 else None
+
+    def retrieve(self, query: str, top_k: int = 5):
+        """
+        The top_k documents of the query as (document, score) pairs, best first.
+        """
+        terms = set(tokenize(query))
+        shard_term_ids = []
+        df = dict.fromkeys(terms, 0)
+        for shard in self.shards:
+            term_ids = {}
+            for term in terms:
+                term_id = shard.term_id(term)
+                if term_id is not None:
+                    term_ids[term] = term_id
+                    df[term] += shard.df(term_id)
+            shard_term_ids.append(term_ids)
+        idfs = {term: math.log(1 + (self.count - frequency + 0.5) / (frequency + 0.5)) for term, frequency in df.items()}
+
+        def search(i):
+            if not shard_term_ids[i]:
+                return []
+            return [(score, i, doc_id) for score, doc_id in self.shards[i].top_k(shard_term_ids[i], idfs, top_k, self.k1, self.b, self.average_length)]
+
+        if self._executor is not None:
+            shard_results = list(self._executor.map(search, range(len(self.shards))))
+        else:
+            shard_results = [search(i) for i in range(len(self.shards))]
+        best = heapq.nlargest(top_k, (result for results in shard_results for result in results))
+        return [(self.shards[i].documents[doc_id], score) for score, i, doc_id in best]
+
+    def __len__(self):
+        return self.count
+
+    @staticmethod
+    def exists(directory: str):
+        return os.path.exists(os.path.join(directory, "meta.json")) and os.path.exists(os.path.join(directory, "shard-0000"))
@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+class CacheMiss(BaseException):
+    """
+    Raised by a read-only (replay) cache when a requested key has not been recorded.
+    A BaseException, like KeyboardInterrupt, so that the `except Exception` fallbacks of the pipeline
+    (failed query -> no answers) do not turn a replay miss into a silently different run.
+    """
+    pass
+
+
+def hash_key(*parts) -> str:
+    """
+    Content-addressed key for the given parts (order matters).
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(str(part).encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+class LRUCache:
+    """
+    Bounded in-memory least-recently-used cache.
+    """
+    def __init__(self, max_items: int = 10000):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def set(self, key, value):
+        if self.max_items <= 0:
+            return
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+
+class PersistentCache:
+    """
+    Two-tier cache: an LRU memory tier in front of an SQLite file.
+    Values must be JSON serializable. Entries older than `ttl` seconds are treated as misses and
+    the file is trimmed (least recently accessed first) whenever it grows beyond `max_size_bytes`.
+    With `read_only=True` the file is never written and a miss raises CacheMiss (replay mode).
+    """
+    def __init__(self, filepath: str, ttl: float = None, max_size_bytes: int = None, memory_items: int = 10000, read_only: bool = False):
+        self.filepath = filepath
+        self.ttl = ttl
+        self.max_size_bytes = max_size_bytes
+        self.read_only = read_only
+        self.memory = LRUCache(memory_items)
+        self._lock = threading.Lock()
+        self._writes_since_eviction = 0
+
+        if read_only:
+            if not os.path.exists(filepath):
+                raise FileNotFoundError(f"Cache file {filepath} does not exist, cannot replay.")
+            self._connection = sqlite3.connect(f"file:{filepath}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            directory = os.path.dirname(os.path.abspath(filepath))
+            os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(filepath, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )
+            """)
+            self._connection.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+            self._connection.commit()
+
+    def _is_expired(self, created: float) -> bool:
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def get(self, key: str):
+        """
+        Return the cached value for `key`, or None on a miss (CacheMiss in read-only mode).
+        """
+        entry = self.memory.get(key)
+        if entry is not None and not self._is_expired(entry[1]):
+            return entry[0]
+
+        with self._lock:
+            row = self._connection.execute("SELECT value, created FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and self._is_expired(row[1]):
+                if not self.read_only:
+                    self._connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+                    self._connection.commit()
+                row = None
+            if row is not None and not self.read_only:
+                self._connection.execute("UPDATE cache SET accessed = ? WHERE key = ?", (time.time(), key))
+                self._connection.commit()
+
+        if row is None:
+            if self.read_only:
+                raise CacheMiss(key)
+            return None
+
+        value = json.loads(row[0])
+        self.memory.set(key, (value, row[1]))
+        return value
+
+    def set(self, key: str, value):
+        """
+        Store `value` under `key` in both tiers. No-op in read-only mode.
+        """
+        if self.read_only:
+            return
+        now = time.time()
+        self.memory.set(key, (value, now))
+        serialized = json.dumps(value)
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO cache (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, serialized, len(serialized), now, now)
+            )
+            self._connection.commit()
+            self._writes_since_eviction += 1
+            if self.max_size_bytes is not None and self._writes_since_eviction >= 100:
+                self._evict()
+
+    def _evict(self):
+        """
+        Drop expired entries, then the least recently accessed ones until the file fits `max_size_bytes`.
+        Must be called while holding the lock.
+        """
+        self._writes_since_eviction = 0
+        if self.ttl is not None:
+            self._connection.execute("DELETE FROM cache WHERE created < ?", (time.time() - self.ttl,))
+        total = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total > self.max_size_bytes:
+            excess = total - self.max_size_bytes
+            freed = 0
+            victims = []
+            for key, size in self._connection.execute("SELECT key, size FROM cache ORDER BY accessed ASC"):
+                victims.append((key,))
+                freed += size
+                if freed >= excess:
+                    break
+            self._connection.executemany("DELETE FROM cache WHERE key = ?", victims)
+        self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -5,7 +5,12 @@ from abc import abstractmethod
 import requests
 import traceback
 import re
+import os
+import json
+import atexit
+import tempfile
 from src.logging import log, LogComponent, LoggingOptions, LogLevel, LogType
+from src.label_store import LabelStore
 
 class Dataset(TorchDataset):
     def __init__(self, name):
@@ -152,41 +157,24 @@ def uri_to_uril(uri: str, kg):# -> Any:
     
     id = uri.split("/")[-1]
     
-    if kg == KnowledgeGraph.WIKIDATA:
-        label = get_wikidata_label(id)
-        if label is not None:
-            # print("got label")
-            label = label.replace(" ", "_")
-            uri_to_uril_map[uri] = uri + "_" + label
-            uril_to_uri_map[uri + "_" + label] = uri
-        else:
-            # print("no label")
-            uri_to_uril_map[uri] = uri
-            uril_to_uri_map[uri] = uri
-    elif kg == KnowledgeGraph.FREEBASE:
-        # print(id)
-        if len(id) > 2 and (id[1] == '.' or id[2] == '.'):
-            label = get_freebase_label(uri)
-            # print(label)
-            if label is not None :
-                # print("got label")
-                label = label.replace(" ", "_")
-                uri_to_uril_map[uri] = uri + "_" + label
-                uril_to_uri_map[uri + "_" + label] = uri
-                # print(f"uri_to_uril_map[{uri}] = {uri_to_uril_map[uri]}")
-                # print(f"uril_to_uri_map[{uri + '_' + label}] = {uril_to_uri_map[uri + '_' + label]}")
-            else:
-                # print("no label")
-                uri_to_uril_map[uri] = uri
-                uril_to_uri_map[uri] = uri
-        else:
-            # print("no label 2")
-            uri_to_uril_map[uri] = uri
-            uril_to_uri_map[uri] = uri
+    # the label store only replaces the network lookups, the other URIs (predicates, types, ...) keep their id
+    stored_label = LABEL_STORE.get(uri) if LABEL_STORE is not None and _has_label_lookup(id, kg) else None
+    if stored_label is not None:
+        _register_label(uri, stored_label)
+    elif kg == KnowledgeGraph.WIKIDATA:
+        try:
+            _register_label(uri, _lookup_wikidata_label(id))
+        except LabelLookupError as e:
+            print(f"Error: {e}")
+            _register_label(uri, None, persist=False)
+    elif kg == KnowledgeGraph.FREEBASE and _is_freebase_id(id):
+        try:
+            _register_label(uri, _lookup_freebase_label(uri))
+        except LabelLookupError as e:
+            print(f"Error: {e}")
+            _register_label(uri, "Unnamed Entity", persist=False)
     else:
-        # print("no label 3")
-        uri_to_uril_map[uri] = uri
-        uril_to_uri_map[uri] = uri
+        _register_label(uri, None)
 
     # print(f"uri_to_uril done: {uri}")
     
@@ -196,6 +184,10 @@ def uri_to_uril(uri: str, kg):# -> Any:
         return uri_to_uril_map[uri]
 
 def uris_to_urils(uris: list, kg):
+    """
+    Bulk uri_to_uril, the labels of all the unresolved URIs are fetched together first.
+    """
+    prefetch_labels(uris, kg)
     urils = []
     for uri in uris:
         uril = uri_to_uril(uri, kg)
@@ -273,6 +265,8 @@ def triples_with_urils_to_triples_with_uris(triples: str, kg=None):
 #     return "\n".join(triples_with_urils)
 
 def triples_with_uris_to_triples_with_urils(triples: str, kg):
+    prefetch_labels(re.findall(r'<([^>]*)>', triples), kg)
+    
     def replace_uri(match):
         uri = match.group(1)
         return f"<{uri_to_uril(uri, kg)}>"
@@ -282,11 +276,143 @@ def triples_with_uris_to_triples_with_urils(triples: str, kg):
     
 def do_nothing(string):
     return string
+
+# ----------------------------
+# ----- Label resolution -----
+# ----------------------------
+
+WIKIDATA_BATCH_SIZE = 50        # max ids per wbgetentities call
+FREEBASE_BATCH_SIZE = 500       # max URIs per VALUES query
+LABEL_MAPS_FILE = None
+LABEL_STORE = None
+_unpersisted_uris = set()      # URIs registered after a failed lookup, kept for this run only
+
+
+class LabelLookupError(Exception):
+    """
+    Raised when a label lookup failed (timeout, request or endpoint error), unlike a lookup that found no label.
+    """
+    pass
+
+def open_label_store(directory: str):
+    """
+    Use the offline label store in `directory` (see tools/label-store-generator), the network is only used
+    for the URIs it does not know.
+    """
+    global LABEL_STORE
+    LABEL_STORE = LabelStore(directory)
+    log(f"Using label store {directory} ({len(LABEL_STORE)} labels)", LogComponent.OTHER, LogLevel.INFO, LogType.NORMAL)
+    return LABEL_STORE
+
+def _has_label_lookup(id: str, kg):
+    """
+    Whether uri_to_uril looks the label of the id up (Wikidata entities and properties, Freebase ids),
+    the URILs of the other URIs are the URIs themselves.
+    """
+    if kg == KnowledgeGraph.WIKIDATA:
+        return re.fullmatch(r"[QP]\d+", id) is not None
+    return kg == KnowledgeGraph.FREEBASE and _is_freebase_id(id)
+
+def _register_label(uri: str, label, persist: bool = True):
+    """
+    :param persist: False when the label is a placeholder for a failed lookup, it is used for the rest of the run
+                    (the URILs already handed out must stay stable) but never saved, the next run looks it up again
+    """
+    if not persist:
+        _unpersisted_uris.add(uri)
+    if label is not None:
+        label = label.replace(" ", "_")
+        uri_to_uril_map[uri] = uri + "_" + label
+        uril_to_uri_map[uri + "_" + label] = uri
+    else:
+        uri_to_uril_map[uri] = uri
+        uril_to_uri_map[uri] = uri
+
+def _is_freebase_id(id: str):
+    return len(id) > 2 and (id[1] == '.' or id[2] == '.')
+
+def prefetch_labels(uris: list, kg):
+    """
+    Resolve the labels of all the given URIs that are not in the maps yet, with one request per batch
+    (WIKIDATA_BATCH_SIZE ids per wbgetentities call, FREEBASE_BATCH_SIZE URIs per VALUES query) instead of one per URI.
+    Best effort: URIs whose batch failed are left to uri_to_uril.
+    """
+    if kg != KnowledgeGraph.WIKIDATA and kg != KnowledgeGraph.FREEBASE:
+        return
+    
+    pending = {}    # id -> uri
+    for uri in uris:
+        if not is_uri(uri):
+            continue
+        if uri[0] == "<" and uri[-1] == ">":
+            uri = uri[1:-1]
+        if uri in uri_to_uril_map or uri in uril_to_uri_map:
+            continue
+        id = uri.split("/")[-1]
+        if not _has_label_lookup(id, kg):
+            continue
+        stored_label = LABEL_STORE.get(uri) if LABEL_STORE is not None else None
+        if stored_label is not None:
+            _register_label(uri, stored_label)
+        else:
+            pending[id] = uri
+    if len(pending) == 0:
+        return
+    
+    if kg == KnowledgeGraph.WIKIDATA:
+        labels = get_wikidata_labels(list(pending.keys()))
+        for id, label in labels.items():
+            _register_label(pending[id], label)
+    else:
+        labels = get_freebase_labels(list(pending.values()))
+        for uri, label in labels.items():
+            _register_label(uri, label)
+
+def load_label_maps(filepath: str):
+    """
+    Use `filepath` as the persistent store of the label maps: load the labels resolved by previous runs
+    and save the maps back when the process exits (or when save_label_maps is called).
+    """
+    global LABEL_MAPS_FILE
+    LABEL_MAPS_FILE = filepath
+    if os.path.exists(filepath):
+        with open(filepath, "r", encoding="utf-8") as f:
+            stored = json.load(f)
+        for uri, uril in stored.items():
+            uri_to_uril_map.setdefault(uri, uril)
+            uril_to_uri_map.setdefault(uril, uri)
+        log(f"Loaded {len(stored)} labels from {filepath}", LogComponent.OTHER, LogLevel.INFO, LogType.NORMAL)
+    atexit.register(save_label_maps)
+
+def save_label_maps():
+    if LABEL_MAPS_FILE is None:
+        return
+    directory = os.path.dirname(os.path.abspath(LABEL_MAPS_FILE))
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(mode="w", dir=directory, delete=False, encoding="utf-8") as tmp_file:
+        json.dump({uri: uril for uri, uril in list(uri_to_uril_map.items()) if uri not in _unpersisted_uris}, tmp_file)
+        temp_name = tmp_file.name
+    os.replace(temp_name, LABEL_MAPS_FILE)  # atomic rename
     
 import re
 import requests
 
+_wikidata_session = requests.Session()
+_WIKIDATA_HEADERS = {
+    "User-Agent": "QuestionAnsweringQidTranslator/1.0 (https://ai.di.uoa.gr/; skefalidis@di.uoa.gr)"
+}
+
 def get_wikidata_label(qid, lang="en"):
+    try:
+        return _lookup_wikidata_label(qid, lang)
+    except LabelLookupError as e:
+        print(f"Error: {e}")
+        return None
+
+def _lookup_wikidata_label(qid, lang="en"):
+    """
+    The label of a Wikidata id, None if it has none. Raises LabelLookupError when the request failed.
+    """
     if not isinstance(qid, str) or not re.fullmatch(r"[QP]\d+", qid):
         return None
 
@@ -298,24 +424,90 @@ def get_wikidata_label(qid, lang="en"):
         "props": "labels",
         "languages": lang
     }
-    headers = {
-        "User-Agent": "QuestionAnsweringQidTranslator/1.0 (https://ai.di.uoa.gr/; skefalidis@di.uoa.gr)"
-    }
-
     # print(f"Fetching label for {qid} from {url}")
     try:
-        response = requests.get(url, params=params, headers=headers, timeout=(5, 5))
+        response = _wikidata_session.get(url, params=params, headers=_WIKIDATA_HEADERS, timeout=(5, 5))
         # print(response.text)
         response.raise_for_status()
         data = response.json()
+    except (ValueError, requests.exceptions.RequestException) as e:
+        raise LabelLookupError(str(e)) from e
+    try:
         return data["entities"][qid]["labels"][lang]["value"]
-    except (KeyError, requests.exceptions.RequestException) as e:
-        print(f"Error: {e}")
+    except KeyError:
         return None
     
-from SPARQLWrapper import SPARQLWrapper, JSON
+def get_wikidata_labels(qids: list, lang="en"):
+    """
+    Labels of many Wikidata ids, WIKIDATA_BATCH_SIZE ids per wbgetentities call.
+    
+    :return: A dictionary id -> label (None for ids without a label), ids of failed batches are missing.
+    """
+    url = "https://www.wikidata.org/w/api.php"
+    labels = {}
+    for i in range(0, len(qids), WIKIDATA_BATCH_SIZE):
+        batch = qids[i:i + WIKIDATA_BATCH_SIZE]
+        params = {
+            "action": "wbgetentities",
+            "ids": "|".join(batch),
+            "format": "json",
+            "props": "labels",
+            "languages": lang
+        }
+        try:
+            response = _wikidata_session.get(url, params=params, headers=_WIKIDATA_HEADERS, timeout=(5, 15))
+            response.raise_for_status()
+            entities = response.json().get("entities", {})
+        except (ValueError, requests.exceptions.RequestException) as e:
+            print(f"Error: {e}")
+            continue
+        for qid in batch:
+            labels[qid] = entities.get(qid, {}).get("labels", {}).get(lang, {}).get("value")
+    return labels
+    
+from src.utils import execute_sparql_query
+
+def get_freebase_labels(uris: list):
+    """
+    English labels of many Freebase URIs, FREEBASE_BATCH_SIZE URIs per VALUES query.
+    
+    :return: A dictionary uri -> label (None for URIs without a label), URIs of failed batches are missing.
+    """
+    labels = {}
+    for i in range(0, len(uris), FREEBASE_BATCH_SIZE):
+        batch = uris[i:i + FREEBASE_BATCH_SIZE]
+        values = " ".join(f"<{uri}>" for uri in batch)
+        query = f"""
+        SELECT ?entity ?tailEntity WHERE {{
+            VALUES ?entity {{ {values} }}
+            ?entity <http://www.w3.org/2000/01/rdf-schema#label> ?tailEntity .
+            FILTER (lang(?tailEntity) = "en")
+        }}
+        """
+        try:
+            results = execute_sparql_query(query, KnowledgeGraph.get_endpoint(KnowledgeGraph.FREEBASE)).convert()
+        except Exception as e:
+            print(f"Error: {e}")
+            continue
+        for uri in batch:
+            labels[uri] = None
+        for binding in results["results"]["bindings"]:
+            uri = binding["entity"]["value"]
+            if labels.get(uri) is None:
+                labels[uri] = binding["tailEntity"]["value"]
+    return labels
     
 def get_freebase_label(uri):
+    try:
+        return _lookup_freebase_label(uri)
+    except LabelLookupError as e:
+        print(f"Error: {e}")
+        return "Unnamed Entity"
+
+def _lookup_freebase_label(uri):
+    """
+    The English label of a Freebase URI, None if it has none. Raises LabelLookupError when the query failed.
+    """
     # query = f"""
     # SELECT ?tailEntity WHERE {{
     #     {{
@@ -336,20 +528,14 @@ def get_freebase_label(uri):
     }}
     """
     
-    sparql = SPARQLWrapper(KnowledgeGraph.get_endpoint(KnowledgeGraph.FREEBASE))
-    sparql.setCredentials("user", "PASSWORD")
-    sparql.setReturnFormat(JSON)
-    sparql.setQuery(query)
-    
     try:
-        results = sparql.query().convert()
-        if len(results["results"]["bindings"]) > 0:
-            return results["results"]["bindings"][0]["tailEntity"]["value"]
-        else:
-            return None
+        results = execute_sparql_query(query, KnowledgeGraph.get_endpoint(KnowledgeGraph.FREEBASE)).convert()
     except Exception as e:
-        print(f"Error: {e}")
-        return "Unnamed Entity"
+        raise LabelLookupError(str(e)) from e
+    if len(results["results"]["bindings"]) > 0:
+        return results["results"]["bindings"][0]["tailEntity"]["value"]
+    else:
+        return None
     
     
 if __name__ == "__main__":
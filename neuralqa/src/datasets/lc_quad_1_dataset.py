@@ -1,5 +1,5 @@
 import json
-from src.engine.gost_requests import extract_uris
+from src.engine.sparql_parser import extract_uris
 from src.datasets.dataset import Dataset, KnowledgeGraph
 from tqdm import tqdm
 
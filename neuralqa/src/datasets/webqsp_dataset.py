@@ -2,7 +2,7 @@ from calendar import c
 from hmac import new
 import json
 from tqdm import tqdm
-from src.engine.gost_requests import validate_query
+from src.engine.sparql_parser import validate_query
 from src.datasets.dataset import Dataset, KnowledgeGraph
 
 
@@ -0,0 +1,41 @@
+import os
+import mmap
+from array import array
+
+
+class DocumentStore:
+    """
+    Read-only list of documents stored on disk (written by tools/faiss-index-generator next to the FAISS index).
+    Document i is the i-th vector of the index. Both files are memory-mapped, so opening a store is instant and
+    only the pages of the documents that are actually read are loaded (and shared by every process).
+
+    Files:
+        docs.bin    - the UTF-8 documents, concatenated
+        docs.idx    - uint64 offsets into docs.bin (count + 1 entries)
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._offsets = self._map(os.path.join(directory, "docs.idx"), "Q")
+        self._documents = self._map(os.path.join(directory, "docs.bin"))
+        self.count = max(0, len(self._offsets) - 1)
+
+    def _map(self, filepath: str, typecode: str = None):
+        if os.path.getsize(filepath) == 0:
+            return array(typecode) if typecode is not None else b""
+        with open(filepath, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(data).cast(typecode) if typecode is not None else data
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return self._documents[self._offsets[i]:self._offsets[i + 1]].decode("utf-8")
+
+    def __len__(self):
+        return self.count
+
+    @staticmethod
+    def exists(directory: str):
+        return os.path.exists(os.path.join(directory, "docs.bin")) and os.path.exists(os.path.join(directory, "docs.idx"))
@@ -1,5 +1,7 @@
 from typing import List
 import os
+import heapq
+import numpy as np
 from llama_index.core.node_parser import SentenceSplitter
 from src.utils import get_relative_path
 from src.engine.class_identifier.class_identifier import ClassIdentifier
@@ -39,6 +41,46 @@ class NgramSimilarityRetriever(BaseRetriever):
         self.lemmatizer = WordNetLemmatizer()
         self.stop_words = set(stopwords.words('english'))
         
+        self._build_label_index()
+        
+    def _build_label_index(self):
+        """
+        Index of the labels, grouped by their number of tokens (the n of the question n-grams they are compared with).
+        Labels scored by exact match ("sentinel") are kept in a hash of their lowercased text, the others as character
+        count vectors: the common characters of two strings bound their Jaro-Winkler similarity from above, so most
+        (n-gram, label) pairs are discarded with one vectorized operation and never scored.
+        """
+        alphabet = sorted({c for label, _, _ in self.labelToClassMap for c in label.lower() + "s"})
+        self._alphabet = {c: i for i, c in enumerate(alphabet)}
+        self._exact_labels = {}     # n -> lowercased label -> label indices
+        self._fuzzy_labels = {}     # n -> (label indices, character counts of label, of label + "s", prefixes of both)
+        fuzzy = {}
+        for i, (conceptLabel, _, _) in enumerate(self.labelToClassMap):
+            n = len(conceptLabel.split())
+            if "sentinel" in conceptLabel:
+                self._exact_labels.setdefault(n, {}).setdefault(conceptLabel.lower(), []).append(i)
+            else:
+                fuzzy.setdefault(n, []).append(i)
+        for n, indices in fuzzy.items():
+            counts = np.stack([self._char_counts(self.labelToClassMap[i][0].lower()) for i in indices])
+            plural_counts = counts.copy()
+            plural_counts[:, self._alphabet["s"]] += 1
+            prefixes = np.stack([_prefix_codes(self.labelToClassMap[i][0].lower(), -1) for i in indices])
+            plural_prefixes = np.stack([_prefix_codes(self.labelToClassMap[i][0].lower() + "s", -1) for i in indices])
+            self._fuzzy_labels[n] = (np.array(indices), counts, plural_counts, prefixes, plural_prefixes)
+        
+    def _char_counts(self, text: str):
+        counts = np.zeros(len(self._alphabet), dtype=np.int32)
+        for c in text:
+            i = self._alphabet.get(c)
+            if i is not None:
+                counts[i] += 1
+        return counts
+        
+    def _tokenize(self, question: str):
+        tokens = word_tokenize(question)
+        return [self.lemmatizer.lemmatize(word) for word in tokens if word.isalpha() and word not in self.stop_words]
+        
     def isSimilar(self, str1: str, str2: str, similarity_function) -> bool:
         if similarity_function == "jw":
             return jellyfish.jaro_winkler_similarity(str1, str2)
@@ -47,41 +89,113 @@ class NgramSimilarityRetriever(BaseRetriever):
         else:
             raise ValueError("Unknown similarity function: {}".format(similarity_function))
 
+    def _candidates(self, tokens: List[str]):
+        """
+        Every (n-gram, label) pair of the question as arrays: label index, n-gram index, upper bound of the similarity
+        and whether the label is matched exactly (the bound is then the similarity), plus the n-grams of each n.
+        """
+        labels, positions, bounds, exact = [], [], [], []
+        ngrams = {}
+        for n in set(self._exact_labels) | set(self._fuzzy_labels):
+            ngrams[n] = [' '.join(ngram) for ngram in create_ngrams(tokens, n)]
+            if not ngrams[n]:
+                continue
+            if n in self._exact_labels:
+                for label, indices in self._exact_labels[n].items():
+                    matches = np.array([float(ngram.lower() == label) for ngram in ngrams[n]])
+                    for i in indices:
+                        labels.append(np.full(len(ngrams[n]), i))
+                        positions.append(np.arange(len(ngrams[n])))
+                        bounds.append(matches)
+                        exact.append(np.ones(len(ngrams[n]), dtype=bool))
+            if n in self._fuzzy_labels:
+                indices, counts, plural_counts, prefixes, plural_prefixes = self._fuzzy_labels[n]
+                ngram_counts = np.stack([self._char_counts(ngram) for ngram in ngrams[n]])
+                ngram_prefixes = np.stack([_prefix_codes(ngram, -2) for ngram in ngrams[n]])
+                ngram_lengths = np.array([len(ngram) for ngram in ngrams[n]], dtype=np.float64)[None, :]
+                label_lengths = counts.sum(axis=1).astype(np.float64)[:, None]
+                # (labels, ngrams) common characters of every pair, an upper bound of the Jaro matches
+                bound = np.maximum(
+                    _jaro_winkler_bound(np.minimum(counts[:, None, :], ngram_counts[None, :, :]).sum(axis=2), label_lengths, ngram_lengths, _common_prefix(prefixes, ngram_prefixes)),
+                    _jaro_winkler_bound(np.minimum(plural_counts[:, None, :], ngram_counts[None, :, :]).sum(axis=2), label_lengths + 1, ngram_lengths, _common_prefix(plural_prefixes, ngram_prefixes)))
+                labels.append(np.repeat(indices, len(ngrams[n])))
+                positions.append(np.tile(np.arange(len(ngrams[n])), len(indices)))
+                bounds.append(bound.ravel())
+                exact.append(np.zeros(bound.size, dtype=bool))
+        if not labels:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0, dtype=bool), ngrams
+        return np.concatenate(labels), np.concatenate(positions), np.concatenate(bounds), np.concatenate(exact), ngrams
+
+    def _similarity(self, label_index: int, ngram: str, bound: float, exact: bool):
+        if exact:
+            return bound > 0
+        if bound == 0: # no common character
+            return 0
+        conceptLabel = self.labelToClassMap[label_index][0]
+        return max(self.isSimilar(ngram, conceptLabel.lower(), "jw"), self.isSimilar(ngram, conceptLabel.lower() + "s", "jw"))
+
     def _retrieve(self, query_bundle: str) -> List[NodeWithScore]:
         question = query_bundle.query_str
         
-        nodes: List[NodeWithScore] = []
-        
-        # tokens = word_tokenize(question)
-        # tokens = [self.lemmatizer.lemmatize(word) for word in tokens if word.isalpha() and word not in self.stop_words]
-        # print(tokens)
-        
-        for conceptLabel, uri, node in self.labelToClassMap:
-            tokens = word_tokenize(question)
-            tokens = [self.lemmatizer.lemmatize(word) for word in tokens if word.isalpha() and word not in self.stop_words]
-            ngrams = list(create_ngrams(tokens, len(conceptLabel.split())))
-            
-            for ngram in ngrams:
-                similarity = 0
-                
-                if "sentinel" in conceptLabel:
-                    similarity = ' '.join(ngram).lower() == conceptLabel.lower()
-                else:
-                    similarity = max(self.isSimilar(' '.join(ngram), conceptLabel.lower(), "jw"), self.isSimilar(' '.join(ngram), conceptLabel.lower() + "s", "jw"))
-                    
-                nodes.append(NodeWithScore(node=node, score=similarity))
+        labels, positions, bounds, exact, ngrams = self._candidates(self._tokenize(question))
+        def ngram(k):
+            return ngrams[len(self.labelToClassMap[labels[k]][0].split())][positions[k]]
         
         if self.top_k > 0:
-            nodes.sort(key=lambda node: node.score, reverse=True)
-            return nodes[:self.top_k]
+            # pairs scored by decreasing upper bound, until no remaining pair can enter the top k
+            # (ties ordered like the original loops over labels and n-grams)
+            scored = []
+            best = []
+            order = np.lexsort((positions, labels, -bounds))
+            for rank, k in enumerate(order):
+                if len(best) == self.top_k and bounds[k] < best[0]:
+                    break
+                if bounds[k] == 0:
+                    # every remaining pair scores 0 and they are already in order, only the first top_k can be kept
+                    scored.extend((int(labels[k]), int(positions[k]), self._similarity(labels[k], None, 0, exact[k])) for k in order[rank:rank + self.top_k])
+                    break
+                similarity = self._similarity(labels[k], ngram(k), bounds[k], exact[k])
+                scored.append((int(labels[k]), int(positions[k]), similarity))
+                if len(best) < self.top_k:
+                    heapq.heappush(best, similarity)
+                else:
+                    heapq.heappushpop(best, similarity)
+            scored.sort(key=lambda pair: (-pair[2], pair[0], pair[1]))
+            return [NodeWithScore(node=self.labelToClassMap[i][2], score=similarity) for i, _, similarity in scored[:self.top_k]]
         else: # FIXME: almost like GeoQA, the only problem is that we can have multiple concepts for the same node
             filtered_nodes = []
-            for n in nodes:
-                if n.score >= self.jwSimilarity:
-                    filtered_nodes.append(n)
+            candidates = np.nonzero(bounds >= self.jwSimilarity)[0]
+            for k in candidates[np.lexsort((positions[candidates], labels[candidates]))]:
+                similarity = self._similarity(labels[k], ngram(k), bounds[k], exact[k])
+                if similarity >= self.jwSimilarity:
+                    filtered_nodes.append(NodeWithScore(node=self.labelToClassMap[labels[k]][2], score=similarity))
             return filtered_nodes
 
 
+def _prefix_codes(text: str, padding: int):
+    """
+    Code points of the first 4 characters (the prefix of Jaro-Winkler), padded with a value no character has.
+    """
+    codes = [ord(c) for c in text[:4]]
+    return np.array(codes + [padding] * (4 - len(codes)), dtype=np.int64)
+
+def _common_prefix(prefixes, ngram_prefixes):
+    """
+    (labels, ngrams) length of the common prefix, at most 4.
+    """
+    return np.cumprod(prefixes[:, None, :] == ngram_prefixes[None, :, :], axis=2).sum(axis=2)
+
+def _jaro_winkler_bound(common, length1, length2, prefix):
+    """
+    Upper bound of the Jaro-Winkler similarity of strings with these lengths, at most `common` matching characters
+    (no transpositions assumed) and a common prefix of this length.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        jaro = np.where(common > 0, (common / length1 + common / length2 + 1) / 3, 0.0)
+    # the prefix boost only applies above 0.7, small slack so that rounding never puts the exact similarity above its bound
+    return np.where(jaro > 0.7, jaro + 0.1 * prefix * (1 - jaro), jaro) + 1e-9 * (common > 0)
+
+
 class NgramClassIdentifier(ClassIdentifier):
     
     def __init__(self, class_dictionary_file_path: str, top_k: int):
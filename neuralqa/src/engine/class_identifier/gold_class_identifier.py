@@ -1,9 +1,8 @@
-from SPARQLWrapper import SPARQLWrapper, JSON
 from src.datasets.geoquestions1089_dataset import Geoquestions1089Dataset
-from src.utils import get_relative_path
+from src.utils import execute_sparql_query, get_relative_path
 from src.datasets.dataset import KnowledgeGraph
 from src.engine.class_identifier.class_identifier import ClassIdentifier
-from src.engine.gost_requests import extract_uris
+from src.engine.sparql_parser import extract_uris
 import os
 import pickle
 
@@ -37,10 +36,6 @@ class GoldClassIdentifier(ClassIdentifier):
         
         print(f"Loading classes for {knowledge_graph}...")
         
-        sparql = SPARQLWrapper(self.endpoint_url)
-        sparql.setCredentials("user", "PASSWORD")
-        sparql.setReturnFormat(JSON)
-        
         classes = []
         classes_cache_filepath = get_relative_path("./resources/knowledge_graph_classes/" + knowledge_graph.value + "_classes.pkl")
         if os.path.exists(classes_cache_filepath):
@@ -52,11 +47,11 @@ class GoldClassIdentifier(ClassIdentifier):
                 print(f"Failed to load classes from cache: {e}")
         else:
             if knowledge_graph == KnowledgeGraph.WIKIDATA:
-                sparql.setQuery(SPARQL_GET_CLASSES_WIKIDATA)
+                query = SPARQL_GET_CLASSES_WIKIDATA
             else:
-                sparql.setQuery(SPARQL_GET_CLASSES)
+                query = SPARQL_GET_CLASSES
             try:
-                ret = sparql.queryAndConvert()
+                ret = execute_sparql_query(query, self.endpoint_url).convert()
 
                 for r in ret["results"]["bindings"]:
                     c = r['class']['value']
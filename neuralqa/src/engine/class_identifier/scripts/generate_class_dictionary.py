@@ -1,4 +1,4 @@
-from SPARQLWrapper import SPARQLWrapper, JSON
+from src.sparql_client import get_sparql_client
 import re
 
     
@@ -128,16 +128,13 @@ def extract_labels_from_uri_beastiary(uri: str):
 def generate_class_resource_file_for_knowledge_graph(knowledge_graph, endpoint_url, extraction_function=extract_labels_from_uri_default, filter=0):
     print(f"Processing knowledge graph: {knowledge_graph}")
     
-    sparql = SPARQLWrapper(endpoint_url)
-    sparql.setCredentials("user", "PASSWORD")
-    sparql.setReturnFormat(JSON)
+    sparql = get_sparql_client(endpoint_url)
     
     print("Retrieving classes...")
     
     classes = []
-    sparql.setQuery(SPARQL_GET_CLASSES.format(filter=filter))
     try:
-        ret = sparql.queryAndConvert()
+        ret = sparql.query(SPARQL_GET_CLASSES.format(filter=filter))
         # print(ret)
 
         for r in ret["results"]["bindings"]:
@@ -162,18 +159,15 @@ def generate_class_resource_file_for_knowledge_graph(knowledge_graph, endpoint_u
 def generate_class_resource_file_for_wikidata(knowledge_graph, endpoint_url, filter=0):
     print(f"Processing knowledge graph: {knowledge_graph}")
     
-    sparql = SPARQLWrapper(endpoint_url)
-    sparql.setCredentials("user", "PASSWORD")
-    sparql.setReturnFormat(JSON)
+    sparql = get_sparql_client(endpoint_url)
     
     print("Retrieving classes...")
     
     classes_labels = []
     print(SPARQL_GET_CLASSES_LABELS_WIKIDATA.format(filter=filter))
-    sparql.setQuery(SPARQL_GET_CLASSES_LABELS_WIKIDATA.format(filter=filter))
-    # sparql.setQuery(SPARQL_GET_CLASSES_LABELS_DESCRIPTIONS_WIKIDATA)
+    # sparql.query(SPARQL_GET_CLASSES_LABELS_DESCRIPTIONS_WIKIDATA)
     try:
-        ret = sparql.queryAndConvert()
+        ret = sparql.query(SPARQL_GET_CLASSES_LABELS_WIKIDATA.format(filter=filter))
         # print(ret)
 
         for r in ret["results"]["bindings"]:
@@ -5,7 +5,7 @@ import openai
 import torch
 import re
 from transformers import pipeline
-from SPARQLWrapper import SPARQLWrapper, JSON
+from src.sparql_client import get_sparql_client
 from random import sample
 
 
@@ -138,14 +138,11 @@ class ClassSummarizer():
     def process_knowledge_graph(self, knowledge_graph):
         print(f"Processing knowledge graph: {knowledge_graph}")
         
-        sparql = SPARQLWrapper(self.endpoint_url)
-        sparql.setCredentials("user", "PASSWORD")
-        sparql.setReturnFormat(JSON)
+        sparql = get_sparql_client(self.endpoint_url)
         
         # classes = []
-        # sparql.setQuery(ClassSummarizer.SPARQL_GET_CLASSES)
         # try:
-        #     ret = sparql.queryAndConvert()
+        #     ret = sparql.query(ClassSummarizer.SPARQL_GET_CLASSES)
 
         #     for r in ret["results"]["bindings"]:
         #         c = r['class']['value']
@@ -161,10 +158,9 @@ class ClassSummarizer():
         responses = []
         for kg_class in classes:
             print(kg_class)
-            sparql.setQuery(ClassSummarizer.SPARQL_GET_INSTANCES.format(kg_class=kg_class))
             instances = []
             try:
-                ret = sparql.queryAndConvert()
+                ret = sparql.query(ClassSummarizer.SPARQL_GET_INSTANCES.format(kg_class=kg_class))
                 instances = [r['x']['value'] for r in ret["results"]["bindings"]]
                 if len(instances) > 10:
                     instances = sample(instances, 10)
@@ -172,10 +168,9 @@ class ClassSummarizer():
             except Exception as e:
                 print(e)
                 
-            sparql.setQuery(ClassSummarizer.SPARQL_GET_COMMON_PREDICATES.format(kg_class=kg_class))
             predicates = []
             try:
-                ret = sparql.queryAndConvert()
+                ret = sparql.query(ClassSummarizer.SPARQL_GET_COMMON_PREDICATES.format(kg_class=kg_class))
                 predicates = [r['y']['value'] for r in ret["results"]["bindings"]]
                 # print(predicates)
             except Exception as e:
@@ -216,10 +211,9 @@ class ClassSummarizer():
             kg_class, assistant_response = response
             print(kg_class)
             
-            sparql.setQuery(ClassSummarizer.SPARQL_GET_INSTANCES.format(kg_class=kg_class))
             instances = []
             try:
-                ret = sparql.queryAndConvert()
+                ret = sparql.query(ClassSummarizer.SPARQL_GET_INSTANCES.format(kg_class=kg_class))
                 instances = [r['x']['value'] for r in ret["results"]["bindings"]]
                 if len(instances) > 10:
                     instances = sample(instances, 10)
@@ -227,10 +221,9 @@ class ClassSummarizer():
             except Exception as e:
                 print(e)
                 
-            sparql.setQuery(ClassSummarizer.SPARQL_GET_COMMON_PREDICATES.format(kg_class=kg_class))
             predicates = []
             try:
-                ret = sparql.queryAndConvert()
+                ret = sparql.query(ClassSummarizer.SPARQL_GET_COMMON_PREDICATES.format(kg_class=kg_class))
                 predicates = [r['y']['value'] for r in ret["results"]["bindings"]]
                 # print(predicates)
             except Exception as e:
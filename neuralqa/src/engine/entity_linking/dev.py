@@ -2,19 +2,37 @@ from ast import Load
 from typing import List
 
 from jellyfish import jaro_winkler_similarity
-from src.utils import SupportedLLMs, get_relative_path, llm_call, embed_model, load_faiss_index, search_faiss_index
+from src.utils import SupportedLLMs, embed, embed_batch, execute_sparql_query, get_relative_path, llm_call, embed_model, load_faiss_index, search_faiss_index_batch, run_concurrently
 from src.datasets.dataset import KnowledgeGraph
 from src.engine.entity_linking.entity_linker import EntityLinker
+from src.bm25_index import BM25Index
 import re
 import os
 import time
-from SPARQLWrapper import SPARQLWrapper, JSON
 from llama_index.core import Document, VectorStoreIndex, Settings, QueryBundle, StorageContext, ServiceContext, load_index_from_storage
 from llama_index.core.retrievers import VectorIndexRetriever, QueryFusionRetriever, fusion_retriever
 from llama_index.retrievers.bm25 import BM25Retriever
 from sentence_transformers.util import cos_sim
 
 
+SPARSE_INDEX_WORKERS = 4     # shards of a sharded BM25 index searched concurrently
+SPARSE_MENTION_WORKERS = 4   # mentions retrieved concurrently from the sparse index
+RRF_K = 60                   # reciprocal-rank fusion constant, score of a candidate is sum(1 / (RRF_K + rank))
+NED_CANDIDATES = 10          # candidates shown to the disambiguation prompt
+
+
+def fuse_candidates(ranked_lists: List[List[str]], k: int):
+    """
+    Reciprocal-rank fusion of ranked candidate lists, the top k distinct candidates.
+    """
+    scores = {}
+    for ranked in ranked_lists:
+        for rank, candidate in enumerate(ranked):
+            scores[candidate] = scores.get(candidate, 0.0) + 1.0 / (RRF_K + rank + 1)
+    # ties keep the order in which the candidates were first seen
+    return sorted(scores, key=scores.get, reverse=True)[:k]
+
+
 class NamedEntityRecognition():
     
     PROMPT = """A named entity in Named Entity Recognition (NER) is an object, real or fictional, that can be identified with a proper name or Universally Unique Identifier. 
@@ -205,7 +223,12 @@ class NamedEntityDisambiguation():
                 print("Loading index from: " + sparse_index_path)
                 start = time.time()
                 
-                self.bm25_retriever = BM25Retriever.from_persist_dir(sparse_index_path)
+                # sharded indexes are memory-mapped, the older llama_index BM25 indexes are deserialized
+                if BM25Index.exists(sparse_index_path):
+                    self.bm25_index = BM25Index(sparse_index_path, max_workers=SPARSE_INDEX_WORKERS)
+                else:
+                    self.bm25_index = None
+                    self.bm25_retriever = BM25Retriever.from_persist_dir(sparse_index_path)
                 
                 print("Index loaded in: " + str(time.time() - start) + " seconds")
             else:
@@ -214,6 +237,15 @@ class NamedEntityDisambiguation():
             self.has_sparse_index = False
             
     def _get_sparse_candidates(self, entity: str, k: int = 5, debug = False):
+        if self.bm25_index is not None:
+            results = self.bm25_index.retrieve(entity, top_k=k)
+            if debug:
+                print("Entity:", entity)
+                print("Response:")
+                for document, score in results:
+                    print(document)
+                    print(score)
+            return [document for document, _ in results]
         try:
             self.bm25_retriever.similarity_top_k = k
             response = self.bm25_retriever.retrieve(entity)           
@@ -230,43 +262,48 @@ class NamedEntityDisambiguation():
                 print(node.score)
         return candidates
             
-    def _get_dense_candidates(self, entity: str, k: int = 5, debug = False):
+    def _get_sparse_candidates_batch(self, entities: List[str], k: int = 5, debug = False):
+        return run_concurrently(lambda entity: self._get_sparse_candidates(entity, k=k, debug=debug), entities, max_workers=SPARSE_MENTION_WORKERS)
+
+    def _get_dense_candidates_batch(self, entities: List[str], k: int = 5, debug = False):
+        """
+        Dense candidates of many mentions, embedded in one batch and searched with one FAISS call.
+        """
         if self.use_faiss:
-            candidates = search_faiss_index(self.faiss_index, self.documents, entity, k=k, debug=debug)
+            results = search_faiss_index_batch(self.faiss_index, self.documents, entities, k=k, debug=debug)
+            batch_candidates = [[document for document, _ in row] for row in results]
         else:
-            try:
-                response = self.retriever.retrieve(entity)           
-            except Exception as e:
-                print(entity)
-                print(e)
-            nodes = [node for node in response]
-            candidates = [node.get_text() for node in nodes]
-            if debug:
-                print("Entity:", entity)
-                print("Response:")
-                for node in nodes:
-                    print(node)
-                    print(node.score)
+            batch_candidates = []
+            for entity, embedding in zip(entities, embed_batch(entities, is_query=True)):
+                try:
+                    response = self.retriever.retrieve(QueryBundle(query_str=entity, embedding=embedding))
+                except Exception as e:
+                    print(entity)
+                    print(e)
+                    response = []
+                nodes = [node for node in response]
+                if debug:
+                    print("Entity:", entity)
+                    print("Response:")
+                    for node in nodes:
+                        print(node)
+                        print(node.score)
+                batch_candidates.append([node.get_text() for node in nodes])
         # Remove embedding prefix
-        candidates = list(map(lambda x: x.replace('search_document: ', ''), candidates))
-        return candidates
+        return [[candidate.replace('search_document: ', '') for candidate in candidates] for candidates in batch_candidates]
+
+    def discover_candidates_batch(self, entities: List[str], k: int = 5, debug = False):
+        """
+        Candidates of every mention: the sparse and the dense candidates fused with reciprocal-rank fusion.
+        """
+        if len(entities) == 0:
+            return []
+        sparse_candidates = self._get_sparse_candidates_batch(entities, k=k, debug=debug) if self.has_sparse_index else [[] for _ in entities]
+        dense_candidates = self._get_dense_candidates_batch(entities, k=k, debug=debug) if self.has_dense_index else [[] for _ in entities]
+        return [fuse_candidates([sparse, dense], k) for sparse, dense in zip(sparse_candidates, dense_candidates)]
 
     def discover_candidates(self, entity: str, k: int = 5, debug = False):
-        sparse_candidates = self._get_sparse_candidates(entity, k=k, debug=debug) if self.has_sparse_index else []
-        dense_candidates = self._get_dense_candidates(entity, k=k, debug=debug) if self.has_dense_index else []
-        candidates = []
-        while len(candidates) < k:
-            if len(sparse_candidates) > 0 and len(sparse_candidates) > len(dense_candidates):
-                if sparse_candidates[0] not in candidates:
-                    candidates.append(sparse_candidates.pop(0))
-                else:
-                    sparse_candidates.pop(0)
-            elif len(dense_candidates) > 0:
-                if dense_candidates[0] not in candidates:
-                    candidates.append(dense_candidates.pop(0))
-                else:
-                    dense_candidates.pop(0)
-        return candidates
+        return self.discover_candidates_batch([entity], k=k, debug=debug)[0]
     
     def tool_get_more_candidates(self, entity: str, k: int = 10, start: int = 0, end: int = -1):
         candidates = self.discover_candidates(entity, k=k)[start:end]
@@ -288,12 +325,8 @@ class NamedEntityDisambiguation():
             ORDER BY DESC(?c)
             LIMIT {limit}
         """
-        sparql = SPARQLWrapper(endpoint)
-        sparql.setCredentials("user", "PASSWORD")
-        sparql.setQuery(QUERY)
-        sparql.setReturnFormat(JSON)
         try:
-            results = sparql.query().convert()
+            results = execute_sparql_query(QUERY, endpoint).convert()
         except Exception as e:
             print(f"Error querying SPARQL: {e}")
             print(f"Query: {QUERY}")
@@ -321,12 +354,8 @@ class NamedEntityDisambiguation():
                 <{entity}> a ?type .
             }}
         """
-        sparql = SPARQLWrapper(endpoint)
-        sparql.setCredentials("user", "PASSWORD")
-        sparql.setQuery(QUERY)
-        sparql.setReturnFormat(JSON)
         try:
-            results = sparql.query().convert()
+            results = execute_sparql_query(QUERY, endpoint).convert()
         except Exception as e:
             print(f"Error querying SPARQL: {e}")
             print(f"Query: {QUERY}")
@@ -350,7 +379,9 @@ class NamedEntityDisambiguation():
         for uri in uris:
             predicates = self._get_predicates_for_entity(uri, endpoint, 100)
             # most_similiar_predicate = max(predicates, key=lambda x: jaro_winkler_similarity(search_query, x))
-            top2_most_similar_predicate = sorted(predicates, key=lambda p: cos_sim(embed_model.get_text_embedding(search_query), embed_model.get_text_embedding(p)), reverse=True)[:2]
+            search_query_embedding = embed(search_query, is_query=False)
+            similarities = {p: float(cos_sim(search_query_embedding, embedding)) for p, embedding in zip(predicates, embed_batch(predicates, is_query=False))}
+            top2_most_similar_predicate = sorted(predicates, key=lambda p: similarities[p], reverse=True)[:2]
             most_similar_predicates.append((uri, ", ".join(top2_most_similar_predicate)))
         most_similar_predicates_string = "\n\t".join(f"{idx}. {uri} - {predicates}" for idx, (uri, predicates) in enumerate(most_similar_predicates))
         PROMPT = f"""
@@ -370,12 +401,8 @@ class NamedEntityDisambiguation():
                 {{ ?s ?p <{entity}> . }}
             }}
         """
-        sparql = SPARQLWrapper(endpoint)
-        sparql.setCredentials("user", "PASSWORD")
-        sparql.setQuery(QUERY)
-        sparql.setReturnFormat(JSON)
         try:
-            results = sparql.query().convert()
+            results = execute_sparql_query(QUERY, endpoint).convert()
         except Exception as e:
             print(f"Error querying SPARQL: {e}")
             print(f"Query: {QUERY}")
@@ -397,12 +424,16 @@ class NamedEntityDisambiguation():
         {candidate_popularity_string}"""
         return PROMPT
 
-    def ned(self, question: str, entity: str, endpoint: str = None, debug: bool = False, logging: bool = False):
+    def ned(self, question: str, entity: str, endpoint: str = None, debug: bool = False, logging: bool = False, candidates: List[str] = None):
+        """
+        :param candidates: the candidates of the entity if they were already retrieved (discover_candidates_batch)
+        """
         if debug:
             print("Entity: " + entity)
 
-        k = 10
-        candidates = self.discover_candidates(entity, debug=debug, k=k)
+        k = NED_CANDIDATES
+        if candidates is None:
+            candidates = self.discover_candidates(entity, debug=debug, k=k)
         candidates_string = "\n\t".join(f"{idx}. {candidate}" for idx, candidate in enumerate(candidates))
         
         print(f"[DEBUG] Found {len(candidates)} candidates for entity '{entity}': {candidates_string}")
@@ -498,8 +529,9 @@ class DevLinker(EntityLinker):
                 print(entities)
                 print()
             uris = []
-            for e in entities:
-                prediction = self.ned.ned(question, e, self.endpoint, debug=debug, logging=logging)
+            all_candidates = self.ned.discover_candidates_batch(entities, k=NED_CANDIDATES, debug=debug)
+            for e, candidates in zip(entities, all_candidates):
+                prediction = self.ned.ned(question, e, self.endpoint, debug=debug, logging=logging, candidates=candidates)
                 if prediction:
                     uris.append(prediction)
             return uris
@@ -507,8 +539,9 @@ class DevLinker(EntityLinker):
             entities, ner_logs = self.ner.ner(question, debug=debug, logging=logging)
             ned_logs = []
             uris = []
-            for e in entities:
-                prediction, log = self.ned.ned(question, e, self.endpoint, debug=debug, logging=logging)
+            all_candidates = self.ned.discover_candidates_batch(entities, k=NED_CANDIDATES, debug=debug)
+            for e, candidates in zip(entities, all_candidates):
+                prediction, log = self.ned.ned(question, e, self.endpoint, debug=debug, logging=logging, candidates=candidates)
                 ned_logs.append(log)
                 if prediction:
                     uris.append(prediction)
@@ -3,7 +3,7 @@ import requests
 import requests
 from urllib.parse import urlparse, unquote
 from abc import abstractmethod
-from SPARQLWrapper import SPARQLWrapper, JSON
+from src.utils import execute_sparql_query
 
 from src.evaluation.evaluatable import Evaluatable
 from src.datasets.dataset import KnowledgeGraph
@@ -191,13 +191,8 @@ def wikidata_to_freebase(wikidata_uri):
     }}
     """
 
-    sparql = SPARQLWrapper(KnowledgeGraph.get_endpoint(KnowledgeGraph.WIKIDATA))
-    sparql.setCredentials("user", "PASSWORD")
-    sparql.setQuery(query)
-    sparql.setReturnFormat(JSON)
-    
     try:
-        results = sparql.query().convert()
+        results = execute_sparql_query(query, KnowledgeGraph.get_endpoint(KnowledgeGraph.WIKIDATA)).convert()
         bindings = results.get("results", {}).get("bindings", [])
         if bindings:
             return "http://rdf.freebase.com/ns/" + bindings[0]["freebaseID"]["value"][1:].replace("/", ".")
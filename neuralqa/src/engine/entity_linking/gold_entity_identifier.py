@@ -2,33 +2,29 @@ from typing import List
 from src.datasets.cwq_dataset import CwqDataset
 from src.datasets.dataset import KnowledgeGraph
 from src.engine.entity_linking.entity_linker import EntityLinker
-from src.engine.gost_requests import extract_uris
-from SPARQLWrapper import SPARQLWrapper, JSON
+from src.engine.sparql_parser import extract_uris
+from src.utils import execute_sparql_query
 
 
 def generic_uri_is_entity(uri: str, endpoint: str) -> bool:
-    sparql = SPARQLWrapper(endpoint)
-    sparql.setCredentials("user", "PASSWORD")
-    sparql.setReturnFormat(JSON)
-    
     # print(f"URI: {uri}")
 
     # Is the URI used as a predicate?
-    sparql.setQuery(f"""
+    query = f"""
         ASK WHERE {{
             ?s <{uri}> ?o .
         }}
-    """)
-    if sparql.query().convert()['boolean']:
+    """
+    if execute_sparql_query(query, endpoint).convert()['boolean']:
         return False 
 
     # Is the URI used as an rdf:type?
-    sparql.setQuery(f"""
+    query = f"""
         ASK WHERE {{
             ?s a <{uri}> .
         }}
-    """)
-    if sparql.query().convert()['boolean']:
+    """
+    if execute_sparql_query(query, endpoint).convert()['boolean']:
         return False
     
     # print(f"URI: {uri} is not a predicate or rdf:type")
@@ -1,9 +1,8 @@
 import re
 import json
 import time
-from SPARQLWrapper import SPARQLWrapper, JSON
 from typing import List
-from src.metrics import get_kgaqa_tracker_from_dict
+from src.metrics import KgaqaTracker, bind_kgaqa_tracker, get_kgaqa_tracker_from_dict
 from src.engine.qa.query_db import QueryDb
 from src.datasets.lc_quad_1_dataset import LcQuad1Dataset
 from src.datasets.lc_quad_2_dataset import LcQuad2Dataset
@@ -11,17 +10,18 @@ from src.datasets.cwq_dataset import CwqDataset
 from src.datasets.webqsp_dataset import WebQSPDataset
 from src.datasets.qald10_dataset import Qald10Dataset
 from src.datasets.qald9_dataset import Qald9Dataset
-from src.engine.gost_requests import validate_query
-from src.datasets.dataset import ENDPOINT_ID, KnowledgeGraph, triples_with_urils_to_triples_with_uris, uris_to_urils
+from src.engine.sparql_parser import validate_query
+from src.datasets.dataset import ENDPOINT_ID, KnowledgeGraph, load_label_maps, open_label_store, save_label_maps, triples_with_urils_to_triples_with_uris, uris_to_urils
 from src.engine.entity_linking.gold_entity_identifier import GoldEntityLinker
 from src.engine.class_identifier.gold_class_identifier import GoldClassIdentifier
 from src.engine.qa.relation_identifier import RelationIdentifier
-from src.engine.qa.path_extractor import PathExtractor, GroundedPath
-from src.utils import SupportedLLMs, get_kgaqa_tracker, get_relative_path, llm_call
+from src.engine.qa.path_extractor import POPULARITY_EXACT, POPULARITY_APPROXIMATE, PathExtractor, GroundedPath, open_triple_store
+from src.utils import SupportedLLMs, configure_embed_cache, configure_llm_cache, configure_llm_concurrency, configure_sparql_cache, execute_sparql_query, get_kgaqa_tracker, get_relative_path, llm_call
 from src.evaluation.evaluator import Evaluatable
 from src.logging import create_logger, log, LoggingOptions, LogLevel, LogComponent, LogType
 import argparse
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
 PROMPT_QUERY_GENERATION_SIMPLE ="""
@@ -244,12 +244,8 @@ class BasicQueryGenerator(Evaluatable):
 # --------------------------------
     
 def run_sparql_query_values_only(endpoint_url, query):
-    sparql = SPARQLWrapper(endpoint_url)
-    sparql.setCredentials("user", "PASSWORD")
-    sparql.setQuery(query)
-    sparql.setReturnFormat(JSON)
     try:
-        results = sparql.query().convert()
+        results = execute_sparql_query(query, endpoint_url).convert()
     except Exception as e:
         # print(f"SPARQL query failed for endpoint {endpoint_url}: {e}")
         # print(f"Query: {query}")
@@ -338,12 +334,8 @@ def compute_metrics(tp: int, fp: int, fn: int):
     return {"precision": precision, "recall": recall, "f1": f1}
 
 def query_has_results(endpoint_url, query, length = 0):
-    sparql = SPARQLWrapper(endpoint_url)
-    sparql.setCredentials("user", "PASSWORD")
-    sparql.setQuery(query)
-    sparql.setReturnFormat(JSON)
     try:
-        results = sparql.query().convert()
+        results = execute_sparql_query(query, endpoint_url).convert()
         if "boolean" in results:
             return results["boolean"]
         else:
@@ -385,6 +377,9 @@ def save_to_file(args, run_results_basic, run_results_icl, tracker, qald_json_ba
             atomic_write(path_icl, run_results_icl)
             log(f"Saved run results to {path_icl}", LogComponent.QUERY_GENERATOR, LogLevel.INFO, LogType.HEADER)
 
+        # Save resolved labels
+        save_label_maps()
+
         # Save metrics
         metrics = tracker.get_metrics()
         metrics_path = os.path.join(get_relative_path(args.metrics_dir), f"metrics_{dataset_name}.json")
@@ -440,6 +435,48 @@ if __name__ == "__main__":
     parser.add_argument("--endpoint", type=int, required=True, default='1',
                         help="Which endpoint to use, choose from (1, 2, 3)")
     
+    parser.add_argument("--sparql_cache_dir", type=str, required=False,
+                        help="Directory of the persistent SPARQL result cache (optional)")
+    
+    parser.add_argument("--sparql_cache_ttl", type=float, required=False,
+                        help="Seconds after which cached SPARQL results expire (optional)")
+    
+    parser.add_argument("--sparql_cache_max_mb", type=float, required=False,
+                        help="Maximum size of the SPARQL result cache in MB (optional)")
+    
+    parser.add_argument("--sparql_replay", action="store_true",
+                        help="Serve SPARQL results only from the cache, without contacting the endpoint")
+    
+    parser.add_argument("--labels_file", type=str, required=False,
+                        help="JSON file where resolved URI labels are persisted between runs (optional)")
+    
+    parser.add_argument("--label_store_dir", type=str, required=False,
+                        help="Offline label store, checked before the Wikidata API / SPARQL label lookups (optional)")
+    
+    parser.add_argument("--triple_store_dir", type=str, required=False,
+                        help="Local triple store of the knowledge graph, answers the single pattern lookups of the path extractor (optional)")
+    
+    parser.add_argument("--llm_cache_dir", type=str, required=False,
+                        help="Directory of the persistent LLM response cache (optional)")
+    
+    parser.add_argument("--llm_cache_max_mb", type=float, required=False,
+                        help="Maximum size of the LLM response cache in MB (optional)")
+    
+    parser.add_argument("--llm_replay", action="store_true",
+                        help="Serve LLM responses only from the cache, fail on prompts that were never answered")
+    
+    parser.add_argument("--embed_cache_dir", type=str, required=False,
+                        help="Directory of the persistent embedding cache (optional)")
+    
+    parser.add_argument("--workers", type=int, required=False, default=1,
+                        help="Number of questions answered concurrently")
+    
+    parser.add_argument("--llm_max_in_flight", type=int, required=False,
+                        help="Max concurrent LLM requests of the whole run, shared by all the workers (optional)")
+    
+    parser.add_argument("--popularity_mode", type=str, required=False, default=POPULARITY_EXACT, choices=[POPULARITY_EXACT, POPULARITY_APPROXIMATE],
+                        help="Exact predicate popularity counts, or counts extrapolated from a sample (bounded cost on huge classes)")
+    
     args = parser.parse_args()
     
     # ------------------------
@@ -535,6 +572,29 @@ if __name__ == "__main__":
     src.datasets.dataset.ENDPOINT_ID = args.endpoint
     log(f"Using endpoint {src.datasets.dataset.ENDPOINT_ID}", LogComponent.KNOWLEDGE_BASE, LogLevel.INFO, LogType.NORMAL)
     
+    if args.sparql_cache_dir:
+        configure_sparql_cache(get_relative_path(args.sparql_cache_dir), ttl=args.sparql_cache_ttl, max_size_mb=args.sparql_cache_max_mb, replay=args.sparql_replay)
+        log(f"Using SPARQL cache {args.sparql_cache_dir} (replay: {args.sparql_replay})", LogComponent.KNOWLEDGE_BASE, LogLevel.INFO, LogType.NORMAL)
+    
+    if args.llm_max_in_flight:
+        configure_llm_concurrency(args.llm_max_in_flight)
+    
+    if args.label_store_dir:
+        open_label_store(get_relative_path(args.label_store_dir))
+    
+    if args.triple_store_dir:
+        open_triple_store(get_relative_path(args.triple_store_dir))
+    
+    if args.labels_file:
+        load_label_maps(get_relative_path(args.labels_file))
+    
+    if args.llm_cache_dir:
+        configure_llm_cache(get_relative_path(args.llm_cache_dir), max_size_mb=args.llm_cache_max_mb, replay=args.llm_replay)
+        log(f"Using LLM cache {args.llm_cache_dir} (replay: {args.llm_replay})", LogComponent.OTHER, LogLevel.INFO, LogType.NORMAL)
+    
+    if args.embed_cache_dir:
+        configure_embed_cache(get_relative_path(args.embed_cache_dir))
+    
     kg = dataset.get_knowledge_graph()
     
     if args.entities_file:
@@ -550,7 +610,7 @@ if __name__ == "__main__":
         class_identifier = GoldClassIdentifier(knowledge_graph=kg, endpoint_url=KnowledgeGraph.get_endpoint(kg), prefixes=dataset.get_prefixes())
         
     relation_identifier = RelationIdentifier(model_id=SupportedLLMs.GROQ, verbalization_model_id=SupportedLLMs.GROQ)
-    path_extractor = PathExtractor(model_id_main=SupportedLLMs.GROQ, model_id_explore=SupportedLLMs.GROQ, knowledge_graph=kg)
+    path_extractor = PathExtractor(model_id_main=SupportedLLMs.GROQ, model_id_explore=SupportedLLMs.GROQ, knowledge_graph=kg, popularity_mode=args.popularity_mode)
     
     if args.query_db_file:
         query_db = QueryDb(query_db_dataset)
@@ -573,17 +633,8 @@ if __name__ == "__main__":
         
     r = range(50) # For further studies, limit to 100 entries
     
-    for idx in r:
-        print("Answering question", idx + 1, "of", len(dataset))
-        entry = dataset[idx]
-        tracker._total += 1
-        tracker._total_questions += 1
-        
-        question = dataset.get_question(entry)
-        gold_query = dataset.get_query(entry)
-        
-        # Fix missing prefixes
-        fixed_gold_query = ""
+    def fix_prefixes(query):
+        fixed_query = ""
         prefixes = dataset.get_prefixes().split("\n")
         for prefix in prefixes:
             prefix = prefix.replace("\n", "").strip()
@@ -591,77 +642,21 @@ if __name__ == "__main__":
                 continue
             prefix_keyword, prefix_name, prefix_value = prefix.split(" ")
             pattern = r'PREFIX\s+'+re.escape(prefix_name)
-            if re.search(pattern, gold_query) is None:
-                fixed_gold_query += prefix + "\n"
-        fixed_gold_query += gold_query
-        gold_query = fixed_gold_query
-        
-        # If the query can't be answered or is invalid, we generate to have valid results for Gerbil, but we don't count it in the metrics.
-        skip_metrics = False
-        if validate_query(gold_query) == False:
-            log(f"Invalid gold query: {gold_query}", LogComponent.QUERY_GENERATOR, LogLevel.INFO, LogType.NORMAL)
-            tracker._invalid_gold_queries += 1
-            tracker._total -= 1
-            skip_metrics = True
-        if query_has_results(KnowledgeGraph.get_endpoint(kg), gold_query) == False:
-            log(f"Empty gold query: {gold_query}", LogComponent.QUERY_GENERATOR, LogLevel.INFO, LogType.NORMAL)
-            tracker._empty_gold_queries += 1
-            tracker._total -= 1
-            skip_metrics = True
-        
-        log(f"Question: {question}", LogComponent.QUERY_GENERATOR, LogLevel.INFO, LogType.HEADER)
-        
-        # Get the entities and classes
-        if args.classes_file:
-            classes = linked_classes[idx+1]['predictions']
-        else:
-            classes = class_identifier.identify(gold_query)
-        # classes = [] # for Wikidata linking and LC-QuAD (we didn't manage to generate classes in time for the deadline)
-        
-        if args.entities_file:
-            entities = linked_entities[idx+1]['predictions']
-        else:
-            entities = entity_linker.identify(gold_query)
-        
-        entities = [uri for uri in entities if uri not in classes] # FIXME: Temporary fix because the Wikidata gold entity linker returns classes as entities.
-        
-        classes = uris_to_urils(classes, kg)
-        entities = uris_to_urils(entities, kg)
-        
-        # Get the relations
-        start_time = time.time()
-        relations = relation_identifier.identify(question, classes, entities)
-        end_time = time.time()
-        tracker._ri_time += end_time - start_time
-        
-        # Get the paths
-        start_time = time.time()
-        grounded_paths = path_extractor.identify(question, relations)
-        end_time = time.time()
-        tracker._pe_time += end_time - start_time
-        
-        # Generate the 0-shot query
-        start_time = time.time()
-        tries = 3
+            if re.search(pattern, query) is None:
+                fixed_query += prefix + "\n"
+        fixed_query += query
+        return fixed_query
+    
+    def generate_query(predict, label, tries):
         failed_generations = []
+        query = ""
         while True and tries > 0:
             tries -= 1
-            query = generator.predict_zeroshot(question, relations, grounded_paths, failed_generations, entities, classes)
+            query = predict(failed_generations)
             try:
-                fixed_query = ""
-                prefixes = dataset.get_prefixes().split("\n")
-                for prefix in prefixes:
-                    prefix = prefix.replace("\n", "").strip()
-                    if prefix == "":
-                        continue
-                    prefix_keyword, prefix_name, prefix_value = prefix.split(" ")
-                    pattern = r'PREFIX\s+'+re.escape(prefix_name)
-                    if re.search(pattern, query) is None:
-                        fixed_query += prefix + "\n"
-                fixed_query += query
-                query = fixed_query
+                query = fix_prefixes(query)
                 query = triples_with_urils_to_triples_with_uris(query, kg)
-            except:
+            except Exception:
                 log(f"Error in triples_with_urils_to_triples_with_uris: {query}", LogComponent.QUERY_GENERATOR, LogLevel.INFO, LogType.NORMAL)
                 continue
             if validate_query(query) == True:
@@ -674,127 +669,177 @@ if __name__ == "__main__":
             else:
                 failed_generations.append((query, "Invalid query"))
                 log(f"Invalid query, you made some syntactical mistake: {query}", LogComponent.QUERY_GENERATOR, LogLevel.INFO, LogType.NORMAL)        
-        log(f"[0-shot] QUERY VALID", LogComponent.QUERY_GENERATOR, LogLevel.INFO, LogType.LLM_RESULT)
-        end_time = time.time()
-        query_zeroshot = query
-        tracker._qg_zero_shot_time += end_time - start_time
-        
-        # Generate the ICL query
-        if args.query_db_file:
+        log(f"[{label}] QUERY VALID", LogComponent.QUERY_GENERATOR, LogLevel.INFO, LogType.LLM_RESULT)
+        return query
+    
+    def answer_question(idx):
+        """
+        Run the whole pipeline for a single question. Runs on a worker thread, so everything it tracks goes
+        to a tracker of its own (merged into the global tracker by the main thread) and it never touches
+        the shared results.
+        """
+        question_tracker = KgaqaTracker()
+        bind_kgaqa_tracker(question_tracker)
+        try:
+            print("Answering question", idx + 1, "of", len(dataset))
+            entry = dataset[idx]
+            question_tracker._total += 1
+            question_tracker._total_questions += 1
+            
+            question = dataset.get_question(entry)
+            gold_query = fix_prefixes(dataset.get_query(entry)) # Fix missing prefixes
+            
+            # If the query can't be answered or is invalid, we generate to have valid results for Gerbil, but we don't count it in the metrics.
+            skip_metrics = False
+            if validate_query(gold_query) == False:
+                log(f"Invalid gold query: {gold_query}", LogComponent.QUERY_GENERATOR, LogLevel.INFO, LogType.NORMAL)
+                question_tracker._invalid_gold_queries += 1
+                question_tracker._total -= 1
+                skip_metrics = True
+            if query_has_results(KnowledgeGraph.get_endpoint(kg), gold_query) == False:
+                log(f"Empty gold query: {gold_query}", LogComponent.QUERY_GENERATOR, LogLevel.INFO, LogType.NORMAL)
+                question_tracker._empty_gold_queries += 1
+                question_tracker._total -= 1
+                skip_metrics = True
+            
+            log(f"Question: {question}", LogComponent.QUERY_GENERATOR, LogLevel.INFO, LogType.HEADER)
+            
+            # Get the entities and classes
+            if args.classes_file:
+                classes = linked_classes[idx+1]['predictions']
+            else:
+                classes = class_identifier.identify(gold_query)
+            # classes = [] # for Wikidata linking and LC-QuAD (we didn't manage to generate classes in time for the deadline)
+            
+            if args.entities_file:
+                entities = linked_entities[idx+1]['predictions']
+            else:
+                entities = entity_linker.identify(gold_query)
+            
+            entities = [uri for uri in entities if uri not in classes] # FIXME: Temporary fix because the Wikidata gold entity linker returns classes as entities.
+            
+            classes = uris_to_urils(classes, kg)
+            entities = uris_to_urils(entities, kg)
+            
+            # Get the relations
             start_time = time.time()
-            tries = 1
-            failed_generations = []
-            while True and tries > 0:
-                tries -= 1
-                query = generator.predict_icl(question, relations, grounded_paths, failed_generations, entities, classes)
-                try:
-                    fixed_query = ""
-                    prefixes = dataset.get_prefixes().split("\n")
-                    for prefix in prefixes:
-                        prefix = prefix.replace("\n", "").strip()
-                        if prefix == "":
-                            continue
-                        prefix_keyword, prefix_name, prefix_value = prefix.split(" ")
-                        pattern = r'PREFIX\s+'+re.escape(prefix_name)
-                        if re.search(pattern, query) is None:
-                            fixed_query += prefix + "\n"
-                    fixed_query += query
-                    query = fixed_query
-                    query = triples_with_urils_to_triples_with_uris(query, kg)
-                except:
-                    log(f"Error in triples_with_urils_to_triples_with_uris: {query}", LogComponent.QUERY_GENERATOR, LogLevel.INFO, LogType.NORMAL)
-                    continue
-                if validate_query(query) == True:
-                    if query_has_results(KnowledgeGraph.get_endpoint(kg), query, 0) == True:
-                        break
-                    else:
-                        failed_generations.append((query, "Query has no results"))
-                        log(f"Query has no results, it is likely that the connected triples are incompatible: {query}", LogComponent.QUERY_GENERATOR, LogLevel.INFO, LogType.NORMAL)
-                        continue
-                else:
-                    failed_generations.append((query, "Invalid query"))
-                    log(f"Invalid query, you made some syntactical mistake: {query}", LogComponent.QUERY_GENERATOR, LogLevel.INFO, LogType.NORMAL)        
-            log(f"[ICL] QUERY VALID", LogComponent.QUERY_GENERATOR, LogLevel.INFO, LogType.LLM_RESULT)
+            relations = relation_identifier.identify(question, classes, entities)
             end_time = time.time()
-            query_icl = query
-            tracker._qg_icl_time += end_time - start_time
-        
-        log(f"Progress: {idx+1}/{len(dataset)}", LogComponent.OTHER, LogLevel.INFO, LogType.HEADER)
-        log(f"Question: {question}", LogComponent.OTHER, LogLevel.INFO, LogType.HEADER)
-        log(f"Entities: {entities}", LogComponent.OTHER, LogLevel.INFO, LogType.NORMAL)
-        log(f"Classes: {classes}", LogComponent.OTHER, LogLevel.INFO, LogType.NORMAL)
-        log(f"Relations: {relations}", LogComponent.OTHER, LogLevel.INFO, LogType.NORMAL)
-        log(f"Grounded Paths: {grounded_paths}", LogComponent.OTHER, LogLevel.INFO, LogType.NORMAL)
-        
-        # ------------------------
-        # ----- Update Files -----
-        # ------------------------
-        
-        # Zeroshot
-        
-        sparql = SPARQLWrapper(KnowledgeGraph.get_endpoint(kg))
-        sparql.setCredentials("user", "PASSWORD")
-        sparql.setQuery(query_zeroshot)
-        sparql.setReturnFormat(JSON)
-        try:
-            results = sparql.query().convert()
-            if qald_json_basic is not None:
-                qald_json_basic['questions'][idx]['query']['sparql'] = query
-                qald_json_basic['questions'][idx]['answers'] = [results]
-        except:
-            if qald_json_basic:
-                qald_json_basic['questions'][idx]['query']['sparql'] = query
-                qald_json_basic['questions'][idx]['answers'] = []
-        entry = {
+            question_tracker._ri_time += end_time - start_time
+            
+            # Get the paths
+            start_time = time.time()
+            grounded_paths = path_extractor.identify(question, relations)
+            end_time = time.time()
+            question_tracker._pe_time += end_time - start_time
+            
+            # Generate the 0-shot query
+            start_time = time.time()
+            query_zeroshot = generate_query(lambda failed_generations: generator.predict_zeroshot(question, relations, grounded_paths, failed_generations, entities, classes), "0-shot", 3)
+            question_tracker._qg_zero_shot_time += time.time() - start_time
+            
+            # Generate the ICL query
+            query_icl = None
+            if args.query_db_file:
+                start_time = time.time()
+                query_icl = generate_query(lambda failed_generations: generator.predict_icl(question, relations, grounded_paths, failed_generations, entities, classes), "ICL", 1)
+                question_tracker._qg_icl_time += time.time() - start_time
+            
+            log(f"Progress: {idx+1}/{len(dataset)}", LogComponent.OTHER, LogLevel.INFO, LogType.HEADER)
+            log(f"Question: {question}", LogComponent.OTHER, LogLevel.INFO, LogType.HEADER)
+            log(f"Entities: {entities}", LogComponent.OTHER, LogLevel.INFO, LogType.NORMAL)
+            log(f"Classes: {classes}", LogComponent.OTHER, LogLevel.INFO, LogType.NORMAL)
+            log(f"Relations: {relations}", LogComponent.OTHER, LogLevel.INFO, LogType.NORMAL)
+            log(f"Grounded Paths: {grounded_paths}", LogComponent.OTHER, LogLevel.INFO, LogType.NORMAL)
+            
+            # Answers and scores of the generated queries
+            answers_zeroshot, answers_icl = None, None
+            scores_zeroshot, scores_icl = None, None
+            try:
+                answers_zeroshot = execute_sparql_query(query_zeroshot, KnowledgeGraph.get_endpoint(kg)).convert()
+            except Exception:
+                pass
+            if skip_metrics == False:
+                scores_zeroshot = compare_queries_loose(question, KnowledgeGraph.get_endpoint(kg), query_zeroshot, gold_query)
+            if args.query_db_file:
+                try:
+                    answers_icl = execute_sparql_query(query_icl, KnowledgeGraph.get_endpoint(kg)).convert()
+                except Exception:
+                    pass
+                if skip_metrics == False:
+                    scores_icl = compare_queries_loose(question, KnowledgeGraph.get_endpoint(kg), query_icl, gold_query, llm=True)
+        finally:
+            bind_kgaqa_tracker(None)
+        
+        return {
+            "idx": idx,
+            "tracker": question_tracker,
             "question": question,
             "gold_query": gold_query,
+            "skip_metrics": skip_metrics,
             "entities": entities,
             "classes": classes,
             "relations": relations,
             "paths": ", ".join([path.path for path in grounded_paths]),
-            "generated_query": query_zeroshot,
-            # "answer": [results]
+            "query_zeroshot": query_zeroshot,
+            "answers_zeroshot": answers_zeroshot,
+            "scores_zeroshot": scores_zeroshot,
+            "query_icl": query_icl,
+            "answers_icl": answers_icl,
+            "scores_icl": scores_icl,
         }
-        run_results_basic.append(entry)
+    
+    def collect_result(result):
+        """
+        Merge the outcome of a question into the global results and metrics. Called in question order.
+        """
+        idx = result["idx"]
+        question, gold_query = result["question"], result["gold_query"]
+        tracker.merge(result["tracker"])
         
-        # ICL
+        # ------------------------
+        # ----- Update Files -----
+        # ------------------------
         
-        if args.query_db_file:
-            sparql = SPARQLWrapper(KnowledgeGraph.get_endpoint(kg))
-            sparql.setCredentials("user", "PASSWORD")
-            sparql.setQuery(query_icl)
-            sparql.setReturnFormat(JSON)
-            try:
-                results = sparql.query().convert()
-                if qald_json_basic is not None:
-                    qald_json_basic['questions'][idx]['query']['sparql'] = query
-                    qald_json_basic['questions'][idx]['answers'] = [results]
-            except:
-                if qald_json_basic:
-                    qald_json_basic['questions'][idx]['query']['sparql'] = query
-                    qald_json_basic['questions'][idx]['answers'] = []
-            entry = {
+        def run_entry(generated_query):
+            return {
                 "question": question,
                 "gold_query": gold_query,
-                "entities": entities,
-                "classes": classes,
-                "relations": relations,
-                "paths": ", ".join([path.path for path in grounded_paths]),
-                "generated_query": query_icl,
+                "entities": result["entities"],
+                "classes": result["classes"],
+                "relations": result["relations"],
+                "paths": result["paths"],
+                "generated_query": generated_query,
                 # "answer": [results]
             }
-            run_results_icl.append(entry)
+        
+        # Zeroshot
+        
+        if qald_json_basic is not None:
+            qald_json_basic['questions'][idx]['query']['sparql'] = result["query_zeroshot"]
+            qald_json_basic['questions'][idx]['answers'] = [result["answers_zeroshot"]] if result["answers_zeroshot"] is not None else []
+        run_results_basic.append(run_entry(result["query_zeroshot"]))
+        
+        # ICL
+        
+        if args.query_db_file:
+            # the ICL answers go to their own QALD file, they used to overwrite the zero-shot ones of qald_json_basic
+            # (and the ICL file was saved without answers)
+            if qald_json_icl is not None:
+                qald_json_icl['questions'][idx]['query']['sparql'] = result["query_icl"]
+                qald_json_icl['questions'][idx]['answers'] = [result["answers_icl"]] if result["answers_icl"] is not None else []
+            run_results_icl.append(run_entry(result["query_icl"]))
         
         # --------------------------
         # ----- Update Metrics -----
         # --------------------------
 
-        if skip_metrics == False:
+        if result["skip_metrics"] == False:
             # Zeroshot
             log(f"Gold query: {gold_query}", LogComponent.OTHER, LogLevel.INFO, LogType.GOLD)
-            log(f"Generated query: {query_zeroshot}", LogComponent.OTHER, LogLevel.INFO, LogType.NORMAL)
+            log(f"Generated query: {result['query_zeroshot']}", LogComponent.OTHER, LogLevel.INFO, LogType.NORMAL)
             
-            tp, fp, fn, hits_at_1 = compare_queries_loose(question, KnowledgeGraph.get_endpoint(kg), query_zeroshot, gold_query)
+            tp, fp, fn, hits_at_1 = result["scores_zeroshot"]
 
             if tp > 0 and fp == 0 and fn == 0:
                 log(f"✅ Correct 0-shot: {question}", LogComponent.OTHER, LogLevel.INFO, LogType.NORMAL)
@@ -825,9 +870,9 @@ if __name__ == "__main__":
             # In-context Learning
             if args.query_db_file:
                 log(f"Gold query: {gold_query}", LogComponent.OTHER, LogLevel.INFO, LogType.GOLD)
-                log(f"Generated query: {query_icl}", LogComponent.OTHER, LogLevel.INFO, LogType.NORMAL)
+                log(f"Generated query: {result['query_icl']}", LogComponent.OTHER, LogLevel.INFO, LogType.NORMAL)
                 
-                tp_llm, fp_llm, fn_llm, hits_at_1_llm = compare_queries_loose(question, KnowledgeGraph.get_endpoint(kg), query_icl, gold_query, llm=True)
+                tp_llm, fp_llm, fn_llm, hits_at_1_llm = result["scores_icl"]
                 if tp_llm > 0 and fp_llm == 0 and fn_llm == 0:
                     log(f"✅ Correct ICL: {question}", LogComponent.OTHER, LogLevel.INFO, LogType.NORMAL)
                     tracker._icl_exact_match += 1
@@ -864,5 +909,23 @@ if __name__ == "__main__":
             if idx % 20 == 0:
                 log(f"Saving results and metrics after {idx+1} entries...", LogComponent.QUERY_GENERATOR, LogLevel.INFO, LogType.NORMAL)
                 save_to_file(args, run_results_basic, run_results_icl, tracker, qald_json_basic=qald_json_basic, qald_json_icl=qald_json_icl)
+    
+    # Questions are answered by `args.workers` threads, the pipeline is dominated by waiting on the LLM and SPARQL
+    # endpoints and the threads share the in-process caches (is_class_index, uri_to_uril_map, SPARQL cache, ...).
+    # Results are collected in question order, so the results files and checkpoints look exactly like a sequential run.
+    indices = list(r)
+    if query_db is not None:
+        # the few-shot examples of every question are retrieved with one batch, the workers read them from memory
+        query_db.prefetch([dataset.get_question(dataset[idx]) for idx in indices], top_k=3)
+    finished = {}
+    next_position = 0
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        futures = {executor.submit(answer_question, idx): idx for idx in indices}
+        for future in as_completed(futures):
+            result = future.result()
+            finished[result["idx"]] = result
+            while next_position < len(indices) and indices[next_position] in finished:
+                collect_result(finished.pop(indices[next_position]))
+                next_position += 1
             
-    save_to_file(args, run_results_basic, run_results_icl, tracker, qald_json_basic=qald_json_basic, qald_json_icl=qald_json_icl)
\ No newline at end of file
+    save_to_file(args, run_results_basic, run_results_icl, tracker, qald_json_basic=qald_json_basic, qald_json_icl=qald_json_icl)
@@ -0,0 +1,83 @@
+import time
+import random
+import argparse
+import statistics
+from src.datasets.dataset import KnowledgeGraph
+import src.engine.qa.path_extractor as path_extractor
+from src.engine.qa.path_extractor import PathExtractor, open_triple_store
+
+
+LOOKUP_LIMIT = 1000     # high enough that both backends return every match, the result sets are compared
+
+
+def sample_triples(store, sample_size: int, seed: int):
+    """
+    Random (subject, predicate, object) IRI triples of the store, the inputs of the benchmarked lookups.
+    """
+    rng = random.Random(seed)
+    triples = []
+    attempts = 0
+    while len(triples) < sample_size and attempts < sample_size * 20:
+        attempts += 1
+        row = rng.randrange(len(store)) * 3
+        s, p, o = store._spo[row], store._spo[row + 1], store._spo[row + 2]
+        terms = [store.term(s), store.term(p), store.term(o)]
+        if all(term[0] == "<" for term in terms):
+            triples.append(tuple(terms))
+    return triples
+
+def lookups(extractor: PathExtractor, triple: tuple):
+    s, p, o = triple
+    p = p.strip("<>") # the predicate is inserted as <{predicate}> in the SPARQL lookups, the nodes as they are
+    return {
+        "get_object_for_subject_predicate": lambda: extractor.get_object_for_subject_predicate(s, p, limit=LOOKUP_LIMIT),
+        "get_subject_from_predicate_object": lambda: extractor.get_subject_from_predicate_object(p, o, limit=LOOKUP_LIMIT),
+        "get_types_for_node": lambda: extractor.get_types_for_node(s),
+        "get_distinct_predicates_for_entity": lambda: extractor.get_distinct_predicates_for_entity(s)[0],
+    }
+
+def run(extractor: PathExtractor, triples: list, store):
+    """
+    Latencies (seconds) and results of every lookup, with the triple store as backend (store) or the endpoint (None).
+    """
+    path_extractor.TRIPLE_STORE = store
+    latencies, results = {}, {}
+    for i, triple in enumerate(triples):
+        for method, lookup in lookups(extractor, triple).items():
+            start = time.perf_counter()
+            result = lookup()
+            latencies.setdefault(method, []).append(time.perf_counter() - start)
+            results[(method, i)] = set(result)
+    return latencies, results
+
+def describe(latencies: list):
+    ordered = sorted(latencies)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return f"mean {statistics.mean(ordered) * 1000:9.3f} ms   p50 {statistics.median(ordered) * 1000:9.3f} ms   p95 {p95 * 1000:9.3f} ms"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the local triple store with the SPARQL endpoint on the single pattern lookups of PathExtractor.")
+    parser.add_argument("--knowledge_graph", type=str, required=True, help="KnowledgeGraph value, e.g., Beastiary_KG")
+    parser.add_argument("--triple_store_dir", type=str, required=True, help="Triple store of the knowledge graph")
+    parser.add_argument("--sample_size", type=int, default=100, help="Number of sampled triples, every one is used for each lookup")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    store = open_triple_store(args.triple_store_dir)
+    extractor = PathExtractor(KnowledgeGraph(args.knowledge_graph))
+    triples = sample_triples(store, args.sample_size, args.seed)
+    print(f"{len(triples)} sampled triples")
+
+    run(extractor, triples, store) # warm-up, the URI labels are resolved once so they cost the same to both backends
+    endpoint_latencies, endpoint_results = run(extractor, triples, None)
+    store_latencies, store_results = run(extractor, triples, store)
+    path_extractor.TRIPLE_STORE = store
+
+    for method in store_latencies:
+        agreement = sum(store_results[(method, i)] == endpoint_results[(method, i)] for i in range(len(triples))) / len(triples)
+        speedup = statistics.mean(endpoint_latencies[method]) / max(statistics.mean(store_latencies[method]), 1e-9)
+        print(method)
+        print(f"    triple store  {describe(store_latencies[method])}")
+        print(f"    endpoint      {describe(endpoint_latencies[method])}")
+        print(f"    speedup x{speedup:.1f}, identical results {agreement * 100:.1f}%")
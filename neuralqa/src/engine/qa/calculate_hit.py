@@ -1,6 +1,6 @@
 from src.datasets.cwq_dataset import CwqDataset
 from src.datasets.webqsp_dataset import WebQSPDataset
-from SPARQLWrapper import SPARQLWrapper, JSON
+from src.utils import execute_sparql_query
 import json
 from tqdm import tqdm
 
@@ -16,12 +16,8 @@ generated = json.load(open(FILE, 'r'))
 # print(generated[0])
 
 def run_sparql_query_values_only(endpoint_url, query):
-    sparql = SPARQLWrapper(endpoint_url)
-    sparql.setCredentials("user", "PASSWORD")
-    sparql.setQuery(query)
-    sparql.setReturnFormat(JSON)
     try:
-        results = sparql.query().convert()
+        results = execute_sparql_query(query, endpoint_url).convert()
     except Exception as e:
         return []
 
@@ -41,13 +37,8 @@ def get_name_query(entity, endpoint_url):
         <{entity}> <http://rdf.freebase.com/ns/type.object.name> ?name .
     }}
     """
-    sparql = SPARQLWrapper(endpoint_url)
-    sparql.setCredentials("user", "PASSWORD")
-    sparql.setQuery(query)
-    sparql.setReturnFormat(JSON)
-    
     try:
-        results = sparql.query().convert()
+        results = execute_sparql_query(query, endpoint_url).convert()
     except Exception as e:
         return []
     
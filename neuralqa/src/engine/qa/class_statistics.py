@@ -0,0 +1,209 @@
+import os
+import sys
+import json
+import mmap
+import time
+import argparse
+import threading
+from array import array
+from src.datasets.dataset import KnowledgeGraph
+from src.logging import log, LogComponent, LogLevel
+from src.utils import execute_sparql_query, get_relative_path
+
+
+# Directory of the materialized statistics, one sub-directory per knowledge graph
+CLASS_STATISTICS_DIR = "./resources/class_statistics/"
+# Statistics older than this are ignored (live SPARQL is used instead), None never expires them
+CLASS_STATISTICS_MAX_AGE_DAYS = 180
+
+DIRECTION_OUTGOING = 0      # ?s a <class> . ?s ?p ?o
+DIRECTION_INCOMING = 1      # ?s a <class> . ?x ?p ?s
+
+FORMAT_VERSION = 1
+
+
+class ClassPredicateStatistics:
+    """
+    Precomputed (class, predicate, direction, literal, count) rows of a knowledge graph, the materialized form of
+    the GROUP BY ?p aggregation of PathExtractor.get_distinct_predicates_for_class.
+    The rows of a class are contiguous, the columns are memory-mapped arrays.
+
+    Files of a statistics directory:
+        classes.json    - {class: [first row, end row, instances]}
+        predicates.txt  - the predicate of every predicate id, one per line
+        predicate.bin   - uint32 predicate id of every row
+        direction.bin   - uint8 DIRECTION_OUTGOING / DIRECTION_INCOMING of every row
+        literal.bin     - uint8, 1 if the objects of the (outgoing) row are literals
+        count.bin       - uint64 number of triples of every row
+        meta.json       - {"format": ..., "created": ..., "endpoint": ..., "min_instances": ...}
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        with open(os.path.join(directory, "classes.json"), "r", encoding="utf-8") as f:
+            self.classes = json.load(f)
+        with open(os.path.join(directory, "predicates.txt"), "r", encoding="utf-8") as f:
+            self.predicates = [line.rstrip("\n") for line in f]
+        self._predicate = self._map(os.path.join(directory, "predicate.bin"), "I")
+        self._direction = self._map(os.path.join(directory, "direction.bin"), "B")
+        self._literal = self._map(os.path.join(directory, "literal.bin"), "B")
+        self._count = self._map(os.path.join(directory, "count.bin"), "Q")
+
+    def _map(self, filepath: str, typecode: str):
+        if os.path.getsize(filepath) == 0:
+            return array(typecode)
+        with open(filepath, "rb") as f:
+            return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)).cast(typecode)
+
+    def age_days(self):
+        return (time.time() - self.meta["created"]) / 86400
+
+    def is_stale(self):
+        return CLASS_STATISTICS_MAX_AGE_DAYS is not None and self.age_days() > CLASS_STATISTICS_MAX_AGE_DAYS
+
+    def __contains__(self, kg_class: str):
+        return kg_class in self.classes
+
+    def get(self, kg_class: str, filter_literals=False):
+        """
+        The predicates of the instances of `kg_class` (both directions) and their popularity, most popular first,
+        exactly as the live aggregation returns them. None if the class was not materialized.
+        """
+        if kg_class not in self.classes:
+            return None
+        first, end, _ = self.classes[kg_class]
+        counts = {}
+        for row in range(first, end):
+            if filter_literals and self._direction[row] == DIRECTION_OUTGOING and self._literal[row]:
+                continue
+            predicate = self.predicates[self._predicate[row]]
+            counts[predicate] = counts.get(predicate, 0) + self._count[row]
+        ranked = sorted(counts.items(), key=lambda item: item[1], reverse=True)
+        return [predicate for predicate, _ in ranked], [count for _, count in ranked]
+
+
+class_statistics = {}
+_class_statistics_lock = threading.Lock()
+
+def get_class_statistics(knowledge_graph: KnowledgeGraph):
+    """
+    The materialized class statistics of a knowledge graph, loaded on first use.
+    None if they were never generated or are stale.
+    """
+    with _class_statistics_lock:
+        if knowledge_graph not in class_statistics:
+            directory = get_relative_path(CLASS_STATISTICS_DIR + knowledge_graph.value)
+            statistics = None
+            if os.path.exists(os.path.join(directory, "meta.json")):
+                statistics = ClassPredicateStatistics(directory)
+                if statistics.is_stale():
+                    log(f"Class statistics of {knowledge_graph.value} are {statistics.age_days():.0f} days old, using live SPARQL", LogComponent.PATH_EXTRACTOR, LogLevel.WARNING)
+                    statistics = None
+            class_statistics[knowledge_graph] = statistics
+        return class_statistics[knowledge_graph]
+
+
+# -----------------------------------
+# ----- Offline materialization -----
+# -----------------------------------
+
+def _type_predicate(knowledge_graph: KnowledgeGraph):
+    if knowledge_graph == KnowledgeGraph.WIKIDATA:
+        return "<http://www.wikidata.org/prop/direct/P31>"
+    return "<http://www.w3.org/1999/02/22-rdf-syntax-ns#type>"
+
+def get_classes_above_threshold(knowledge_graph: KnowledgeGraph, endpoint: str, min_instances: int, timeout: int):
+    query = f"""
+    SELECT ?class (COUNT(?s) AS ?instances)
+    WHERE {{
+        ?s {_type_predicate(knowledge_graph)} ?class .
+        FILTER (isIRI(?class))
+    }}
+    GROUP BY ?class
+    HAVING (COUNT(?s) >= {min_instances})
+    ORDER BY DESC(?instances)
+    """
+    results = execute_sparql_query(query, endpoint, timeout=timeout).convert()
+    return [(result["class"]["value"], int(result["instances"]["value"])) for result in results["results"]["bindings"]]
+
+def get_class_rows(knowledge_graph: KnowledgeGraph, endpoint: str, kg_class: str, timeout: int):
+    """
+    The (predicate, direction, literal, count) rows of one class.
+    """
+    type_predicate = _type_predicate(knowledge_graph)
+    outgoing = f"""
+    SELECT ?p ?literal (COUNT(*) AS ?count)
+    WHERE {{
+        ?s {type_predicate} <{kg_class}> .
+        ?s ?p ?o .
+    }}
+    GROUP BY ?p (isLiteral(?o) AS ?literal)
+    """
+    incoming = f"""
+    SELECT ?p (COUNT(*) AS ?count)
+    WHERE {{
+        ?s {type_predicate} <{kg_class}> .
+        ?x ?p ?s .
+    }}
+    GROUP BY ?p
+    """
+    rows = []
+    for result in execute_sparql_query(outgoing, endpoint, timeout=timeout).convert()["results"]["bindings"]:
+        literal = result["literal"]["value"] in ("true", "1")
+        rows.append((result["p"]["value"], DIRECTION_OUTGOING, literal, int(result["count"]["value"])))
+    for result in execute_sparql_query(incoming, endpoint, timeout=timeout).convert()["results"]["bindings"]:
+        rows.append((result["p"]["value"], DIRECTION_INCOMING, False, int(result["count"]["value"])))
+    return rows
+
+def generate_class_statistics(knowledge_graph: KnowledgeGraph, endpoint: str, output_dir: str, min_instances: int, timeout: int):
+    print(f"Retrieving the classes of {knowledge_graph.value} with at least {min_instances} instances...")
+    classes = get_classes_above_threshold(knowledge_graph, endpoint, min_instances, timeout)
+    print(f"{len(classes)} classes")
+
+    predicate_ids = {}
+    predicate, direction, literal, count = array("I"), array("B"), array("B"), array("Q")
+    class_rows = {}
+    for i, (kg_class, instances) in enumerate(classes):
+        try:
+            rows = get_class_rows(knowledge_graph, endpoint, kg_class, timeout)
+        except Exception as e:
+            # classes that fail are left out, PathExtractor falls back to live SPARQL for them
+            print(f"Skipping {kg_class}: {e}", file=sys.stderr)
+            continue
+        first = len(count)
+        for p, d, l, c in rows:
+            predicate.append(predicate_ids.setdefault(p, len(predicate_ids)))
+            direction.append(d)
+            literal.append(1 if l else 0)
+            count.append(c)
+        class_rows[kg_class] = [first, len(count), instances]
+        if (i + 1) % 100 == 0:
+            print(f"{i + 1}/{len(classes)} classes...")
+
+    os.makedirs(output_dir, exist_ok=True)
+    for name, column in (("predicate.bin", predicate), ("direction.bin", direction), ("literal.bin", literal), ("count.bin", count)):
+        with open(os.path.join(output_dir, name), "wb") as f:
+            column.tofile(f)
+    with open(os.path.join(output_dir, "predicates.txt"), "w", encoding="utf-8") as f:
+        for p in predicate_ids: # insertion order is the id order
+            f.write(p + "\n")
+    with open(os.path.join(output_dir, "classes.json"), "w", encoding="utf-8") as f:
+        json.dump(class_rows, f)
+    # meta.json last, a directory without it is not loaded
+    with open(os.path.join(output_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"format": FORMAT_VERSION, "created": time.time(), "endpoint": endpoint, "min_instances": min_instances}, f)
+    print(f"Statistics of {len(class_rows)} classes ({len(count)} rows) written to {output_dir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Materialize the per-class predicate statistics of a knowledge graph.")
+    parser.add_argument("--knowledge_graph", type=str, required=True, help="KnowledgeGraph value, e.g., DBpedia or Wikidata")
+    parser.add_argument("--endpoint", type=str, default=None, help="SPARQL endpoint, defaults to the endpoint of the knowledge graph")
+    parser.add_argument("--min_instances", type=int, default=1000, help="Only classes with at least this many instances are materialized")
+    parser.add_argument("--timeout", type=int, default=600, help="Timeout (seconds) of every aggregation query")
+    args = parser.parse_args()
+
+    knowledge_graph = KnowledgeGraph(args.knowledge_graph)
+    endpoint = args.endpoint if args.endpoint is not None else KnowledgeGraph.get_endpoint(knowledge_graph)
+    generate_class_statistics(knowledge_graph, endpoint, get_relative_path(CLASS_STATISTICS_DIR + knowledge_graph.value), args.min_instances, args.timeout)
@@ -2,12 +2,11 @@ import argparse
 import re
 import os
 import json
-from SPARQLWrapper import SPARQLWrapper, JSON
 from typing import List
 
-from src.datasets.dataset import KnowledgeGraph, uris_to_urils, urils_to_uris, triples_with_urils_to_triples_with_uris, triples_with_uris_to_triples_with_urils
+from src.datasets.dataset import KnowledgeGraph, load_label_maps, open_label_store, uris_to_urils, urils_to_uris, triples_with_urils_to_triples_with_uris, triples_with_uris_to_triples_with_urils
 from src.engine.qa.query_db import QueryDb
-from src.utils import SupportedLLMs, get_relative_path, llm_call
+from src.utils import SupportedLLMs, configure_embed_cache, configure_llm_cache, configure_sparql_cache, execute_sparql_query, get_relative_path, llm_call
 from src.logging import LoggingOptions, create_logger, log, LogComponent, LogLevel, LogType, print_colored
 
 from src.engine.entity_linking.gold_entity_identifier import GoldEntityLinker
@@ -19,7 +18,7 @@ from src.datasets.cwq_dataset import CwqDataset
 from src.datasets.webqsp_dataset import WebQSPDataset
 from src.datasets.qald10_dataset import Qald10Dataset
 from src.datasets.qald9_dataset import Qald9Dataset
-from src.engine.gost_requests import validate_query
+from src.engine.sparql_parser import validate_query
 
 from src.engine.qa.basic_query_generator import compare_queries_loose, compute_metrics, query_has_results
 
@@ -167,6 +166,27 @@ if __name__ == "__main__":
     
     parser.add_argument("--endpoint", type=int, required=True, default='1',
                         help="Which endpoint to use, choose from (1, 2, 3)")
+    
+    parser.add_argument("--sparql_cache_dir", type=str, required=False,
+                        help="Directory of the persistent SPARQL result cache (optional)")
+    
+    parser.add_argument("--sparql_replay", action="store_true",
+                        help="Serve SPARQL results only from the cache, without contacting the endpoint")
+    
+    parser.add_argument("--labels_file", type=str, required=False,
+                        help="JSON file where resolved URI labels are persisted between runs (optional)")
+    
+    parser.add_argument("--label_store_dir", type=str, required=False,
+                        help="Offline label store, checked before the Wikidata API / SPARQL label lookups (optional)")
+    
+    parser.add_argument("--llm_cache_dir", type=str, required=False,
+                        help="Directory of the persistent LLM response cache (optional)")
+    
+    parser.add_argument("--llm_replay", action="store_true",
+                        help="Serve LLM responses only from the cache, fail on prompts that were never answered")
+    
+    parser.add_argument("--embed_cache_dir", type=str, required=False,
+                        help="Directory of the persistent embedding cache (optional)")
 
     args = parser.parse_args()
     
@@ -234,6 +254,21 @@ if __name__ == "__main__":
     src.datasets.dataset.ENDPOINT_ID = args.endpoint
     log(f"Using endpoint {src.datasets.dataset.ENDPOINT_ID}", LogComponent.KNOWLEDGE_BASE, LogLevel.INFO, LogType.NORMAL)
     
+    if args.sparql_cache_dir:
+        configure_sparql_cache(get_relative_path(args.sparql_cache_dir), replay=args.sparql_replay)
+    
+    if args.label_store_dir:
+        open_label_store(get_relative_path(args.label_store_dir))
+    
+    if args.labels_file:
+        load_label_maps(get_relative_path(args.labels_file))
+    
+    if args.llm_cache_dir:
+        configure_llm_cache(get_relative_path(args.llm_cache_dir), replay=args.llm_replay)
+    
+    if args.embed_cache_dir:
+        configure_embed_cache(get_relative_path(args.embed_cache_dir))
+    
     kg = dataset.get_knowledge_graph()
     
     entity_linker = GoldEntityLinker(knowledge_graph=kg, prefixes=dataset.get_prefixes())
@@ -241,6 +276,7 @@ if __name__ == "__main__":
     
     query_db = QueryDb(query_db_dataset)
     generator = EntryQueryGenerator(model_id=SupportedLLMs.GPT4_1_MINI, query_db=query_db)
+    query_db.prefetch([dataset.get_question(entry) for entry in dataset], top_k=5)
     
     run_results = []
     
@@ -349,7 +385,7 @@ if __name__ == "__main__":
                         log(f"Invalid generated query: {query}", LogComponent.QUERY_GENERATOR, LogLevel.INFO, LogType.NORMAL)
                         query = "UNABLE_TO_GENERATE_QUERY"
                         no_generation += 1
-            except:
+            except Exception:
                 log(f"Error in triples_with_urils_to_triples_with_uris: {query}", LogComponent.QUERY_GENERATOR, LogLevel.INFO, LogType.NORMAL)
         
         # ------------------------
@@ -357,12 +393,8 @@ if __name__ == "__main__":
         # ------------------------
         
         if query != "UNABLE_TO_GENERATE_QUERY":
-            sparql = SPARQLWrapper(KnowledgeGraph.get_endpoint(kg))
-            sparql.setCredentials("user", "PASSWORD")
-            sparql.setQuery(query)
-            sparql.setReturnFormat(JSON)
             try:
-                results = sparql.query().convert()
+                results = execute_sparql_query(query, KnowledgeGraph.get_endpoint(kg)).convert()
                 if qald_json is not None:
                     qald_json['questions'][idx]['query']['sparql'] = query
                     qald_json['questions'][idx]['answers'] = [results]
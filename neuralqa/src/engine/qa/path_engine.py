@@ -0,0 +1,319 @@
+import os
+import re
+import sys
+import json
+import mmap
+import argparse
+import threading
+from array import array
+from collections import Counter
+from src.datasets.dataset import KnowledgeGraph
+from src.utils import execute_sparql_query, get_relative_path
+
+
+# Directory of the compressed graphs, one sub-directory per knowledge graph
+PATH_ENGINE_DIR = "./resources/path_engine/"
+# Max number of (node) paths enumerated by a single search, hubs can make the enumeration explode
+MAX_ENUMERATED_PATHS = 100000
+
+
+class PathEngine:
+    """
+    In-process path search over a knowledge graph (or a predicate-filtered projection of it) stored as a
+    compressed sparse row (CSR) adjacency structure, with integer node and predicate ids.
+    Only the edges between IRIs are kept, literals never lie on a path.
+    Returns the (predicatePath, pathCount) pairs of the GraphDB path:search queries of PathExtractor.
+
+    Files of a graph directory:
+        nodes.txt           - the IRI of every node id, one per line
+        predicates.txt      - the IRI of every predicate id, one per line
+        out_offsets.bin     - uint64, the outgoing edges of node i are [out_offsets[i], out_offsets[i + 1])
+        out_targets.bin     - uint32 target node of every outgoing edge
+        out_predicates.bin  - uint32 predicate of every outgoing edge
+        in_offsets.bin, in_sources.bin, in_predicates.bin - the same for the incoming edges
+        meta.json           - {"nodes": ..., "edges": ..., "predicates": ...}
+    """
+    def __init__(self, nodes: list, predicates: list, out_offsets, out_targets, out_predicates, in_offsets, in_sources, in_predicates):
+        self.nodes = nodes
+        self.node_ids = {node: i for i, node in enumerate(nodes)}
+        self.predicates = predicates
+        self.out_offsets, self.out_targets, self.out_predicates = out_offsets, out_targets, out_predicates
+        self.in_offsets, self.in_sources, self.in_predicates = in_offsets, in_sources, in_predicates
+
+    # --------------------------
+    # ----- Build and load -----
+    # --------------------------
+
+    @staticmethod
+    def from_triples(triples):
+        """
+        Build the graph from (subject, predicate, object) IRIs.
+        """
+        node_ids, predicate_ids = {}, {}
+        sources, predicates, targets = array("I"), array("I"), array("I")
+        for s, p, o in triples:
+            sources.append(node_ids.setdefault(s, len(node_ids)))
+            predicates.append(predicate_ids.setdefault(p, len(predicate_ids)))
+            targets.append(node_ids.setdefault(o, len(node_ids)))
+        out_offsets, out_targets, out_predicates = _csr(len(node_ids), sources, targets, predicates)
+        in_offsets, in_sources, in_predicates = _csr(len(node_ids), targets, sources, predicates)
+        return PathEngine(list(node_ids), list(predicate_ids), out_offsets, out_targets, out_predicates, in_offsets, in_sources, in_predicates)
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        for name, column in (("out_offsets.bin", self.out_offsets), ("out_targets.bin", self.out_targets), ("out_predicates.bin", self.out_predicates),
+                             ("in_offsets.bin", self.in_offsets), ("in_sources.bin", self.in_sources), ("in_predicates.bin", self.in_predicates)):
+            with open(os.path.join(directory, name), "wb") as f:
+                column.tofile(f)
+        for name, values in (("nodes.txt", self.nodes), ("predicates.txt", self.predicates)):
+            with open(os.path.join(directory, name), "w", encoding="utf-8") as f:
+                for value in values:
+                    f.write(value + "\n")
+        with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"nodes": len(self.nodes), "edges": len(self.out_targets), "predicates": len(self.predicates)}, f)
+
+    @staticmethod
+    def load(directory: str):
+        def read_lines(name):
+            with open(os.path.join(directory, name), "r", encoding="utf-8") as f:
+                return [line.rstrip("\n") for line in f]
+
+        def map_column(name, typecode):
+            filepath = os.path.join(directory, name)
+            if os.path.getsize(filepath) == 0:
+                return array(typecode)
+            with open(filepath, "rb") as f:
+                return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)).cast(typecode)
+
+        return PathEngine(read_lines("nodes.txt"), read_lines("predicates.txt"),
+                          map_column("out_offsets.bin", "Q"), map_column("out_targets.bin", "I"), map_column("out_predicates.bin", "I"),
+                          map_column("in_offsets.bin", "Q"), map_column("in_sources.bin", "I"), map_column("in_predicates.bin", "I"))
+
+    # ------------------
+    # ----- Search -----
+    # ------------------
+
+    def _outgoing(self, node: int):
+        for edge in range(self.out_offsets[node], self.out_offsets[node + 1]):
+            yield self.out_targets[edge], self.out_predicates[edge]
+
+    def _incoming(self, node: int):
+        for edge in range(self.in_offsets[node], self.in_offsets[node + 1]):
+            yield self.in_sources[edge], self.in_predicates[edge]
+
+    def _neighbors(self, node: int, forward: bool, bidirectional: bool):
+        """
+        (neighbor, predicate) pairs of a node, following the edges forward (from the source) or backward (from the destination).
+        """
+        if bidirectional:
+            yield from self._outgoing(node)
+            yield from self._incoming(node)
+        elif forward:
+            yield from self._outgoing(node)
+        else:
+            yield from self._incoming(node)
+
+    def _results(self, counts: Counter):
+        ranked = counts.most_common()
+        paths = [" -> ".join(self.predicates[p] for p in predicate_path) for predicate_path, _ in ranked]
+        return paths, [count for _, count in ranked]
+
+    def shortest_paths(self, from_node: str, to_node: str, bidirectional: bool = True, max_depth: int = None):
+        """
+        All the shortest paths between two nodes, grouped by their predicate path.
+        Bidirectional BFS, the smaller frontier is expanded first. Every shortest path is counted once.
+        :return: predicate paths (" -> " separated IRIs) and the number of paths of each, most frequent first
+        """
+        if from_node not in self.node_ids or to_node not in self.node_ids or from_node == to_node:
+            return [], []
+        source, destination = self.node_ids[from_node], self.node_ids[to_node]
+
+        # distance and (previous node, predicate) parents of every visited node, per side
+        distances = ({source: 0}, {destination: 0})
+        parents = ({source: []}, {destination: []})
+        frontiers = ([source], [destination])
+        depths = [0, 0]
+        length = None
+        while length is None and frontiers[0] and frontiers[1]:
+            if max_depth is not None and depths[0] + depths[1] >= max_depth:
+                return [], []
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            side_distances, side_parents = distances[side], parents[side]
+            next_frontier = []
+            for node in frontiers[side]:
+                for neighbor, predicate in self._neighbors(node, side == 0, bidirectional):
+                    if neighbor not in side_distances:
+                        side_distances[neighbor] = depths[side] + 1
+                        side_parents[neighbor] = []
+                        next_frontier.append(neighbor)
+                    if side_distances[neighbor] == depths[side] + 1:
+                        side_parents[neighbor].append((node, predicate))
+            depths[side] += 1
+            frontiers = (next_frontier, frontiers[1]) if side == 0 else (frontiers[0], next_frontier)
+            meetings = [distances[0][node] + distances[1][node] for node in next_frontier if node in distances[1 - side]]
+            if meetings:
+                length = min(meetings)
+        if length is None:
+            return [], []
+
+        # every shortest path has exactly one node at this forward distance, both of its distances are exact
+        cut = min(length, depths[0])
+        meeting_nodes = [node for node, distance in distances[0].items() if distance == cut and distances[1].get(node) == length - cut]
+
+        forward_memo, backward_memo = {}, {}
+        counts = Counter()
+        enumerated = 0
+        for node in meeting_nodes:
+            for prefix, prefix_count in self._predicate_paths(node, parents[0], forward_memo).items():
+                for suffix, suffix_count in self._predicate_paths(node, parents[1], backward_memo).items():
+                    counts[prefix + suffix[::-1]] += prefix_count * suffix_count
+                    enumerated += 1
+                    if enumerated >= MAX_ENUMERATED_PATHS:
+                        return self._results(counts)
+        return self._results(counts)
+
+    def _predicate_paths(self, node: int, parents: dict, memo: dict):
+        """
+        Number of BFS-tree paths from the root of `parents` to `node`, grouped by their predicate sequence.
+        """
+        if node in memo:
+            return memo[node]
+        if not parents[node]:
+            memo[node] = Counter({(): 1})
+            return memo[node]
+        paths = Counter()
+        for previous, predicate in parents[node]:
+            for path, count in self._predicate_paths(previous, parents, memo).items():
+                paths[path + (predicate,)] += count
+        memo[node] = paths
+        return paths
+
+    def all_paths(self, from_node: str, to_node: str, depth_limit: int, bidirectional: bool = True):
+        """
+        All the simple paths of at most `depth_limit` edges between two nodes, grouped by their predicate path.
+        Depth-first search, pruned with the distances to the destination (BFS from the destination up to `depth_limit`).
+        :return: predicate paths (" -> " separated IRIs) and the number of paths of each, most frequent first
+        """
+        if from_node not in self.node_ids or to_node not in self.node_ids or from_node == to_node:
+            return [], []
+        source, destination = self.node_ids[from_node], self.node_ids[to_node]
+
+        remaining = {destination: 0}
+        frontier = [destination]
+        for depth in range(1, depth_limit):
+            next_frontier = []
+            for node in frontier:
+                for neighbor, _ in self._neighbors(node, False, bidirectional):
+                    if neighbor not in remaining:
+                        remaining[neighbor] = depth
+                        next_frontier.append(neighbor)
+            frontier = next_frontier
+
+        counts = Counter()
+        on_path = {source}
+        predicate_path = []
+        stack = [(source, self._neighbors(source, True, bidirectional))]
+        enumerated = 0
+        while stack and enumerated < MAX_ENUMERATED_PATHS:
+            node, neighbors = stack[-1]
+            step = next(neighbors, None)
+            if step is None:
+                stack.pop()
+                on_path.discard(node)
+                if predicate_path:
+                    predicate_path.pop()
+                continue
+            neighbor, predicate = step
+            if neighbor == destination:
+                counts[tuple(predicate_path) + (predicate,)] += 1
+                enumerated += 1
+                continue
+            # len(stack) edges lead to the neighbor, it needs `remaining` more to reach the destination
+            if neighbor in on_path or neighbor not in remaining or len(stack) + remaining[neighbor] > depth_limit:
+                continue
+            on_path.add(neighbor)
+            predicate_path.append(predicate)
+            stack.append((neighbor, self._neighbors(neighbor, True, bidirectional)))
+        return self._results(counts)
+
+
+def _csr(node_count: int, sources: array, targets: array, predicates: array):
+    """
+    Group the edges by source node (counting sort).
+    """
+    offsets = array("Q", [0]) * (node_count + 1)
+    for source in sources:
+        offsets[source + 1] += 1
+    for i in range(node_count):
+        offsets[i + 1] += offsets[i]
+    position = array("Q", offsets[:-1])
+    sorted_targets, sorted_predicates = array("I", [0]) * len(sources), array("I", [0]) * len(sources)
+    for source, target, predicate in zip(sources, targets, predicates):
+        sorted_targets[position[source]] = target
+        sorted_predicates[position[source]] = predicate
+        position[source] += 1
+    return offsets, sorted_targets, sorted_predicates
+
+
+path_engines = {}
+_path_engines_lock = threading.Lock()
+
+def get_path_engine(knowledge_graph: KnowledgeGraph):
+    """
+    The path engine of a knowledge graph, loaded on first use. None if its graph was never generated.
+    """
+    with _path_engines_lock:
+        if knowledge_graph not in path_engines:
+            directory = get_relative_path(PATH_ENGINE_DIR + knowledge_graph.value)
+            path_engines[knowledge_graph] = PathEngine.load(directory) if os.path.exists(os.path.join(directory, "meta.json")) else None
+        return path_engines[knowledge_graph]
+
+
+# ---------------------------------
+# ----- Build the graph files -----
+# ---------------------------------
+
+_NTRIPLE = re.compile(r'^<([^>]+)>\s+<([^>]+)>\s+<([^>]+)>\s*\.\s*$')
+
+def read_ntriples(filepaths: list):
+    for filepath in filepaths:
+        with open(filepath, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                match = _NTRIPLE.match(line)
+                if match is not None:
+                    yield match.group(1), match.group(2), match.group(3)
+
+def read_endpoint(endpoint: str, page_size: int):
+    """
+    Page through the IRI-to-IRI triples of an endpoint, for the small knowledge graphs that have no dump.
+    """
+    offset = 0
+    while True:
+        query = f"SELECT ?s ?p ?o WHERE {{ ?s ?p ?o . FILTER (isIRI(?s) && isIRI(?o)) }} ORDER BY ?s ?p ?o LIMIT {page_size} OFFSET {offset}"
+        bindings = execute_sparql_query(query, endpoint).convert()["results"]["bindings"]
+        for binding in bindings:
+            yield binding["s"]["value"], binding["p"]["value"], binding["o"]["value"]
+        if len(bindings) < page_size:
+            return
+        offset += page_size
+        print(f"{offset} triples...", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the compressed adjacency graph of the in-process path engine.")
+    parser.add_argument("--knowledge_graph", type=str, required=True, help="KnowledgeGraph value, e.g., Beastiary_KG or Elections_KG")
+    parser.add_argument("--input", type=str, nargs="*", default=[], help="N-Triples dumps, the endpoint of the knowledge graph is paged when omitted")
+    parser.add_argument("--include_predicates", type=str, nargs="*", default=None, help="Keep only these predicates (projection)")
+    parser.add_argument("--exclude_predicates", type=str, nargs="*", default=[], help="Drop these predicates (projection)")
+    parser.add_argument("--page_size", type=int, default=100000, help="Triples per request when paging the endpoint")
+    args = parser.parse_args()
+
+    knowledge_graph = KnowledgeGraph(args.knowledge_graph)
+    triples = read_ntriples(args.input) if args.input else read_endpoint(KnowledgeGraph.get_endpoint(knowledge_graph), args.page_size)
+    include, exclude = set(args.include_predicates) if args.include_predicates else None, set(args.exclude_predicates)
+    triples = ((s, p, o) for s, p, o in triples if (include is None or p in include) and p not in exclude)
+
+    engine = PathEngine.from_triples(triples)
+    directory = get_relative_path(PATH_ENGINE_DIR + knowledge_graph.value)
+    engine.save(directory)
+    print(f"{len(engine.nodes)} nodes, {len(engine.out_targets)} edges, {len(engine.predicates)} predicates written to {directory}")
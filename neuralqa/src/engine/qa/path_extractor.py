@@ -1,10 +1,17 @@
 import time
 import re
+import math
+import random
+import threading
 import traceback
 
 from src.logging import log, LogComponent, LoggingOptions, LogType, Colors, LogLevel, create_logger
-from src.datasets.dataset import KnowledgeGraph, uri_to_uril, uril_to_uri, triples_with_urils_to_triples_with_uris, triples_with_uris_to_triples_with_urils, urils_to_uris, uril_to_uri_map
-from src.utils import SupportedLLMs, embed, execute_sparql_query, get_kgaqa_tracker, llm_call, is_entity_placeholder, is_property_description, is_type_predicate, is_uri
+from src.datasets.dataset import KnowledgeGraph, prefetch_labels, uri_to_uril, uris_to_urils, uril_to_uri, triples_with_urils_to_triples_with_uris, triples_with_uris_to_triples_with_urils, urils_to_uris, uril_to_uri_map
+from src.utils import SupportedLLMs, answer_marker_stop, embed, execute_sparql_query, get_kgaqa_tracker, llm_batch_call, llm_call, run_concurrently, is_entity_placeholder, is_property_description, is_type_predicate, is_uri
+from src.engine.qa.schema_index import get_schema_index
+from src.engine.qa.class_statistics import get_class_statistics
+from src.engine.qa.path_engine import get_path_engine
+from src.triple_store import TripleStore
 import jellyfish
 import traceback
 
@@ -180,6 +187,85 @@ is_entity_index = {}
 path_to_triples_index = {}
 ENDPOINT = ""
 KNOWLEDGE_GRAPH = ""
+BATCH_VALIDATION = True         # validate the direction variants of many property paths with a single UNION query
+VALIDATION_BATCH_SIZE = 64      # max number of variants (UNION branches) per validation query
+GROUNDING_CONCURRENCY = 8       # max concurrent grounding requests per endpoint, 1 disables the thread pool
+EXPLORATION_CONCURRENCY = 8     # max concurrent predicate selection prompts of a neighborhood search level
+USE_PATH_ENGINE = True          # search paths with the in-process path engine when its graph was generated, GraphDB path:search otherwise
+USE_CLASS_STATISTICS = True     # read the predicates of large classes from the materialized class statistics
+USE_SCHEMA_INDEX = True         # answer is_class/is_entity from the local schema index, SPARQL only when it cannot decide
+POPULARITY_EXACT = "exact"                  # COUNT(*) over every instance/triple
+POPULARITY_APPROXIMATE = "approximate"      # COUNT over a bounded random sample, extrapolated to the population
+POPULARITY_MODE = POPULARITY_EXACT          # default popularity mode of PathExtractor instances
+POPULARITY_SAMPLE_SIZE = 1000   # instances (classes) or triples per direction (entities) sampled in approximate mode
+POPULARITY_SAMPLE_TIMEOUT = 30  # read timeout (seconds) of the sampling queries, caps the cost of a single node
+POPULARITY_SAMPLE_BLOCKS = 10   # the sample is read as this many LIMIT blocks at random offsets, one per stratum of the population
+STREAM_EARLY_STOP = True        # stream the grounding/inclusion answers and stop generating once the answer is complete
+
+GROUNDING_ANSWER_COMPLETE = answer_marker_stop("FINAL ANSWER", r"\{\s*\d+\s*\}", 3)        # top-3 groundings
+INCLUSION_ANSWER_COMPLETE = answer_marker_stop("FINAL ANSWER", r"\{\s*(?:YES|NO)\s*\}", 1)
+
+
+# Optional local triple store (see tools/triple-store-generator), answers the single triple pattern lookups without the endpoint
+TRIPLE_STORE = None
+
+def open_triple_store(directory: str):
+    """
+    Use the triple store in `directory` for the single pattern lookups of PathExtractor.
+    The store must hold the whole knowledge graph, its answers are not checked against the endpoint.
+    """
+    global TRIPLE_STORE
+    TRIPLE_STORE = TripleStore(directory)
+    log(f"Using triple store {directory} ({len(TRIPLE_STORE)} triples)", LogComponent.PATH_EXTRACTOR, LogLevel.INFO)
+    return TRIPLE_STORE
+
+
+endpoint_semaphores = {}
+_endpoint_semaphores_lock = threading.Lock()
+
+def get_endpoint_semaphore(endpoint: str):
+    with _endpoint_semaphores_lock:
+        if endpoint not in endpoint_semaphores:
+            endpoint_semaphores[endpoint] = threading.BoundedSemaphore(GROUNDING_CONCURRENCY)
+        return endpoint_semaphores[endpoint]
+
+
+def extrapolate_counts(sums: dict, squares: dict, sample_size: int, population: int):
+    """
+    Extrapolate per-predicate totals from a sample of `sample_size` units (instances or triples) out of `population`.
+    :param sums: predicate -> sum of the per-unit counts over the sample
+    :param squares: predicate -> sum of the squared per-unit counts over the sample
+    :return: predicate -> (estimate, margin), the margin is the half-width of the 95% confidence interval
+    """
+    scale = population / sample_size
+    finite_population_correction = math.sqrt(max(0.0, 1 - sample_size / population))
+    estimates = {}
+    for predicate, total in sums.items():
+        mean = total / sample_size
+        variance = max(0.0, squares[predicate] / sample_size - mean ** 2)
+        margin = 1.96 * population * math.sqrt(variance / sample_size) * finite_population_correction
+        estimates[predicate] = (round(total * scale), round(margin))
+    return estimates
+
+
+def sample_blocks(variable: str, pattern: str, population: int, sample_size: int, seed: str):
+    """
+    Group pattern binding `variable` to a stratified sample of the solutions of `pattern`: the population is split
+    in POPULARITY_SAMPLE_BLOCKS strata and a block of consecutive solutions (OFFSET/LIMIT, no ORDER BY) is read at a
+    random offset of every stratum. Unlike ORDER BY RAND() the endpoint only scans up to the last offset and never
+    sorts the whole population. The offsets are drawn from `seed`, so the query of a node is the same in every run
+    (SPARQL cache, replay).
+    :return: the group pattern and the number of sampled solutions
+    """
+    blocks = max(1, min(POPULARITY_SAMPLE_BLOCKS, sample_size))
+    block_size = sample_size // blocks
+    stratum = population // blocks
+    rng = random.Random(seed)
+    subqueries = []
+    for i in range(blocks):
+        offset = i * stratum + rng.randint(0, max(0, stratum - block_size))
+        subqueries.append(f"{{ SELECT {variable} WHERE {{ {pattern} }} OFFSET {offset} LIMIT {block_size} }}")
+    return "{ " + " UNION ".join(subqueries) + " }", blocks * block_size
 
 
 from anytree import Node, RenderTree
@@ -193,8 +279,7 @@ class TreeNode:
         self.values = values
         if isinstance(values, List):
             if is_uri(values[0]):
-                for i in range(len(values)):
-                    self.values[i] = uri_to_uril(values[i], kg)
+                self.values = uris_to_urils(values, kg)
                 self.type = "URI"
             else:
                 self.type = "LITERAL"
@@ -230,8 +315,14 @@ def get_leafs(node: Node):
 
 class PathExtractor():
 
-    def __init__(self, knowledge_graph: KnowledgeGraph, model_id_main: SupportedLLMs = SupportedLLMs.VLLM, model_id_explore: SupportedLLMs = SupportedLLMs.VLLM) -> None:
+    def __init__(self, knowledge_graph: KnowledgeGraph, model_id_main: SupportedLLMs = SupportedLLMs.VLLM, model_id_explore: SupportedLLMs = SupportedLLMs.VLLM,
+                 popularity_mode: str = POPULARITY_MODE, popularity_sample_size: int = POPULARITY_SAMPLE_SIZE) -> None:
         super().__init__()
+        if popularity_mode not in (POPULARITY_EXACT, POPULARITY_APPROXIMATE):
+            raise ValueError(f"Unknown popularity mode: {popularity_mode}")
+        self.popularity_mode = popularity_mode
+        self.popularity_sample_size = popularity_sample_size
+        self.popularity_margins = {}    # node -> {predicate: margin} of the approximate popularities
         self.model_id_main = model_id_main
         self.model_id_explore = model_id_explore
         self.knowledge_graph = knowledge_graph
@@ -241,7 +332,23 @@ class PathExtractor():
         global KNOWLEDGE_GRAPH
         KNOWLEDGE_GRAPH = self.knowledge_graph
         self.ontology_endpoint = KnowledgeGraph.get_ontology_endpoint(self.knowledge_graph)
-        self.tracker = get_kgaqa_tracker()
+        self._schema_index = None
+    
+    @property
+    def schema_index(self):
+        # loaded lazily, most runs never need it when the nodes are already in the is_class/is_entity indices
+        if self._schema_index is None:
+            self._schema_index = get_schema_index(self.knowledge_graph)
+        return self._schema_index
+    
+    @property
+    def path_engine(self):
+        return get_path_engine(self.knowledge_graph) if USE_PATH_ENGINE else None
+    
+    @property
+    def tracker(self):
+        # resolved on every access, questions processed concurrently have their own trackers
+        return get_kgaqa_tracker()
         
     # --------------------------
     # ----- SPARQL Queries -----
@@ -253,6 +360,12 @@ class PathExtractor():
         og_node = node
         if node not in is_class_index:
             node = uril_to_uri(node)
+            local_answer = self.schema_index.is_class(node.strip("<>")) if USE_SCHEMA_INDEX else None
+            if local_answer is not None:
+                self.tracker._pe_schema_index_hits += 1
+                is_class_index[og_node] = local_answer
+                return local_answer
+            self.tracker._pe_schema_index_misses += 1
             if self.knowledge_graph == KnowledgeGraph.WIKIDATA:
                 query = f"""
                 ASK WHERE {{ 
@@ -283,6 +396,12 @@ class PathExtractor():
             if self.is_class(node):
                 return False
             node = uril_to_uri(node)
+            local_answer = self.schema_index.is_node(node.strip("<>")) if USE_SCHEMA_INDEX else None
+            if local_answer is not None:
+                self.tracker._pe_schema_index_hits += 1
+                is_entity_index[og_node] = local_answer
+                return local_answer
+            self.tracker._pe_schema_index_misses += 1
             query = f"""
             ASK WHERE {{ 
                 {{
@@ -304,8 +423,16 @@ class PathExtractor():
                 is_entity_index[og_node] = False
         return is_entity_index[og_node]
     
+    def _type_predicate(self):
+        if self.knowledge_graph == KnowledgeGraph.WIKIDATA:
+            return "http://www.wikidata.org/prop/direct/P31"
+        return "http://www.w3.org/1999/02/22-rdf-syntax-ns#type"
+    
     def get_types_for_node(self, node: str):
         node = uril_to_uri(node)
+        if TRIPLE_STORE is not None:
+            self.tracker._pe_triple_store_lookups += 1
+            return [uri_to_uril(type, self.knowledge_graph) for type in TRIPLE_STORE.objects(node, self._type_predicate())]
         if self.knowledge_graph == KnowledgeGraph.WIKIDATA:
             query = f"""
             SELECT ?type
@@ -342,6 +469,13 @@ class PathExtractor():
         
         from_node = uril_to_uri(from_node)
         to_node = uril_to_uri(to_node)
+        if self.path_engine is not None:
+            self.tracker._pe_path_engine_searches += 1
+            paths, popularity = self.path_engine.all_paths(from_node.strip("<>"), to_node.strip("<>"), depth_limit, bidirectional == "true")
+            log(f"Found {len(paths)} paths with the path engine (all paths)", LogComponent.PATH_EXTRACTOR, LogLevel.DEBUG)
+            paths = [" -> ".join(uri_to_uril(uri, self.knowledge_graph) for uri in path.split(" -> ")) for path in paths]
+            self.tracker._pe_all_paths_time += time.time() - start_time
+            return paths, popularity
         query = f"""
         PREFIX path: <http://www.ontotext.com/path#>
 
@@ -408,6 +542,13 @@ class PathExtractor():
         
         from_node = uril_to_uri(from_node)
         to_node = uril_to_uri(to_node)
+        if self.path_engine is not None:
+            self.tracker._pe_path_engine_searches += 1
+            paths, popularity = self.path_engine.shortest_paths(from_node.strip("<>"), to_node.strip("<>"), bidirectional == "true")
+            log(f"Found {len(paths)} paths with the path engine (shortest paths)", LogComponent.PATH_EXTRACTOR, LogLevel.DEBUG)
+            paths = [" -> ".join(uri_to_uril(uri, self.knowledge_graph) for uri in path.split(" -> ")) for path in paths]
+            self.tracker._pe_shortest_path_time += time.time() - start_time
+            return paths, popularity
         query = f"""
         PREFIX path: <http://www.ontotext.com/path#>
         PREFIX xsd: <http://www.w3.org/2001/XMLSchema#>
@@ -470,6 +611,20 @@ class PathExtractor():
     
     def get_distinct_predicates_for_class(self, node: str, debug=False, filter_literals=False):
         node = uril_to_uri(node)
+        # the live Wikidata aggregation keeps the literal objects, the statistics and the sampling must match it
+        filter_literals = filter_literals and self.knowledge_graph != KnowledgeGraph.WIKIDATA
+        statistics = get_class_statistics(self.knowledge_graph) if USE_CLASS_STATISTICS else None
+        materialized = statistics.get(node.strip("<>"), filter_literals=filter_literals) if statistics is not None else None
+        if materialized is not None:
+            self.tracker._pe_class_statistics_hits += 1
+            predicates, popularity = materialized
+            return [uri_to_uril(predicate, self.knowledge_graph) for predicate in predicates], popularity
+        self.tracker._pe_class_statistics_misses += 1
+        if self.popularity_mode == POPULARITY_APPROXIMATE:
+            approximate = self._approximate_predicates_for_class(node, filter_literals)
+            if approximate is not None:
+                return approximate
+        self.tracker._pe_popularity_exact += 1
         if self.knowledge_graph != KnowledgeGraph.WIKIDATA:
             if not filter_literals:
                 query = f"""
@@ -542,6 +697,15 @@ class PathExtractor():
     
     def get_distinct_predicates_for_entity(self, node: str, debug=False, filter_literals=False):
         node = uril_to_uri(node)
+        if TRIPLE_STORE is not None:
+            self.tracker._pe_triple_store_lookups += 1
+            ranked = TRIPLE_STORE.predicate_counts(node, filter_literals=filter_literals).most_common()
+            return [uri_to_uril(predicate, self.knowledge_graph) for predicate, _ in ranked], [count for _, count in ranked]
+        if self.popularity_mode == POPULARITY_APPROXIMATE:
+            approximate = self._approximate_predicates_for_entity(node, filter_literals)
+            if approximate is not None:
+                return approximate
+        self.tracker._pe_popularity_exact += 1
         if not filter_literals:
             query = f"""
             SELECT ?p (COUNT(*) AS ?count)
@@ -593,9 +757,139 @@ class PathExtractor():
         predicates = [uri_to_uril(predicate, self.knowledge_graph) for predicate in predicates]
         return predicates, popularity
     
+    # ----------------------------------
+    # ----- Approximate popularity -----
+    # ----------------------------------
+    
+    def _count(self, query: str):
+        results = execute_sparql_query(query, self.endpoint, timeout=POPULARITY_SAMPLE_TIMEOUT).convert()
+        return {variable: int(value["value"]) for variable, value in results["results"]["bindings"][0].items()}
+    
+    def _ranked_estimates(self, node: str, estimates: dict):
+        ranked = sorted(estimates.items(), key=lambda item: item[1][0], reverse=True)
+        predicates = [uri_to_uril(predicate, self.knowledge_graph) for predicate, _ in ranked]
+        self.popularity_margins[node] = {predicate: margin for predicate, (_, (_, margin)) in zip(predicates, ranked)}
+        return predicates, [estimate for _, (estimate, _) in ranked]
+    
+    def _approximate_predicates_for_class(self, node: str, filter_literals: bool):
+        """
+        Popularity of the predicates of the instances of a class, extrapolated from a stratified random sample of its instances
+        (see sample_blocks).
+        None when the class has no more instances than the sample (the exact aggregation is as cheap) or when the
+        sampling fails, the caller then runs the exact aggregation.
+        """
+        type_predicate = "<http://www.wikidata.org/prop/direct/P31>" if self.knowledge_graph == KnowledgeGraph.WIKIDATA else "a"
+        literal_filter = "FILTER (!isLiteral(?o))" if filter_literals else ""
+        try:
+            population = self._count(f"SELECT (COUNT(*) AS ?n) WHERE {{ ?s {type_predicate} {node} . }}")["n"]
+            if population <= self.popularity_sample_size:
+                return None
+            instances, sample_size = sample_blocks("?s", f"?s {type_predicate} {node} .", population, self.popularity_sample_size, node)
+            query = f"""
+            SELECT ?p (SUM(?c) AS ?sum) (SUM(?c * ?c) AS ?squares)
+            WHERE {{
+                {{
+                    SELECT ?s ?p (COUNT(*) AS ?c)
+                    WHERE {{
+                        {instances}
+                        {{
+                            ?s ?p ?o .
+                            {literal_filter}
+                        }}
+                        UNION
+                        {{
+                            ?x ?p ?s .
+                        }}
+                    }}
+                    GROUP BY ?s ?p
+                }}
+            }}
+            GROUP BY ?p
+            """
+            results = execute_sparql_query(query, self.endpoint, timeout=POPULARITY_SAMPLE_TIMEOUT).convert()
+        except Exception as e:
+            log(f"Error _approximate_predicates_for_class: {e}", LogComponent.PATH_EXTRACTOR, LogLevel.ERROR)
+            return None
+        self.tracker._pe_popularity_approximate += 1
+        
+        sums, squares = {}, {}
+        for result in results["results"]["bindings"]:
+            sums[result["p"]["value"]] = int(result["sum"]["value"])
+            squares[result["p"]["value"]] = int(result["squares"]["value"])
+        estimates = extrapolate_counts(sums, squares, sample_size, population)
+        log(f"approximate predicates for class {node}: {len(estimates)} predicates from {sample_size}/{population} instances", LogComponent.PATH_EXTRACTOR, LogLevel.DEBUG)
+        return self._ranked_estimates(node, estimates)
+    
+    def _approximate_predicates_for_entity(self, node: str, filter_literals: bool):
+        """
+        Popularity of the predicates of an entity. The predicates are listed exactly, only their counts are extrapolated
+        from a stratified random sample of the triples of each direction (see sample_blocks).
+        None when no direction has more triples than the sample (the exact aggregation is as cheap) or when the
+        sampling fails, the caller then runs the exact aggregation.
+        """
+        literal_filter = "FILTER (!isLiteral(?o))" if filter_literals else ""
+        directions = {
+            "outgoing": f"{node} ?p ?o . {literal_filter}",
+            "incoming": f"?s ?p {node} .",
+        }
+        try:
+            populations = self._count(f"""
+            SELECT ?outgoing ?incoming
+            WHERE {{
+                {{ SELECT (COUNT(*) AS ?outgoing) WHERE {{ {directions["outgoing"]} }} }}
+                {{ SELECT (COUNT(*) AS ?incoming) WHERE {{ {directions["incoming"]} }} }}
+            }}
+            """)
+            if max(populations.values()) <= self.popularity_sample_size:
+                return None
+            estimates = {}
+            for direction, pattern in directions.items():
+                population = populations[direction]
+                if population == 0:
+                    continue
+                if population <= self.popularity_sample_size:
+                    triples, sample_size = f"{{ {pattern} }}", population
+                else:
+                    triples, sample_size = sample_blocks("?p", pattern, population, self.popularity_sample_size, f"{node} {direction}")
+                query = f"""
+                SELECT ?p (COUNT(*) AS ?count)
+                WHERE {{
+                    {triples}
+                }}
+                GROUP BY ?p
+                """
+                results = execute_sparql_query(query, self.endpoint, timeout=POPULARITY_SAMPLE_TIMEOUT).convert()
+                # every sampled triple counts once, so the sum of squares equals the sum
+                counts = {result["p"]["value"]: int(result["count"]["value"]) for result in results["results"]["bindings"]}
+                if sample_size < population:
+                    # predicates missed by the sample still exist, they are listed exactly and counted at least once
+                    results = execute_sparql_query(f"SELECT DISTINCT ?p WHERE {{ {pattern} }}", self.endpoint, timeout=POPULARITY_SAMPLE_TIMEOUT).convert()
+                    for result in results["results"]["bindings"]:
+                        counts.setdefault(result["p"]["value"], 0)
+                for predicate, (estimate, margin) in extrapolate_counts(counts, counts, sample_size, population).items():
+                    previous_estimate, previous_margin = estimates.get(predicate, (0, 0))
+                    estimates[predicate] = (previous_estimate + max(estimate, 1), round(math.hypot(previous_margin, margin)))
+        except Exception as e:
+            log(f"Error _approximate_predicates_for_entity: {e}", LogComponent.PATH_EXTRACTOR, LogLevel.ERROR)
+            return None
+        self.tracker._pe_popularity_approximate += 1
+        log(f"approximate predicates for entity {node}: {len(estimates)} predicates from {populations}", LogComponent.PATH_EXTRACTOR, LogLevel.DEBUG)
+        return self._ranked_estimates(node, estimates)
+    
     def get_object_for_subject_predicate(self, subject: str, predicate: str, limit=1, debug=False, cls=False):
         subject = uril_to_uri(subject)
         predicate = uril_to_uri(predicate)
+        if TRIPLE_STORE is not None:
+            self.tracker._pe_triple_store_lookups += 1
+            if cls == False:
+                objects = TRIPLE_STORE.objects(subject, predicate, limit)
+            else:
+                objects = []
+                for instance in TRIPLE_STORE.iter_subjects(self._type_predicate(), subject):
+                    objects.extend(TRIPLE_STORE.iter_objects(instance, predicate, limit - len(objects)))
+                    if len(objects) >= limit:
+                        break
+            return [uri_to_uril(object, self.knowledge_graph) for object in objects]
         if cls == False:
             query = f"""
             SELECT ?o
@@ -643,6 +937,17 @@ class PathExtractor():
     def get_subject_from_predicate_object(self, predicate: str, object: str, limit=1, debug=False, cls=False):
         object = uril_to_uri(object)
         predicate = uril_to_uri(predicate)
+        if TRIPLE_STORE is not None:
+            self.tracker._pe_triple_store_lookups += 1
+            if cls == False:
+                subjects = TRIPLE_STORE.subjects(predicate, object, limit)
+            else:
+                subjects = []
+                for instance in TRIPLE_STORE.iter_subjects(self._type_predicate(), object):
+                    subjects.extend(TRIPLE_STORE.iter_subjects(predicate, instance, limit - len(subjects)))
+                    if len(subjects) >= limit:
+                        break
+            return [uri_to_uril(subject, self.knowledge_graph) for subject in subjects]
         if cls == False:
             query = f"""
             SELECT ?s
@@ -767,7 +1072,7 @@ class PathExtractor():
             get_kgaqa_tracker()._pe_prompt_inclusion_calls += 1
             start_time2 = time.time()
         
-            generated = llm_call(self.model_id_main, prompt, 1024)
+            generated = llm_call(self.model_id_main, prompt, 1024, stop_when=INCLUSION_ANSWER_COMPLETE if STREAM_EARLY_STOP else None)
             log(f"LLM response for decide inclusion: {generated}", LogComponent.PATH_EXTRACTOR, LogLevel.DEBUG, LogType.LLM_RESULT)
             
             get_kgaqa_tracker()._pe_prompt_inclusion_time += time.time() - start_time2
@@ -790,9 +1095,43 @@ class PathExtractor():
         get_kgaqa_tracker()._pe_graph_search_time += time.time() - start_time
         return paths, paths_popularity
     
+    def _prompt_select_predicates_for_node(self, question: str, start, target: str, value_readable: str, predicates: List[str], popularity: dict):
+        # this will be used to select the most relevant predicates
+        predicates_popularity = "\n".join([f"{p} - {popularity[p]}" for p in predicates])
+        
+        prompt = f"""
+        You are exploring a knowledge graph to find a connection between two concepts in the context of the question: "{question}".
+
+        - Initial node: "{start}"
+        - Current node: "{value_readable}"
+        - Goal: "{target}"
+        
+        Your task is to select the **three most relevant predicates** from the list below that are most likely to lead from the start node toward the goal concept. These predicates represent the known relationships starting from "{value_readable}", but they do not yet have expanded values.
+
+        The structure below shows the current node and its predicates, along with how popular each predicate is in the graph (higher count = more commonly used).
+
+        Choose the 3 predicates that seem most promising for discovering information about the goal: **"{target}"**
+
+        Predicates - Popularity:
+        {predicates_popularity}
+
+        Respond with only the URIs of the 3 selected predicates, one per line.
+        Do not include explanations or extra text.
+        
+        Answer:
+        """
+        log(f"Prompt for selecting predicates: {prompt}", LogComponent.PATH_EXTRACTOR, LogLevel.DEBUG, LogType.PROMPT)
+        return prompt
+    
     def get_paths_by_neighborhood_search(self, question: str, start, target: str, initial_depth=2, to_uri=False):
+        """
+        Explore the neighborhood of `start` for `initial_depth` levels, the LLM picks the predicates to follow.
+        The tree is expanded level by level: all the frontier nodes of a level are processed together, first their
+        predicates are fetched, then their predicate selection prompts are sent concurrently, then the values of all
+        the selected predicates are fetched. So the exploration costs O(depth) waves of LLM calls instead of O(frontier).
+        """
         get_kgaqa_tracker()._pe_neighborhood_calls += 1
-        start_time = time.time()
+        search_start_time = time.time()
         
         total_graph = 0
         total_llm = 0
@@ -812,6 +1151,11 @@ class PathExtractor():
         while depth > 0:
             leafs = get_leafs(root)
             # print(f"The depth is: {depth}")
+            
+            #
+            # Collect the frontier, i.e., the URI values of all the leafs
+            #
+            frontier = []   # (leaf, value_readable, value_graph)
             for leaf in leafs:
                 tree_node = leaf.name
                 if tree_node.type == "LITERAL":
@@ -825,102 +1169,97 @@ class PathExtractor():
                         if value_graph[0] != "<" or value_graph[-1] != ">":
                             value_graph = "<" + value_graph + ">"
                         if (self.is_class(value_graph)) and not is_class:
-                            is_class = False
                             continue
-
-                        # For the values URIs get predicates and their popularity
-                        start_time = time.time()
-                        predicates_and_popularity = self.get_predicates_and_popularity_for_node(value_graph, filter_literals=to_uri)
-                        if len(predicates_and_popularity) == 0:
-                            log(f"No predicates found for {value_readable}", LogComponent.PATH_EXTRACTOR, LogLevel.WARNING)
-                            continue
-                        predicates, popularity = predicates_and_popularity
-                        
-                        for p in predicates:
-                            log(f"Predicate: {p} - Popularity: {popularity[p]}", LogComponent.PATH_EXTRACTOR, LogLevel.DEBUG)
-                        total_graph += time.time() - start_time
-                        
-                        # avoid reusing the same paths
-                        filtered_predicates = []
-                        for p in predicates:
-                            if tree_node.predicate_from == p:
-                                continue
-                            ancestors = leaf.ancestors
-                            if any(ancestor.name.predicate_from == p for ancestor in ancestors):
-                                continue
-                            filtered_predicates.append(p)
-                        if len(filtered_predicates) == 0:
-                            log(f"No predicates left after filtering for {value_readable}", LogComponent.PATH_EXTRACTOR, LogLevel.WARNING)
-                            continue                       
-                        predicates = filtered_predicates
-                        
-                        # this will be used to select the most relevant predicates
-                        predicates_popularity = "\n".join([f"{p} - {popularity[p]}" for p in predicates])
-                        
-                        prompt = f"""
-                        You are exploring a knowledge graph to find a connection between two concepts in the context of the question: "{question}".
-
-                        - Initial node: "{start}"
-                        - Current node: "{value_readable}"
-                        - Goal: "{target}"
-                        
-                        Your task is to select the **three most relevant predicates** from the list below that are most likely to lead from the start node toward the goal concept. These predicates represent the known relationships starting from "{value_readable}", but they do not yet have expanded values.
-
-                        The structure below shows the current node and its predicates, along with how popular each predicate is in the graph (higher count = more commonly used).
-
-                        Choose the 3 predicates that seem most promising for discovering information about the goal: **"{target}"**
-
-                        Predicates - Popularity:
-                        {predicates_popularity}
-
-                        Respond with only the URIs of the 3 selected predicates, one per line.
-                        Do not include explanations or extra text.
-                        
-                        Answer:
-                        """
-                        log(f"Prompt for selecting predicates: {prompt}", LogComponent.PATH_EXTRACTOR, LogLevel.DEBUG, LogType.PROMPT)
-
-                        # Call the LLM
-                        start_time = time.time()
-                        get_kgaqa_tracker()._pe_prompt_neighborhood_calls += 1
-                        generated = llm_call(self.model_id_explore, prompt, max_tokens=512)
-                        log(f"LLM response for selecting predicates: {generated}", LogComponent.PATH_EXTRACTOR, LogLevel.DEBUG, LogType.LLM_RESULT)
-                        get_kgaqa_tracker()._pe_prompt_neighborhood_time += time.time() - start_time
-                        total_llm += time.time() - start_time
-
-                        selected_predicate_ids = [line.strip() for line in generated.strip().splitlines() if line.strip()]
-                        
-                        log(f"LLM selected predicates: {selected_predicate_ids}", LogComponent.PATH_EXTRACTOR, LogLevel.DEBUG, LogType.HEADER)
-                        for predicate_id in selected_predicate_ids:
-                            log(f"Selected predicate: {predicate_id}", LogComponent.PATH_EXTRACTOR, LogLevel.DEBUG)
-                    
-                        # get values for the selected predicates
-                        for predicate_id in selected_predicate_ids:                        
-                            log(f"Getting values for predicate {predicate_id}", LogComponent.PATH_EXTRACTOR, LogLevel.DEBUG, LogType.HEADER)
-                            
-                            # Get values for the predicate (both object and subject direction)
-                            values = self.get_object_for_subject_predicate(value_graph, predicate_id, limit=3, cls=is_class, debug=False)
-                            values += self.get_subject_from_predicate_object(predicate_id, value_graph, limit=3, cls=is_class, debug=False)
-
-                            if len(values) == 0:
-                                log(f"No values found for predicate {predicate_id}", LogComponent.PATH_EXTRACTOR, LogLevel.ERROR)
-                                continue
-                            if isinstance(start, str) and start in values[0]:
-                                continue
-                            elif isinstance(start, list) and any(s in values[0] for s in start):
-                                continue
-                            
-                            values = urils_to_uris(values)
-                            
-                            # Create a new tree node for the values
-                            if predicate_id in popularity:
-                                new_tree_node = TreeNode(predicate_id, values, popularity[predicate_id], KNOWLEDGE_GRAPH)
-                            else:
-                                new_tree_node = TreeNode(predicate_id, values, 0, KNOWLEDGE_GRAPH)
-                            new_node = Node(new_tree_node, parent=leaf)
-                        
-                        for pre, _, node in RenderTree(root):
-                            log(f"{pre}{node.name}", LogComponent.PATH_EXTRACTOR, LogLevel.DEBUG)
+                        frontier.append((leaf, value_readable, value_graph))
+            if len(frontier) == 0:
+                break
+            
+            # For the values URIs get predicates and their popularity
+            start_time = time.time()
+            all_predicates_and_popularity = run_concurrently(lambda node: self.get_predicates_and_popularity_for_node(node[2], filter_literals=to_uri), frontier,
+                                                             GROUNDING_CONCURRENCY, get_endpoint_semaphore(self.endpoint))
+            total_graph += time.time() - start_time
+            
+            selection_requests = []   # (leaf, value_readable, value_graph, predicates, popularity)
+            for (leaf, value_readable, value_graph), predicates_and_popularity in zip(frontier, all_predicates_and_popularity):
+                if len(predicates_and_popularity) == 0:
+                    log(f"No predicates found for {value_readable}", LogComponent.PATH_EXTRACTOR, LogLevel.WARNING)
+                    continue
+                predicates, popularity = predicates_and_popularity
+                
+                for p in predicates:
+                    log(f"Predicate: {p} - Popularity: {popularity[p]}", LogComponent.PATH_EXTRACTOR, LogLevel.DEBUG)
+                
+                # avoid reusing the same paths
+                filtered_predicates = []
+                for p in predicates:
+                    if leaf.name.predicate_from == p:
+                        continue
+                    ancestors = leaf.ancestors
+                    if any(ancestor.name.predicate_from == p for ancestor in ancestors):
+                        continue
+                    filtered_predicates.append(p)
+                if len(filtered_predicates) == 0:
+                    log(f"No predicates left after filtering for {value_readable}", LogComponent.PATH_EXTRACTOR, LogLevel.WARNING)
+                    continue
+                selection_requests.append((leaf, value_readable, value_graph, filtered_predicates, popularity))
+            if len(selection_requests) == 0:
+                break
+            
+            # The LLM selects the predicates of every frontier node, one batch of concurrent prompts per level
+            prompts = [self._prompt_select_predicates_for_node(question, start, target, request[1], request[3], request[4]) for request in selection_requests]
+            start_time = time.time()
+            get_kgaqa_tracker()._pe_neighborhood_waves += 1
+            get_kgaqa_tracker()._pe_prompt_neighborhood_calls += len(prompts)
+            all_generated = llm_batch_call(self.model_id_explore, prompts, max_tokens=512, max_in_flight=EXPLORATION_CONCURRENCY)
+            get_kgaqa_tracker()._pe_prompt_neighborhood_time += time.time() - start_time
+            total_llm += time.time() - start_time
+            
+            # get values for the selected predicates (both object and subject direction)
+            expansions = []   # (request index, predicate_id)
+            for request_idx, generated in enumerate(all_generated):
+                log(f"LLM response for selecting predicates: {generated}", LogComponent.PATH_EXTRACTOR, LogLevel.DEBUG, LogType.LLM_RESULT)
+                if generated is None:
+                    continue
+                selected_predicate_ids = [line.strip() for line in generated.strip().splitlines() if line.strip()]
+                log(f"LLM selected predicates for {selection_requests[request_idx][1]}: {selected_predicate_ids}", LogComponent.PATH_EXTRACTOR, LogLevel.DEBUG, LogType.HEADER)
+                for predicate_id in selected_predicate_ids:
+                    log(f"Selected predicate: {predicate_id}", LogComponent.PATH_EXTRACTOR, LogLevel.DEBUG)
+                    expansions.append((request_idx, predicate_id))
+            
+            def get_values(expansion):
+                value_graph, predicate_id = selection_requests[expansion[0]][2], expansion[1]
+                log(f"Getting values for predicate {predicate_id}", LogComponent.PATH_EXTRACTOR, LogLevel.DEBUG, LogType.HEADER)
+                values = self.get_object_for_subject_predicate(value_graph, predicate_id, limit=3, cls=is_class, debug=False)
+                values += self.get_subject_from_predicate_object(predicate_id, value_graph, limit=3, cls=is_class, debug=False)
+                return values
+            
+            start_time = time.time()
+            all_values = run_concurrently(get_values, expansions, GROUNDING_CONCURRENCY, get_endpoint_semaphore(self.endpoint))
+            total_graph += time.time() - start_time
+            
+            # expand the tree, in the order of the frontier
+            for (request_idx, predicate_id), values in zip(expansions, all_values):
+                leaf, popularity = selection_requests[request_idx][0], selection_requests[request_idx][4]
+                if len(values) == 0:
+                    log(f"No values found for predicate {predicate_id}", LogComponent.PATH_EXTRACTOR, LogLevel.ERROR)
+                    continue
+                if isinstance(start, str) and start in values[0]:
+                    continue
+                elif isinstance(start, list) and any(s in values[0] for s in start):
+                    continue
+                
+                values = urils_to_uris(values)
+                
+                # Create a new tree node for the values
+                if predicate_id in popularity:
+                    new_tree_node = TreeNode(predicate_id, values, popularity[predicate_id], KNOWLEDGE_GRAPH)
+                else:
+                    new_tree_node = TreeNode(predicate_id, values, 0, KNOWLEDGE_GRAPH)
+                new_node = Node(new_tree_node, parent=leaf)
+            
+            for pre, _, node in RenderTree(root):
+                log(f"{pre}{node.name}", LogComponent.PATH_EXTRACTOR, LogLevel.DEBUG)
                         
             depth -= 1
             is_class = False
@@ -956,7 +1295,7 @@ class PathExtractor():
         log(f"Time taken to get predicates and popularity: {total_graph:.2f} seconds", LogComponent.PATH_EXTRACTOR, LogLevel.DEBUG)
         log(f"Time taken to get selected predicates: {total_llm:.2f} seconds", LogComponent.PATH_EXTRACTOR, LogLevel.DEBUG)
         
-        get_kgaqa_tracker()._pe_neighborhood_time += time.time() - start_time
+        get_kgaqa_tracker()._pe_neighborhood_time += time.time() - search_start_time
         
         return paths, popularities
 
@@ -1145,10 +1484,12 @@ class PathExtractor():
                 break
         return keep
     
-    def replace_types_for_triples(self, triples: str):
-        triples = triples_with_urils_to_triples_with_uris(triples, self.knowledge_graph)
+    def _get_type_variables(self, triples: str):
+        """
+        Variables in object position of a type predicate, i.e., variables that stand for a class.
         
-        # find all variables that are types
+        :param triples: Triples with full URIs, one per line.
+        """
         variables = []
         lines = triples.split("\n")
         for l in lines:
@@ -1158,10 +1499,25 @@ class PathExtractor():
             if is_type_predicate(p):
                 if not o.startswith("<"):
                     variables.append(o)
+        return list(set(variables))
+    
+    def _bind_type_variables(self, triples: str, variables: List[str], binding: dict):
+        """
+        Replace type variables with the URIs they are bound to in a SPARQL JSON result row.
+        """
+        for v in variables:
+            if v[1:] in binding:
+                triples = triples.replace(v, "<" + binding[v[1:]]["value"] + ">")
+        return triples
+    
+    def replace_types_for_triples(self, triples: str):
+        triples = triples_with_urils_to_triples_with_uris(triples, self.knowledge_graph)
+        
+        # find all variables that are types
+        variables = self._get_type_variables(triples)
         if len(variables) == 0:
             triples = triples_with_uris_to_triples_with_urils(triples, self.knowledge_graph)
             return triples
-        variables = list(set(variables))
         
         query = f"""
         SELECT {" ".join(variables)} WHERE {{ 
@@ -1182,86 +1538,206 @@ class PathExtractor():
         
         # replace variables with actual URIs
         for result in results["results"]["bindings"]:
-            for v in variables:
-                if v[1:] in result:
-                    triples = triples.replace(v, "<" + result[v[1:]]["value"] + ">")
+            triples = self._bind_type_variables(triples, variables, result)
         triples = triples_with_uris_to_triples_with_urils(triples, self.knowledge_graph)
         return triples
+    
+    def validate_triples_batch(self, triples_list: List[str]):
+        """
+        Validate many collections of triples with a single SPARQL request.
+        Every collection becomes a `SELECT * ... LIMIT 1` subquery tagged with its index, the subqueries are joined
+        with UNION. A collection is valid if its branch returns a row, the row tells whether the connection binds a
+        literal and provides sample bindings for the type variables. This replaces the are_triples_valid,
+        has_no_value_connection and replace_types_for_triples round trips of each collection.
+        
+        :param triples_list: Collections of triples with URILs, one triple per line.
+        :return: A list with a (valid, binds_literal, triples_with_types_replaced) tuple per collection, or None if the request failed.
+        """
+        if len(triples_list) == 0:
+            return []
+        
+        triples_list_uris = [triples_with_urils_to_triples_with_uris(triples, self.knowledge_graph) for triples in triples_list]
+        branches = []
+        for idx, triples in enumerate(triples_list_uris):
+            branches.append(f"""{{
+                {{ SELECT * WHERE {{ 
+                    {triples}
+                }} LIMIT 1 }}
+                BIND({idx} AS ?pe_variant)
+            }}""")
+        query = f"""
+        SELECT * WHERE {{
+            {" UNION ".join(branches)}
+        }}
+        """
+        log(f"validate_triples_batch: {query}", LogComponent.PATH_EXTRACTOR, LogLevel.DEBUG)
+        
+        try:
+            results = execute_sparql_query(query, self.endpoint).convert()
+        except Exception as e:
+            log(f"Error validate_triples_batch: {e}", LogComponent.PATH_EXTRACTOR, LogLevel.CRITICAL)
+            log(f"Query: {query}", LogComponent.PATH_EXTRACTOR, LogLevel.CRITICAL)
+            return None
+        bindings = {}
+        for result in results["results"]["bindings"]:
+            idx = int(result.pop("pe_variant")["value"])
+            bindings.setdefault(idx, result)
+        
+        validations = []
+        for idx, triples in enumerate(triples_list_uris):
+            if idx not in bindings:
+                validations.append((False, False, None))
+                continue
+            binding = bindings[idx]
+            binds_literal = any(binding[var]["type"] in ("literal", "typed-literal") for var in binding)
+            triples = self._bind_type_variables(triples, self._get_type_variables(triples), binding)
+            validations.append((True, binds_literal, triples_with_uris_to_triples_with_urils(triples, self.knowledge_graph)))
+        return validations
+    
+    def _generate_triples_for_property_path(self, start: str, goal: str, path: str):
+        """
+        Every direction variant of the property path as a collection of triples (2^n for n properties).
         
+        :return: The variants and whether connections through a value (literal) must be discarded.
+        """
+        current = start # "<" + start + ">"
+        triples = [""]
+        var_index = 0
+        properties = path.split(" -> ")
+        check_value_connection = True
+        for idx, p in enumerate(properties):
+            if p == "PROPERTY": # this means that we are searching for a literal, not a node
+                check_value_connection = False
+                break
+            if p == "PLACEHOLDER":
+                break
+            new_triples = []
+            if idx == len(properties) - 1:
+                new_var = goal # "<" + goal + ">"
+            else:
+                new_var = "?var" + str(var_index)
+                var_index += 1
+            for t in triples:
+                if "VALUES" not in current:
+                    new_t_1 = t + current + " <" + p + "> " + new_var + " . \n"
+                    new_t_2 = t + new_var + " <" + p + "> " + current + " . \n"
+                    new_triples.append(new_t_1)
+                    new_triples.append(new_t_2)
+                else:
+                    new_t_1 = t + current + "?vals <" + p + "> " + new_var + " . \n"
+                    new_t_2 = t + current + new_var + " <" + p + ">  ?vals" + " . \n"
+                    new_triples.append(new_t_1)
+                    new_triples.append(new_t_2)
+            current = new_var
+            triples = new_triples
+        return triples, check_value_connection
+    
+    def _validate_triples_one_by_one(self, triples: List[str], check_value_connection: bool):
+        #
+        # Only keep valid collections of triples, i.e., those that have results in the KG
+        #
+        valid_triples = [triple for triple in triples if self.are_triples_valid(triple)]
+        
+        #
+        # Ignore triples that have a value connection
+        #
+        filtered_triples = []
+        for triples_string in valid_triples:
+            if check_value_connection and self.has_no_value_connection(triples_string) == False:
+                continue
+            filtered_triples.append(triples_string)
+        
+        #
+        # In the generated triples, replace variables that represent types/classes with their actual URIs
+        #
+        final_triples = []
+        for triples_string in filtered_triples:
+            final_triples.append(self.replace_types_for_triples(triples_string))
+        return final_triples
+        
+    def _fan_out(self, function, items: List):
+        """
+        Apply `function` to every item concurrently, with at most GROUNDING_CONCURRENCY requests in flight
+        against the endpoint (shared by all the extractors of the process). Results keep the order of `items`.
+        """
+        self.tracker._pe_fanout_connections += 1
+        self.tracker._pe_fanout_tasks += len(items)
+        self.tracker._pe_fanout_max = max(self.tracker._pe_fanout_max, len(items))
+        start_time = time.time()
+        
+        results = run_concurrently(function, items, GROUNDING_CONCURRENCY, get_endpoint_semaphore(self.endpoint))
+        
+        self.tracker._pe_fanout_time += time.time() - start_time
+        return results
+    
     def property_path_to_triples(self, start: str, goal: str, path: str):
-        key = f"{start}->{goal}->{path}"
+        return self.property_paths_to_triples(start, goal, [path])[0]
+    
+    def property_paths_to_triples(self, start: str, goal: str, paths: List[str]):
+        """
+        Turn property paths between the same start and goal into valid collections of triples.
+        With BATCH_VALIDATION the direction variants of all the uncached paths are validated together,
+        VALIDATION_BATCH_SIZE variants per SPARQL request.
         
-        if key not in path_to_triples_index:
+        :return: A list with the final triples of every path, in the order of `paths`.
+        """
+        keys = [f"{start}->{goal}->{path}" for path in paths]
+        
+        pending = []    # (key, variants, check_value_connection)
+        pending_keys = set()
+        for key, path in zip(keys, paths):
+            if key in path_to_triples_index or key in pending_keys:
+                continue
+            pending_keys.add(key)
             get_kgaqa_tracker()._pe_property_path_to_triples_calls += 1
+            triples, check_value_connection = self._generate_triples_for_property_path(start, goal, path)
+            log(f"Count of candidate triples: {len(triples)}", LogComponent.PATH_EXTRACTOR, LogLevel.DEBUG)
+            pending.append((key, triples, check_value_connection))
+        
+        if len(pending) > 0:
             start_time = time.time()
             
-            #
-            # Generate triples from the path
-            #
-            current = start # "<" + start + ">"
-            triples = [""]
-            var_index = 0
-            properties = path.split(" -> ")
-            check_value_connection = True
-            for idx, p in enumerate(properties):
-                if p == "PROPERTY": # this means that we are searching for a literal, not a node
-                    check_value_connection = False
-                    break
-                if p == "PLACEHOLDER":
-                    break
-                new_triples = []
-                if idx == len(properties) - 1:
-                    new_var = goal # "<" + goal + ">"
-                else:
-                    new_var = "?var" + str(var_index)
-                    var_index += 1
-                for t in triples:
-                    if "VALUES" not in current:
-                        new_t_1 = t + current + " <" + p + "> " + new_var + " . \n"
-                        new_t_2 = t + new_var + " <" + p + "> " + current + " . \n"
-                        new_triples.append(new_t_1)
-                        new_triples.append(new_t_2)
-                    else:
-                        new_t_1 = t + current + "?vals <" + p + "> " + new_var + " . \n"
-                        new_t_2 = t + current + new_var + " <" + p + ">  ?vals" + " . \n"
-                        new_triples.append(new_t_1)
-                        new_triples.append(new_t_2)
-                current = new_var
-                triples = new_triples
+            validations = None
+            if BATCH_VALIDATION:
+                variants = [(triples, check_value_connection) for _, path_variants, check_value_connection in pending for triples in path_variants]
+                batches = [variants[i:i + VALIDATION_BATCH_SIZE] for i in range(0, len(variants), VALIDATION_BATCH_SIZE)]
+                batch_validations = self._fan_out(lambda batch: self.validate_triples_batch([triples for triples, _ in batch]), batches)
+                self.tracker._pe_batched_validation_queries += len(batches)
+                self.tracker._pe_batched_validation_variants += len(variants)
                 
-            log(f"Count of candidate triples: {len(triples)}", LogComponent.PATH_EXTRACTOR, LogLevel.DEBUG)
+                # only the variants of the failed batches are validated one by one
+                failed = [variant for batch, batch_validation in zip(batches, batch_validations) if batch_validation is None for variant in batch]
+                if len(failed) > 0:
+                    log(f"Batched validation failed for {len(failed)} variants, validating them one by one", LogComponent.PATH_EXTRACTOR, LogLevel.WARNING)
+                    failed_triples = iter(self._fan_out(lambda variant: self._validate_triples_one_by_one([variant[0]], variant[1]), failed))
+                validations = []
+                for batch, batch_validation in zip(batches, batch_validations):
+                    if batch_validation is None:
+                        # the value connections are already discarded by _validate_triples_one_by_one
+                        batch_validation = [(True, False, final[0]) if final else (False, False, None) for final in (next(failed_triples) for _ in batch)]
+                    validations.extend(batch_validation)
             
-            #
-            # Only keep valid collections of triples, i.e., those that have results in the KG
-            #
-            valid_triples = [triple for triple in triples if self.are_triples_valid(triple)]
-            # print(f"Count of valid triples: {len(valid_triples)}")
-            # print(valid_triples)
-            # print(f"Count of valid triples: {len(valid_triples)}")
-            
-            #
-            # Ignore triples that have a value connection
-            #
-            filtered_triples = []
-            for triples_string in valid_triples:
-                if check_value_connection and self.has_no_value_connection(triples_string) == False:
-                    continue
-                filtered_triples.append(triples_string)
-            # print(f"Count of filtered triples: {len(filtered_triples)}")
+            if validations is None:
+                all_final_triples = self._fan_out(lambda p: self._validate_triples_one_by_one(p[1], p[2]), pending)
+            else:
+                all_final_triples = []
+                offset = 0
+                for _, path_variants, check_value_connection in pending:
+                    final_triples = []
+                    for valid, binds_literal, triples in validations[offset:offset + len(path_variants)]:
+                        if not valid or (check_value_connection and binds_literal):
+                            continue
+                        final_triples.append(triples)
+                    offset += len(path_variants)
+                    all_final_triples.append(final_triples)
             
-            #
-            # In the generated triples, replace variables that represent types/classes with their actual URIs
-            #
-            final_triples = []
-            for triples_string in filtered_triples:
-                final_triples.append(self.replace_types_for_triples(triples_string))
-                
-            log(f"Count of final triples: {len(final_triples)}", LogComponent.PATH_EXTRACTOR, LogLevel.DEBUG)
+            for (key, _, _), final_triples in zip(pending, all_final_triples):
+                log(f"Count of final triples for {key}: {len(final_triples)}", LogComponent.PATH_EXTRACTOR, LogLevel.DEBUG)
+                path_to_triples_index[key] = final_triples
                 
             get_kgaqa_tracker()._pe_property_path_to_triples_time += time.time() - start_time
-            path_to_triples_index[key] = final_triples
             
-        return path_to_triples_index[key]
+        return [path_to_triples_index[key] for key in keys]
     
     # ------------------------------
     # ----- Main Functionality -----
@@ -1363,10 +1839,10 @@ class PathExtractor():
                 # create triples from the property paths, the returned triples are valid in the KG
                 triples_strings = []
                 triples_popularities = []
-                for property_path, popularity in zip(property_paths, popularities):
+                all_final_triples = self.property_paths_to_triples(start, end, property_paths)
+                for property_path, popularity, final_triples in zip(property_paths, popularities, all_final_triples):
                     # print_colored("Property Path: " + property_path, Colors.BOLD)
                     log(f"Property Path: {property_path}", LogComponent.PATH_EXTRACTOR, LogLevel.DEBUG)
-                    final_triples = self.property_path_to_triples(start, end, property_path)
                     if final_triples == []: # if the property path connects the goals through a value connection, we skip it
                         self.tracker._pe_no_triples_for_property_path += 1
                         log(f"No triples found for property path {property_path}", LogComponent.PATH_EXTRACTOR, LogLevel.WARNING)
@@ -1408,7 +1884,7 @@ class PathExtractor():
                     get_kgaqa_tracker()._pe_prompt_grounding_calls += 1
                     start_time_2 = time.time()
                     
-                    generated = llm_call(self.model_id_main, prompt, 4096)
+                    generated = llm_call(self.model_id_main, prompt, 4096, stop_when=GROUNDING_ANSWER_COMPLETE if STREAM_EARLY_STOP else None)
                     # print_colored(f"{generated}", Colors.BLUE)
                     log(f"LLM response for grounding: {generated}", LogComponent.PATH_EXTRACTOR, LogLevel.DEBUG, LogType.LLM_RESULT)
                     
@@ -1530,6 +2006,7 @@ def triples_results(triples: str):
     variables = results["head"]["vars"]
 
     # Collect all rows with variable values
+    prefetch_labels([binding["value"] for result in bindings for binding in result.values() if binding["type"] == "uri"], KNOWLEDGE_GRAPH)
     my_results = []
     for result in bindings:
         row = [result.get(var, {}).get("value", "") for var in variables]
@@ -1,39 +1,205 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+import numpy as np
 from typing import List
-from src.utils import embed_model
+from src.utils import embed_batch, embed_model, get_relative_path
 from src.datasets.dataset import Dataset
 from src.datasets.qald9_dataset import Qald9Dataset
+from src.logging import log, LogComponent, LogLevel
 
-from llama_index.core import Document, VectorStoreIndex, Settings
+from llama_index.core import Document, VectorStoreIndex, Settings, StorageContext, load_index_from_storage
 from llama_index.core.retrievers import VectorIndexRetriever
-from llama_index.core.schema import TextNode
+from llama_index.core.schema import TextNode, MetadataMode
+
+
+# Directory of the persisted indices, <dataset name>/<fingerprint>/ per index
+QUERY_DB_DIR = "./resources/query_db/"
+# Questions embedded per call of the embedding model when building or extending an index
+QUERY_DB_EMBED_BATCH_SIZE = 128
+
+
+def pair_id(question: str, query: str):
+    return hashlib.sha256(f"{question}\t{query}".encode("utf-8")).hexdigest()[:32]
+
+def fingerprint(pair_ids):
+    """
+    Identity of an index: the embedding model and the (question, query) pairs, independent of their order.
+    """
+    model_name = getattr(embed_model, "model_name", None)
+    return hashlib.sha256(("\n".join([str(model_name)] + sorted(set(pair_ids)))).encode("utf-8")).hexdigest()[:16]
+
 
 class QueryDb:
-    def __init__(self, dataset: Dataset):
+    def __init__(self, dataset: Dataset, persist: bool = True):
+        """
+        :param dataset: the (question, query) pairs of the database
+        :param persist: load the index from QUERY_DB_DIR if it was already built, and save it there otherwise
+        """
         self.dataset = dataset
-        
+        self.persist_root = os.path.join(get_relative_path(QUERY_DB_DIR), dataset.get_name()) if persist else None
+
         Settings.llm = None
 
-        # Build documents (nodes) for each query
-        nodes = []
+        pairs = {}
         for i in self.dataset:
             question = self.dataset.get_question(i)
             query = self.dataset.get_query(i)
-            # We'll use the question as the text to embed, but store query as metadata
-            node = TextNode(text=question, metadata={"query": query})
-            nodes.append(node)
+            pairs[pair_id(question, query)] = (question, query)
+        self.pair_ids = set()
 
-        # Build vector index
-        self.index = VectorStoreIndex(nodes, embed_model=embed_model)
-        self.retriever = VectorIndexRetriever(index=self.index)   
+        self.index = self._load(set(pairs))
+        if self.index is None:
+            # Build vector index
+            self.index = VectorStoreIndex(self._embedded_nodes(pairs), embed_model=embed_model)
+            self.pair_ids = set(pairs)
+            self._persist()
+        elif self.pair_ids != set(pairs):
+            # an index of a subset of the pairs was found, only the difference is embedded
+            self.add_queries([pairs[added] for added in set(pairs) - self.pair_ids])
+        self.retriever = VectorIndexRetriever(index=self.index)
+        
+        self._prefetched = {}
+        self._prefetched_lock = threading.Lock()
+        self._build_matrix()
+
+    def _build_matrix(self):
+        """
+        Contiguous matrix of the normalized question embeddings (row i is the i-th entry), so the retrieval is a
+        matrix multiply instead of a llama_index query engine per question.
+        """
+        embeddings = self.index.vector_store.data.embedding_dict
+        self.entries = []
+        rows = []
+        for id in sorted(self.pair_ids):
+            node = self.index.docstore.get_node(id)
+            self.entries.append((node.text, node.metadata["query"]))
+            rows.append(embeddings[id])
+        self.matrix = _normalized(np.asarray(rows, dtype=np.float32).reshape(len(rows), -1))
+
+    def _embedded_nodes(self, pairs: dict):
+        """
+        Build documents (nodes) for each query, embedded in batches.
+        """
+        # We'll use the question as the text to embed, but store query as metadata
+        nodes = [TextNode(id_=id, text=question, metadata={"query": query}) for id, (question, query) in pairs.items()]
+        for start in range(0, len(nodes), QUERY_DB_EMBED_BATCH_SIZE):
+            batch = nodes[start:start + QUERY_DB_EMBED_BATCH_SIZE]
+            embeddings = embed_batch([node.get_content(metadata_mode=MetadataMode.EMBED) for node in batch], is_query=False)
+            for node, embedding in zip(batch, embeddings):
+                node.embedding = embedding
+        return nodes
+
+    def _load(self, pair_ids: set):
+        """
+        Load the persisted index of these pairs or, failing that, the largest persisted index of a subset of them.
+        """
+        if self.persist_root is None or not os.path.isdir(self.persist_root):
+            return None
+        best, best_pair_ids = None, set()
+        for entry in os.listdir(self.persist_root):
+            manifest_filepath = os.path.join(self.persist_root, entry, "manifest.json")
+            if not os.path.exists(manifest_filepath):
+                continue
+            with open(manifest_filepath, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            persisted_pair_ids = set(manifest["pairs"])
+            if manifest["model"] != str(getattr(embed_model, "model_name", None)) or not persisted_pair_ids <= pair_ids:
+                continue
+            if best is None or len(persisted_pair_ids) > len(best_pair_ids):
+                best, best_pair_ids = entry, persisted_pair_ids
+                if persisted_pair_ids == pair_ids:
+                    break
+        if best is None:
+            return None
+        log(f"Loading query db index {best} ({len(best_pair_ids)}/{len(pair_ids)} queries)", LogComponent.QUERY_GENERATOR, LogLevel.INFO)
+        storage_context = StorageContext.from_defaults(persist_dir=os.path.join(self.persist_root, best))
+        self.pair_ids = best_pair_ids
+        return load_index_from_storage(storage_context, embed_model=embed_model)
+
+    def _persist(self):
+        if self.persist_root is None:
+            return
+        directory = os.path.join(self.persist_root, fingerprint(self.pair_ids))
+        if os.path.exists(directory):
+            return
+        os.makedirs(self.persist_root, exist_ok=True)
+        # written next to its final place and renamed, a crash never leaves a half-written index behind
+        staging = tempfile.mkdtemp(dir=self.persist_root, prefix=".staging-")
+        try:
+            self.index.storage_context.persist(persist_dir=staging)
+            with open(os.path.join(staging, "manifest.json"), "w", encoding="utf-8") as f:
+                json.dump({"model": str(getattr(embed_model, "model_name", None)), "pairs": sorted(self.pair_ids)}, f)
+            os.replace(staging, directory)
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        log(f"Saved query db index to {directory}", LogComponent.QUERY_GENERATOR, LogLevel.INFO)
+
+    def add_queries(self, pairs: List[tuple]):
+        """
+        Add (question, query) pairs to the index without rebuilding it, the extended index is persisted under its new fingerprint.
+        """
+        new_pairs = {}
+        for question, query in pairs:
+            id = pair_id(question, query)
+            if id not in self.pair_ids:
+                new_pairs[id] = (question, query)
+        if not new_pairs:
+            return
+        self.index.insert_nodes(self._embedded_nodes(new_pairs))
+        self.pair_ids.update(new_pairs)
+        self._persist()
+        if hasattr(self, "matrix"):
+            self._build_matrix()
 
     def get_relevant_queries(self, input_question: str, top_k: int = 3) -> List[str]:
-        query_engine = self.index.as_query_engine(similarity_top_k=top_k)
-        results = query_engine.query(input_question)
+        with self._prefetched_lock:
+            prefetched = self._prefetched.get((input_question, top_k))
+        if prefetched is not None:
+            return prefetched
+        return self.get_relevant_queries_batch([input_question], top_k=top_k)[0]
+
+    def get_relevant_queries_batch(self, input_questions: List[str], top_k: int = 3):
+        """
+        The most similar questions (cosine similarity) and their queries for every input question.
+        All the input questions are embedded at once and scored with a single matrix multiply.
+        :return: a (relevant_questions, relevant_queries) pair per input question
+        """
+        if not input_questions:
+            return []
+        top_k = min(top_k, len(self.entries))
+        if top_k == 0:
+            return [([], []) for _ in input_questions]
+        queries = _normalized(np.asarray(embed_batch(input_questions, is_query=True), dtype=np.float32))
+        scores = queries @ self.matrix.T
+        # top_k unordered candidates per row, then ordered by score
+        candidates = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+        results = []
+        for row, row_candidates in enumerate(candidates):
+            ranked = row_candidates[np.argsort(-scores[row, row_candidates], kind="stable")]
+            results.append(([self.entries[i][0] for i in ranked], [self.entries[i][1] for i in ranked]))
+        return results
+
+    def prefetch(self, input_questions: List[str], top_k: int = 3):
+        """
+        Retrieve the relevant queries of many questions with one batch, later get_relevant_queries calls with the
+        same question and top_k are answered from memory.
+        """
+        questions = list(dict.fromkeys(input_questions))
+        results = self.get_relevant_queries_batch(questions, top_k=top_k)
+        with self._prefetched_lock:
+            for question, result in zip(questions, results):
+                self._prefetched[(question, top_k)] = result
+
 
-        # Extract queries from metadata
-        relevant_questions = [node.text for node in results.source_nodes]
-        relevant_queries = [node.metadata["query"] for node in results.source_nodes]
-        return relevant_questions, relevant_queries
+def _normalized(matrix: np.ndarray):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
         
         
 if __name__ == '__main__':
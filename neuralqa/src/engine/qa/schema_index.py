@@ -0,0 +1,187 @@
+import os
+import re
+import sys
+import json
+import mmap
+import math
+import pickle
+import hashlib
+import argparse
+import threading
+from src.datasets.dataset import KnowledgeGraph
+from src.utils import get_relative_path
+
+
+# Directory of the schema indices, one sub-directory per knowledge graph
+SCHEMA_INDEX_DIR = "./resources/schema_index/"
+# Class lists pulled by the GoldClassIdentifier, used when an index has no classes.txt
+GOLD_CLASSES_DIR = "../class_identifier/resources/knowledge_graph_classes/"
+
+TYPE_PREDICATES = {
+    "http://www.w3.org/1999/02/22-rdf-syntax-ns#type",
+    "http://www.wikidata.org/prop/direct/P31",
+}
+
+
+class BloomFilter:
+    """
+    Compact set of strings without false negatives and with a bounded false positive rate.
+    The bits are memory-mapped when loaded from a file.
+    """
+    def __init__(self, bits: int, hashes: int, data=None):
+        self.bits = bits
+        self.hashes = hashes
+        self.data = data if data is not None else bytearray((bits + 7) // 8)
+
+    @staticmethod
+    def for_capacity(capacity: int, false_positive_rate: float = 0.001):
+        bits = max(8, int(-capacity * math.log(false_positive_rate) / (math.log(2) ** 2)))
+        hashes = max(1, round(bits / max(1, capacity) * math.log(2)))
+        return BloomFilter(bits, hashes)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self.data[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str):
+        return all(self.data[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def save(self, filepath: str):
+        with open(filepath + ".json", "w", encoding="utf-8") as f:
+            json.dump({"bits": self.bits, "hashes": self.hashes}, f)
+        with open(filepath, "wb") as f:
+            f.write(self.data)
+
+    @staticmethod
+    def load(filepath: str):
+        with open(filepath + ".json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(filepath, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return BloomFilter(meta["bits"], meta["hashes"], data)
+
+
+class SchemaIndex:
+    """
+    Local membership checks for the nodes of a knowledge graph: the set of classes, the set of predicates and
+    a Bloom filter of every node that appears as a subject or object. Every part is optional, the answer of a
+    check is None when the index cannot decide (the caller then asks the endpoint).
+    """
+    def __init__(self, classes: set = None, predicates: set = None, nodes: BloomFilter = None):
+        self.classes = classes
+        self.predicates = predicates
+        self.nodes = nodes
+
+    @staticmethod
+    def load(knowledge_graph: KnowledgeGraph):
+        directory = get_relative_path(SCHEMA_INDEX_DIR + knowledge_graph.value)
+
+        classes = None
+        if os.path.exists(os.path.join(directory, "classes.txt")):
+            classes = _read_set(os.path.join(directory, "classes.txt"))
+        else:
+            gold_classes_filepath = get_relative_path(GOLD_CLASSES_DIR + knowledge_graph.value + "_classes.pkl")
+            if os.path.exists(gold_classes_filepath):
+                with open(gold_classes_filepath, "rb") as f:
+                    classes = set(pickle.load(f))
+        if classes is not None and len(classes) == 0:
+            classes = None  # an empty list means that pulling the classes failed
+
+        predicates = None
+        if os.path.exists(os.path.join(directory, "predicates.txt")):
+            predicates = _read_set(os.path.join(directory, "predicates.txt"))
+
+        nodes = None
+        if os.path.exists(os.path.join(directory, "nodes.bloom")):
+            nodes = BloomFilter.load(os.path.join(directory, "nodes.bloom"))
+
+        return SchemaIndex(classes, predicates, nodes)
+
+    def is_class(self, uri: str):
+        if self.classes is None:
+            return None
+        return uri in self.classes
+
+    def is_predicate(self, uri: str):
+        if self.predicates is None:
+            return None
+        return uri in self.predicates
+
+    def is_node(self, uri: str):
+        if self.nodes is None:
+            return None
+        return uri in self.nodes
+
+
+def _read_set(filepath: str):
+    with open(filepath, "r", encoding="utf-8") as f:
+        return set(line.rstrip("\n") for line in f if line.strip())
+
+
+schema_indices = {}
+_schema_indices_lock = threading.Lock()
+
+def get_schema_index(knowledge_graph: KnowledgeGraph) -> SchemaIndex:
+    """
+    The schema index of a knowledge graph, loaded on first use.
+    """
+    with _schema_indices_lock:
+        if knowledge_graph not in schema_indices:
+            schema_indices[knowledge_graph] = SchemaIndex.load(knowledge_graph)
+        return schema_indices[knowledge_graph]
+
+
+# --------------------------------
+# ----- Build from a KG dump -----
+# --------------------------------
+
+_NTRIPLE = re.compile(r'^<([^>]+)>\s+<([^>]+)>\s+(<([^>]+)>|.+?)\s*\.\s*$')
+
+def build_schema_index(dump_filepaths: list, output_dir: str, capacity: int, false_positive_rate: float):
+    """
+    Build the schema index of a knowledge graph from N-Triples dumps.
+    """
+    classes, predicates = set(), set()
+    nodes = BloomFilter.for_capacity(capacity, false_positive_rate)
+    triples = 0
+    for dump_filepath in dump_filepaths:
+        with open(dump_filepath, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                match = _NTRIPLE.match(line)
+                if match is None:
+                    continue
+                s, p, o = match.group(1), match.group(2), match.group(4)
+                predicates.add(p)
+                nodes.add(s)
+                if o is not None:
+                    nodes.add(o)
+                    if p in TYPE_PREDICATES:
+                        classes.add(o)
+                triples += 1
+                if triples % 10000000 == 0:
+                    print(f"{triples} triples...", file=sys.stderr)
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, "classes.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(sorted(classes)) + "\n")
+    with open(os.path.join(output_dir, "predicates.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(sorted(predicates)) + "\n")
+    nodes.save(os.path.join(output_dir, "nodes.bloom"))
+    print(f"{triples} triples, {len(classes)} classes, {len(predicates)} predicates indexed in {output_dir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the schema index of a knowledge graph from N-Triples dumps.")
+    parser.add_argument("--knowledge_graph", type=str, required=True, help="KnowledgeGraph value, e.g., Wikidata or Freebase")
+    parser.add_argument("--input", type=str, nargs="+", required=True, help="N-Triples dumps of the knowledge graph")
+    parser.add_argument("--capacity", type=int, required=True, help="Expected number of distinct nodes")
+    parser.add_argument("--false_positive_rate", type=float, default=0.001, help="False positive rate of the nodes Bloom filter")
+    args = parser.parse_args()
+
+    build_schema_index(args.input, get_relative_path(SCHEMA_INDEX_DIR + KnowledgeGraph(args.knowledge_graph).value), args.capacity, args.false_positive_rate)
@@ -0,0 +1,272 @@
+import re
+import threading
+import requests
+from src.cache import LRUCache, hash_key
+from src.metrics import get_kgaqa_tracker
+from src.engine import gost_requests
+
+try:
+    from rdflib.plugins.sparql.parser import parseQuery
+except ImportError:
+    parseQuery = None
+
+
+PARSE_CACHE_ITEMS = 50000   # memoized results (validation, URIs, predicates, formatting) by query hash
+GOST_FALLBACK = True        # validate with the GoST service when the SPARQL 1.1 grammar (rdflib) is not installed
+
+RDF_TYPE = "http://www.w3.org/1999/02/22-rdf-syntax-ns#type"
+
+PARSE_CACHE = LRUCache(PARSE_CACHE_ITEMS)
+_parse_lock = threading.Lock()  # the rdflib (pyparsing) grammar is shared, queries are parsed one at a time
+
+# -----------------
+# ----- Lexer -----
+# -----------------
+
+_TOKENS = re.compile(r"""
+    (?P<WS>\s+)
+  | (?P<COMMENT>\#[^\n]*)
+  | (?P<IRI><[^<>"{}|^`\\\x00-\x20]*>)
+  | (?P<STRING>'''(?:[^'\\]|\\.|'(?!''))*'''|\"\"\"(?:[^"\\]|\\.|"(?!""))*\"\"\"|'(?:[^'\\\n\r]|\\.)*'|"(?:[^"\\\n\r]|\\.)*")
+  | (?P<VAR>[?$]\w+)
+  | (?P<BLANK>_:[\w](?:[\w\-.]*[\w\-])?)
+  | (?P<PNAME>(?:[^\W\d_](?:[\w\-.]*[\w\-])?)?:(?:(?:[\w:%\-]|\\[_~.\-!$&'()*+,;=/?\#@%]|\.(?=[\w:%\-\\]))*))
+  | (?P<LANGTAG>@[a-zA-Z]+(?:-[a-zA-Z0-9]+)*)
+  | (?P<NUMBER>\d*\.\d+(?:[eE][+-]?\d+)?|\d+\.\d*[eE][+-]?\d+|\d+)
+  | (?P<NAME>[A-Za-z_]\w*)
+  | (?P<PUNCT>\^\^|&&|\|\||!=|<=|>=|[{}()\[\];,.*+\-/|^!=<>?])
+""", re.VERBOSE)
+
+_OPENING = {"{": "}", "(": ")", "[": "]"}
+_QUERY_FORMS = {"SELECT", "ASK", "CONSTRUCT", "DESCRIBE"}
+_PATH_OPERATORS = {"/", "|", "^", "!"}     # followed by another predicate of the path, unlike the modifiers * + ?
+_NEXT_POSITION = {"subject": "predicate", "predicate": "path", "path": "object_end", "object": "object_end"}    # after a term of a triple pattern
+
+
+def tokenize(query: str):
+    """
+    (kind, text) tokens of a SPARQL query, whitespace and comments dropped. Characters that start no SPARQL token
+    are returned as ("ERROR", character).
+    """
+    tokens = []
+    position = 0
+    while position < len(query):
+        match = _TOKENS.match(query, position)
+        if match is None:
+            tokens.append(("ERROR", query[position]))
+            position += 1
+            continue
+        if match.lastgroup not in ("WS", "COMMENT"):
+            tokens.append((match.lastgroup, match.group()))
+        position = match.end()
+    return tokens
+
+def _prologue(tokens: list):
+    """
+    The PREFIX declarations of the query and the index of the first token after the prologue.
+    """
+    prefixes = {}
+    i = 0
+    while i < len(tokens):
+        keyword = tokens[i][1].upper()
+        if keyword == "PREFIX" and i + 2 < len(tokens) and tokens[i + 1][0] == "PNAME" and tokens[i + 2][0] == "IRI":
+            prefixes[tokens[i + 1][1][:-1]] = tokens[i + 2][1][1:-1]
+            i += 3
+        elif keyword == "BASE" and i + 1 < len(tokens) and tokens[i + 1][0] == "IRI":
+            i += 2
+        else:
+            break
+    return prefixes, i
+
+def _expand(token: tuple, prefixes: dict):
+    """
+    The full IRI of an IRI or prefixed name token, None for prefixed names of undeclared prefixes.
+    """
+    kind, text = token
+    if kind == "IRI":
+        return text[1:-1]
+    prefix, local = text.split(":", 1)
+    if prefix not in prefixes:
+        return None
+    return prefixes[prefix] + re.sub(r"\\(.)", r"\1", local)
+
+def _is_well_formed(tokens: list):
+    """
+    Lexical and structural check: every token is a SPARQL token, the brackets are balanced and there is a query form.
+    """
+    stack = []
+    for kind, text in tokens:
+        if kind == "ERROR":
+            return False
+        if kind == "PUNCT":
+            if text in _OPENING:
+                stack.append(_OPENING[text])
+            elif text in ("}", ")", "]"):
+                if not stack or stack.pop() != text:
+                    return False
+    return not stack and any(kind == "NAME" and text.upper() in _QUERY_FORMS for kind, text in tokens)
+
+def _memoized(function: str, query: str, compute):
+    key = hash_key(function, query)
+    result = PARSE_CACHE.get(key)
+    if result is not None:
+        get_kgaqa_tracker()._sparql_parse_cache_hits += 1
+        return result
+    result = compute()
+    if result is not None:
+        PARSE_CACHE.set(key, result)
+    return result
+
+# ----------------------
+# ----- Public API -----
+# ----------------------
+
+def validate_query(query: str) -> bool:
+    """
+    Whether the query is syntactically valid SPARQL 1.1 (GeoSPARQL functions and literals are plain SPARQL syntax).
+    Parsed in-process with the rdflib grammar, by the GoST service if rdflib is not installed and GOST_FALLBACK is set,
+    otherwise only the lexical and structural check is done. When GoST is unreachable or fails, the structural check
+    is accepted and the result is not memoized, the next call asks GoST again.
+    """
+    def compute():
+        if not _is_well_formed(tokenize(query)):
+            return False
+        if parseQuery is not None:
+            try:
+                with _parse_lock:
+                    parseQuery(query)
+                return True
+            except Exception:
+                return False
+        if GOST_FALLBACK:
+            get_kgaqa_tracker()._sparql_parse_gost_calls += 1
+            try:
+                valid = gost_requests.validate_query(query)
+            except requests.exceptions.RequestException as e:
+                print("Error:", e)
+                return None
+            return None if valid is None else valid == True
+        return True
+    valid = _memoized("validate", query, compute)
+    return True if valid is None else valid
+
+def extract_uris(query: str) -> str:
+    """
+    The distinct IRIs used by the query (prefixed names expanded, PREFIX and BASE declarations excluded),
+    one per line in order of appearance.
+    """
+    def compute():
+        tokens = tokenize(query)
+        prefixes, start = _prologue(tokens)
+        uris = {}
+        for token in tokens[start:]:
+            if token[0] in ("IRI", "PNAME"):
+                uri = _expand(token, prefixes)
+                if uri is not None:
+                    uris[uri] = None
+        return "\n".join(uris)
+    return _memoized("uris", query, compute)
+
+def extract_predicates(query: str) -> str:
+    """
+    The distinct IRIs used as predicates (or inside property paths) of the triple patterns of the query,
+    one per line in order of appearance.
+    """
+    def compute():
+        tokens = tokenize(query)
+        prefixes, start = _prologue(tokens)
+        predicates = {}
+        position = "subject"    # subject -> predicate -> path -> object -> object_end
+        saved = []              # positions around [ ] blank node property lists
+        depth = 0               # parenthesized expressions, function calls and collections are skipped
+        skip_block = False      # VALUES data blocks
+        skip_datatype = False
+        for kind, text in tokens[start:]:
+            if depth > 0:
+                depth += {"(": 1, ")": -1}.get(text, 0)
+                continue
+            if skip_block:
+                skip_block = text != "}"
+                continue
+            if skip_datatype:
+                skip_datatype = False
+                continue
+            if kind == "PUNCT":
+                if text == "(":
+                    depth = 1
+                elif text == "^^":
+                    skip_datatype = True
+                elif text in ("{", "}", "."):
+                    position = "subject"
+                elif text == ";":
+                    position = "predicate"
+                elif text == ",":
+                    position = "object"
+                elif text == "[":
+                    saved.append(position)
+                    position = "predicate"
+                elif text == "]":
+                    position = _NEXT_POSITION.get(saved.pop() if saved else "subject", "subject")
+                elif text in _PATH_OPERATORS and position == "path":
+                    position = "predicate"
+                continue
+            if kind == "NAME" and text != "a" and text.lower() not in ("true", "false"):
+                if text.upper() == "VALUES":
+                    skip_block = True
+                position = "subject"
+                continue
+            if kind == "LANGTAG":
+                continue
+            if position == "predicate":
+                uri = RDF_TYPE if text == "a" else (_expand((kind, text), prefixes) if kind in ("IRI", "PNAME") else None)
+                if uri is not None:
+                    predicates[uri] = None
+            position = _NEXT_POSITION.get(position, "object_end")
+        return "\n".join(predicates)
+    return _memoized("predicates", query, compute)
+
+def format_query(query: str) -> str:
+    """
+    The query re-indented: one PREFIX declaration per line, one triple pattern per line (predicate-object lists
+    continued one level deeper) and one level of indentation per group. Comments are dropped.
+    """
+    def compute():
+        tokens = tokenize(query)
+        _, start = _prologue(tokens)
+        lines = []
+        i = 0
+        while i < start:
+            width = 3 if tokens[i][1].upper() == "PREFIX" else 2
+            lines.append(" ".join(text for _, text in tokens[i:i + width]))
+            i += width
+        indent = 0
+        continuation = False
+        line = ""
+        previous = None
+        for kind, text in tokens[start:]:
+            if kind == "PUNCT" and text == "}":
+                if line:
+                    lines.append("    " * (indent + continuation) + line)
+                indent = max(indent - 1, 0)
+                continuation = False
+                line = ""
+            attached = previous is None or line == "" \
+                or previous[1] in ("(", "^^", "/", "|", "^") \
+                or text in (")", ",", "^^", "/", "|", "?") or kind == "LANGTAG" \
+                or (text == "(" and previous[0] in ("IRI", "PNAME")) \
+                or (text in ("*", "+") and (previous[0] in ("IRI", "PNAME") or previous[1] == ")"))
+            line += text if attached else " " + text
+            previous = (kind, text)
+            if kind == "PUNCT" and text in ("{", ".", ";", "}"):
+                if line == "." and lines:
+                    lines[-1] += " ."
+                else:
+                    lines.append("    " * (indent + continuation) + line)
+                line = ""
+                continuation = text == ";"
+                if text == "{":
+                    indent += 1
+        if line:
+            lines.append("    " * (indent + continuation) + line)
+        return "\n".join(lines)
+    return _memoized("format", query, compute)
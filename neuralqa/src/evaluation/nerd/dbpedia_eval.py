@@ -2,13 +2,13 @@
 # ----- Useful for counting redirects in DBpedia NERD evaluation. -----
 # ---------------------------------------------------------------------
 
-from SPARQLWrapper import SPARQLWrapper, JSON
+from src.sparql_client import get_sparql_client
 import json
 from tqdm import tqdm
 import argparse
 
-# SPARQL endpoint for DBpedia
-sparql = SPARQLWrapper("https://dbpedia.org/sparql")
+# SPARQL endpoint for DBpedia (public, no credentials)
+sparql = get_sparql_client("https://dbpedia.org/sparql", credentials=None)
 
 # Cache to avoid repeated queries
 redirect_cache = {}
@@ -22,11 +22,8 @@ def resolve(uri):
         <{uri}> <http://dbpedia.org/ontology/wikiPageRedirects> ?target
     }} LIMIT 1
     """
-    sparql.setQuery(query)
-    sparql.setReturnFormat(JSON)
-    
     try:
-        results = sparql.query().convert()
+        results = sparql.query(query)
         bindings = results.get("results", {}).get("bindings", [])
         if bindings:
             target = bindings[0]["target"]["value"]
@@ -0,0 +1,58 @@
+import os
+import json
+import mmap
+
+
+class LabelStore:
+    """
+    Read-only URI -> label dictionary stored on disk (built by tools/label-store-generator).
+    The URIs are sorted, lookups binary search the memory-mapped files, so opening a store costs nothing
+    and the pages are shared by every process that uses it.
+
+    Files of a store directory:
+        keys.bin    - the UTF-8 URIs, sorted bytewise, concatenated
+        keys.idx    - uint64 offsets into keys.bin (count + 1 entries)
+        labels.bin  - the UTF-8 labels, in the order of the keys
+        labels.idx  - uint64 offsets into labels.bin (count + 1 entries)
+        meta.json   - {"count": ..., "format": 1}
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.count = self.meta["count"]
+        self._keys_idx = memoryview(self._map(os.path.join(directory, "keys.idx"))).cast("Q")
+        self._labels_idx = memoryview(self._map(os.path.join(directory, "labels.idx"))).cast("Q")
+        self._keys = self._map(os.path.join(directory, "keys.bin"))
+        self._labels = self._map(os.path.join(directory, "labels.bin"))
+
+    def _map(self, filepath: str):
+        if os.path.getsize(filepath) == 0:
+            return b""
+        with open(filepath, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _key(self, i: int) -> bytes:
+        return self._keys[self._keys_idx[i]:self._keys_idx[i + 1]]
+
+    def get(self, uri: str):
+        """
+        The label of `uri`, None if the store does not know it.
+        """
+        key = uri.encode("utf-8")
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self._key(low) == key:
+            return self._labels[self._labels_idx[low]:self._labels_idx[low + 1]].decode("utf-8")
+        return None
+
+    def __contains__(self, uri: str):
+        return self.get(uri) is not None
+
+    def __len__(self):
+        return self.count
@@ -1,3 +1,41 @@
+import threading
+
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000]
+
+def new_latency_histogram():
+    """
+    Empty latency histogram, bucket label -> number of requests.
+    """
+    histogram = {f"<={bound}ms": 0 for bound in LATENCY_BUCKETS_MS}
+    histogram[f">{LATENCY_BUCKETS_MS[-1]}ms"] = 0
+    return histogram
+
+def record_latency(histogram: dict, seconds: float):
+    milliseconds = seconds * 1000
+    for bound in LATENCY_BUCKETS_MS:
+        if milliseconds <= bound:
+            histogram[f"<={bound}ms"] += 1
+            return
+    histogram[f">{LATENCY_BUCKETS_MS[-1]}ms"] += 1
+
+def new_llm_provider_stats():
+    """
+    Empty statistics of an LLM provider. `timed_token_time` only sums the calls that reported token usage.
+    """
+    return {"calls": 0, "time": 0.0, "completion_tokens": 0, "timed_token_time": 0.0, "latency_histogram": new_latency_histogram()}
+
+def llm_provider_summary(stats: dict):
+    return {
+        "calls": stats["calls"],
+        "time": stats["time"],
+        "average_latency": stats["time"] / stats["calls"] if stats["calls"] > 0 else 0.0,
+        "completion_tokens": stats["completion_tokens"],
+        "timed_token_time": stats["timed_token_time"],
+        "tokens_per_second": stats["completion_tokens"] / stats["timed_token_time"] if stats["timed_token_time"] > 0 else 0.0,
+        "latency_histogram": stats["latency_histogram"],
+    }
+
+
 class KgaqaTracker:
     def __init__(self):
         # ---------------------------
@@ -32,11 +70,24 @@ class KgaqaTracker:
         # -------------------
         self._total_questions = 0           # total number of questions (they might not all be counted, because they might have invalid gold queries)
         self._llm_time = 0.0                # total time taken by the LLM to generate answers
-        self._llm_calls = 0                 # total number of LLM calls
+        self._llm_calls = 0                 # total number of LLM calls (cache hits included)
+        self._llm_cache_hits = 0            # LLM responses served from the response cache
+        self._llm_cache_misses = 0          # LLM prompts not found in the response cache
+        self._llm_early_stops = 0           # streamed LLM responses stopped as soon as the answer was complete
+        self._llm_provider_stats = {}       # provider -> calls, time, completion tokens and latency histogram
         self._embed_time = 0.0              # total time taken for embedding generation
         self._embed_calls = 0               # total number of embedding calls
+        self._embed_cache_hits = 0          # texts whose embedding was cached (memory or disk)
+        self._embed_cache_misses = 0        # texts embedded by the model
+        self._embed_batches = 0             # forward passes of the embedding model
+        self._embed_batch_max = 0           # largest batch of texts embedded in one forward pass
         self._sparql_execs = 0              # total number of SPARQL executions
         self._sparql_time = 0.0             # total time taken for SPARQL executions
+        self._sparql_cache_hits = 0         # SPARQL results served from the result cache
+        self._sparql_cache_misses = 0       # SPARQL queries not found in the result cache
+        self._sparql_latency_histogram = new_latency_histogram()  # per-request latency of SPARQL HTTP requests
+        self._sparql_parse_cache_hits = 0   # validations and URI extractions answered from the parse cache
+        self._sparql_parse_gost_calls = 0   # queries validated by the GoST service (rdflib not installed)
         self._ri_time = 0.0                 # total time taken for relation identification
         self._pe_time = 0.0                 # total time taken for path extraction
         self._qg_zero_shot_time = 0.0       # total time taken for query generation
@@ -69,8 +120,23 @@ class KgaqaTracker:
         self._pe_graph_search_time = 0.0
         self._pe_neighborhood_calls = 0                # how many connections were found with neighborhood search
         self._pe_neighborhood_time = 0.0
+        self._pe_neighborhood_waves = 0                # how many levels of concurrent predicate selection prompts were sent
         self._pe_property_path_to_triples_calls = 0
         self._pe_property_path_to_triples_time = 0.0
+        self._pe_batched_validation_queries = 0     # how many batched (UNION) validation requests were sent
+        self._pe_batched_validation_variants = 0    # how many direction variants were validated through them
+        self._pe_class_statistics_hits = 0          # class predicates read from the materialized class statistics
+        self._pe_class_statistics_misses = 0        # class predicates aggregated with live SPARQL
+        self._pe_triple_store_lookups = 0           # single triple pattern lookups answered by the local triple store
+        self._pe_path_engine_searches = 0           # shortest/all paths searches answered by the in-process path engine
+        self._pe_popularity_exact = 0               # predicate popularities computed with exact COUNT(*) aggregations
+        self._pe_popularity_approximate = 0         # predicate popularities extrapolated from a sample
+        self._pe_schema_index_hits = 0              # is_class/is_entity checks answered by the local schema index
+        self._pe_schema_index_misses = 0            # is_class/is_entity checks that needed a SPARQL query
+        self._pe_fanout_connections = 0             # how many connections had their candidate paths grounded concurrently
+        self._pe_fanout_tasks = 0                   # how many grounding requests were fanned out in total
+        self._pe_fanout_max = 0                     # largest fan-out of a single connection
+        self._pe_fanout_time = 0.0                  # wall time spent waiting on fanned out grounding requests
         self._pe_prompt_inclusion_time = 0.0
         self._pe_prompt_inclusion_calls = 0
         self._pe_prompt_grounding_time = 0.0
@@ -129,10 +195,23 @@ class KgaqaTracker:
             "general_metrics": {
                 "llm_time": self._llm_time,
                 "llm_calls": self._llm_calls,
+                "llm_cache_hits": self._llm_cache_hits,
+                "llm_cache_misses": self._llm_cache_misses,
+                "llm_early_stops": self._llm_early_stops,
+                "llm_provider_stats": {provider: llm_provider_summary(stats) for provider, stats in self._llm_provider_stats.items()},
                 "embed_time": self._embed_time,
                 "embed_calls": self._embed_calls,
+                "embed_cache_hits": self._embed_cache_hits,
+                "embed_cache_misses": self._embed_cache_misses,
+                "embed_batches": self._embed_batches,
+                "embed_batch_max": self._embed_batch_max,
                 "sparql_execs": self._sparql_execs,
                 "sparql_time": self._sparql_time,
+                "sparql_cache_hits": self._sparql_cache_hits,
+                "sparql_cache_misses": self._sparql_cache_misses,
+                "sparql_latency_histogram": self._sparql_latency_histogram,
+                "sparql_parse_cache_hits": self._sparql_parse_cache_hits,
+                "sparql_parse_gost_calls": self._sparql_parse_gost_calls,
                 "ri_time": self._ri_time,
                 "pe_time": self._pe_time,
                 "qg_zero_shot_time": self._qg_zero_shot_time,
@@ -163,8 +242,23 @@ class KgaqaTracker:
                 "pe_graph_search_time": self._pe_graph_search_time,
                 "pe_neighborhood_calls": self._pe_neighborhood_calls,
                 "pe_neighborhood_time": self._pe_neighborhood_time,
+                "pe_neighborhood_waves": self._pe_neighborhood_waves,
                 "pe_property_path_to_triples_calls": self._pe_property_path_to_triples_calls,
                 "pe_property_path_to_triples_time": self._pe_property_path_to_triples_time,
+                "pe_batched_validation_queries": self._pe_batched_validation_queries,
+                "pe_batched_validation_variants": self._pe_batched_validation_variants,
+                "pe_class_statistics_hits": self._pe_class_statistics_hits,
+                "pe_class_statistics_misses": self._pe_class_statistics_misses,
+                "pe_triple_store_lookups": self._pe_triple_store_lookups,
+                "pe_path_engine_searches": self._pe_path_engine_searches,
+                "pe_popularity_exact": self._pe_popularity_exact,
+                "pe_popularity_approximate": self._pe_popularity_approximate,
+                "pe_schema_index_hits": self._pe_schema_index_hits,
+                "pe_schema_index_misses": self._pe_schema_index_misses,
+                "pe_fanout_connections": self._pe_fanout_connections,
+                "pe_fanout_tasks": self._pe_fanout_tasks,
+                "pe_fanout_max": self._pe_fanout_max,
+                "pe_fanout_time": self._pe_fanout_time,
                 "pe_prompt_inclusion_time": self._pe_prompt_inclusion_time,
                 "pe_prompt_inclusion_calls": self._pe_prompt_inclusion_calls,
                 "pe_prompt_grounding_time": self._pe_prompt_grounding_time,
@@ -190,6 +284,30 @@ class KgaqaTracker:
                 else:
                     print(f"Warning: Metric '{key2}' not found in KgaqaTracker.")
     
+    def merge(self, other: "KgaqaTracker"):
+        """
+        Add the counters of another tracker (e.g., the tracker of a single question) to this one.
+        Counters named `_..._max` keep the maximum, histograms are added bucket by bucket.
+        """
+        def merge_dicts(current: dict, value: dict):
+            for bucket, count in value.items():
+                if isinstance(count, dict):
+                    merge_dicts(current.setdefault(bucket, {}), count)
+                else:
+                    current[bucket] = current.get(bucket, 0) + count
+        
+        for key, value in vars(other).items():
+            if not key.startswith("_") or not hasattr(self, key):
+                continue
+            current = getattr(self, key)
+            if isinstance(value, dict):
+                merge_dicts(current, value)
+            elif isinstance(value, (int, float)):
+                if key.endswith("_max"):
+                    setattr(self, key, max(current, value))
+                else:
+                    setattr(self, key, current + value)
+    
     def print(self):
         metrics = self.get_metrics()
         for category, values in metrics.items():
@@ -200,8 +318,15 @@ class KgaqaTracker:
         print("\n")
         
 tracker = None
+_thread_trackers = threading.local()
 
 def get_kgaqa_tracker() -> KgaqaTracker:
+    """
+    The tracker bound to the current thread (see bind_kgaqa_tracker), otherwise the global tracker.
+    """
+    bound = getattr(_thread_trackers, "tracker", None)
+    if bound is not None:
+        return bound
     global tracker
     if tracker is None:
         tracker = KgaqaTracker()
@@ -212,4 +337,11 @@ def get_kgaqa_tracker_from_dict(metrics_dict: dict) -> KgaqaTracker:
     if tracker is None:
         tracker = KgaqaTracker()
     tracker.load_from_dict(metrics_dict)
-    return tracker
\ No newline at end of file
+    return tracker
+
+def bind_kgaqa_tracker(bound_tracker: KgaqaTracker):
+    """
+    Make get_kgaqa_tracker return `bound_tracker` in the current thread, None restores the global tracker.
+    Used to give every concurrently processed question its own tracker, merged into the global one afterwards.
+    """
+    _thread_trackers.tracker = bound_tracker
@@ -0,0 +1,125 @@
+import time
+import random
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from src.metrics import get_kgaqa_tracker, new_latency_histogram, record_latency
+
+
+SPARQL_CREDENTIALS = ("user", "PASSWORD")
+SPARQL_CONNECT_TIMEOUT = 10     # seconds to establish a connection
+SPARQL_READ_TIMEOUT = 180       # 3 minutes max per query
+SPARQL_MAX_RETRIES = 5
+SPARQL_BACKOFF_BASE = 1.0       # seconds, doubled on every retry
+SPARQL_BACKOFF_MAX = 60.0
+SPARQL_POOL_SIZE = 16           # keep-alive connections per endpoint
+
+# Statuses that signal an overloaded or restarting server, everything else is the query's fault.
+_RETRIABLE_STATUSES = {429, 502, 503, 504}
+
+
+class SparqlError(Exception):
+    """
+    Raised when the endpoint rejects a query or stays unreachable after all retries.
+    """
+    def __init__(self, message: str, status_code: int = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class SparqlClient:
+    """
+    SPARQL protocol client for a single endpoint.
+    Keeps a pool of persistent HTTP connections, retries transient failures with jittered
+    exponential backoff and records a latency histogram of every request.
+    """
+    def __init__(self, endpoint: str, credentials=SPARQL_CREDENTIALS, connect_timeout: float = SPARQL_CONNECT_TIMEOUT,
+                 read_timeout: float = SPARQL_READ_TIMEOUT, max_retries: int = SPARQL_MAX_RETRIES,
+                 backoff_base: float = SPARQL_BACKOFF_BASE, backoff_max: float = SPARQL_BACKOFF_MAX, pool_size: int = SPARQL_POOL_SIZE):
+        self.endpoint = endpoint
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.latency_histogram = new_latency_histogram()
+        self._histogram_lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if credentials is not None:
+            self.session.auth = credentials
+        self.session.headers.update({"Accept": "application/sparql-results+json"})
+
+    def _backoff(self, attempt: int) -> float:
+        # "full jitter": uniform in [0, min(max, base * 2^attempt)]
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _observe(self, seconds: float):
+        with self._histogram_lock:
+            record_latency(self.latency_histogram, seconds)
+        record_latency(get_kgaqa_tracker()._sparql_latency_histogram, seconds)
+
+    def query(self, query: str, timeout: float = None) -> dict:
+        """
+        Execute a SELECT/ASK query and return the decoded JSON result.
+
+        :param query: The SPARQL query.
+        :param timeout: Read timeout in seconds, overrides the client default.
+        :return: The SPARQL JSON result as a dictionary.
+        """
+        read_timeout = timeout if timeout is not None else self.read_timeout
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                delay = self._backoff(attempt - 1)
+                print(f"[WAIT] Retrying query on {self.endpoint} in {delay:.1f} seconds ({attempt}/{self.max_retries})")
+                time.sleep(delay)
+            start = time.time()
+            try:
+                response = self.session.post(self.endpoint, data={"query": query}, timeout=(self.connect_timeout, read_timeout))
+            except requests.exceptions.ReadTimeout as e:
+                # the server is up but the query is too heavy, retrying would only repeat the wait
+                self._observe(time.time() - start)
+                raise SparqlError(f"Query timed out after {read_timeout} seconds: {e}") from e
+            except requests.exceptions.RequestException as e:
+                last_error = SparqlError(f"Connection to {self.endpoint} failed: {e}")
+                continue
+            self._observe(time.time() - start)
+
+            if response.status_code == 200:
+                return response.json()
+            error = SparqlError(f"Query failed with status {response.status_code}: {response.text}", response.status_code)
+            if response.status_code not in _RETRIABLE_STATUSES:
+                raise error
+            last_error = error
+        raise last_error
+
+    def is_up(self, test_query: str = "ASK {}") -> bool:
+        """
+        Sends a lightweight test query to check if the endpoint is responsive.
+        """
+        try:
+            response = self.session.post(self.endpoint, data={"query": test_query}, timeout=(self.connect_timeout, 10))
+            return response.status_code == 200
+        except requests.exceptions.RequestException:
+            return False
+
+    def close(self):
+        self.session.close()
+
+
+SPARQL_CLIENTS = {}
+_clients_lock = threading.Lock()
+
+def get_sparql_client(endpoint: str, credentials=SPARQL_CREDENTIALS) -> SparqlClient:
+    """
+    Get the shared client of an endpoint, creating it on first use.
+    """
+    key = (endpoint, credentials)
+    with _clients_lock:
+        if key not in SPARQL_CLIENTS:
+            SPARQL_CLIENTS[key] = SparqlClient(endpoint, credentials=credentials)
+        return SPARQL_CLIENTS[key]
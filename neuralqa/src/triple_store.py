@@ -0,0 +1,170 @@
+import os
+import re
+import json
+import mmap
+from array import array
+from collections import Counter
+
+
+class TripleStore:
+    """
+    Read-only, dictionary-encoded triple store stored on disk (built by tools/triple-store-generator).
+    Terms are sorted and numbered by their rank, the triples are kept in three sorted permutations (SPO, POS, OSP),
+    so every single triple pattern is a binary search over memory-mapped files.
+
+    Terms are kept in N-Triples syntax: <iri>, _:blank or "literal"@lang / "literal"^^<datatype>.
+    The lookups take and return plain IRIs (no angle brackets) and literal values, like SPARQL JSON bindings.
+
+    Files of a store directory:
+        terms.bin   - the UTF-8 terms, sorted bytewise, concatenated
+        terms.idx   - uint64 offsets into terms.bin (count + 1 entries)
+        spo.bin     - uint32 (subject, predicate, object) ids, sorted
+        pos.bin     - uint32 (predicate, object, subject) ids, sorted
+        osp.bin     - uint32 (object, subject, predicate) ids, sorted
+        meta.json   - {"terms": ..., "triples": ..., "format": 1}
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.term_count = self.meta["terms"]
+        self.count = self.meta["triples"]
+        self._terms = self._map(os.path.join(directory, "terms.bin"))
+        self._terms_idx = self._map(os.path.join(directory, "terms.idx"), "Q")
+        self._spo = self._map(os.path.join(directory, "spo.bin"), "I")
+        self._pos = self._map(os.path.join(directory, "pos.bin"), "I")
+        self._osp = self._map(os.path.join(directory, "osp.bin"), "I")
+
+    def _map(self, filepath: str, typecode: str = None):
+        if os.path.getsize(filepath) == 0:
+            return array(typecode) if typecode is not None else b""
+        with open(filepath, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(data).cast(typecode) if typecode is not None else data
+
+    # ----------------------
+    # ----- Dictionary -----
+    # ----------------------
+
+    def _term(self, i: int) -> bytes:
+        return self._terms[self._terms_idx[i]:self._terms_idx[i + 1]]
+
+    def term_id(self, term: str):
+        """
+        The id of a term in N-Triples syntax, None if the store does not know it.
+        """
+        key = term.encode("utf-8")
+        low, high = 0, self.term_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._term(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.term_count and self._term(low) == key:
+            return low
+        return None
+
+    def term(self, i: int) -> str:
+        return self._term(i).decode("utf-8")
+
+    def iri_id(self, iri: str):
+        return self.term_id("<" + iri.strip("<>") + ">")
+
+    def value(self, i: int) -> str:
+        """
+        The SPARQL binding value of a term: the IRI without brackets or the lexical form of a literal.
+        """
+        term = self.term(i)
+        if term[0] == "<":
+            return term[1:-1]
+        if term[0] == '"':
+            return unescape(term[1:term.rindex('"')])
+        return term
+
+    def is_literal(self, i: int):
+        return self._terms[self._terms_idx[i]] == ord('"')
+
+    # ---------------------------
+    # ----- Triple patterns -----
+    # ---------------------------
+
+    def _range(self, permutation, key: tuple):
+        """
+        The [first, end) rows of `permutation` whose leading ids equal `key`.
+        """
+        width = len(key)
+
+        def lower_bound(bound):
+            low, high = 0, self.count
+            while low < high:
+                middle = (low + high) // 2
+                row = middle * 3
+                if tuple(permutation[row:row + width]) < bound:
+                    low = middle + 1
+                else:
+                    high = middle
+            return low
+
+        first = lower_bound(key)
+        end = lower_bound(key[:-1] + (key[-1] + 1,))
+        return first, end
+
+    def _rows(self, permutation, key: tuple, limit: int = None):
+        first, end = self._range(permutation, key)
+        if limit is not None:
+            end = min(end, first + limit)
+        for row in range(first * 3, end * 3, 3):
+            yield permutation[row], permutation[row + 1], permutation[row + 2]
+
+    def iter_objects(self, subject: str, predicate: str, limit: int = None):
+        subject_id, predicate_id = self.iri_id(subject), self.iri_id(predicate)
+        if subject_id is None or predicate_id is None:
+            return
+        for _, _, o in self._rows(self._spo, (subject_id, predicate_id), limit):
+            yield self.value(o)
+
+    def iter_subjects(self, predicate: str, object: str, limit: int = None):
+        predicate_id, object_id = self.iri_id(predicate), self.iri_id(object)
+        if predicate_id is None or object_id is None:
+            return
+        for _, _, s in self._rows(self._pos, (predicate_id, object_id), limit):
+            yield self.value(s)
+
+    def objects(self, subject: str, predicate: str, limit: int = None):
+        return list(self.iter_objects(subject, predicate, limit))
+
+    def subjects(self, predicate: str, object: str, limit: int = None):
+        return list(self.iter_subjects(predicate, object, limit))
+
+    def predicate_counts(self, node: str, filter_literals=False):
+        """
+        Number of triples of every predicate that has `node` as subject or object.
+        :param filter_literals: skip the triples of `node` with a literal object
+        """
+        node_id = self.iri_id(node)
+        counts = Counter()
+        if node_id is None:
+            return counts
+        for _, p, o in self._rows(self._spo, (node_id,)):
+            if filter_literals and self.is_literal(o):
+                continue
+            counts[p] += 1
+        for _, _, p in self._rows(self._osp, (node_id,)):
+            counts[p] += 1
+        return Counter({self.value(p): count for p, count in counts.items()})
+
+    def __len__(self):
+        return self.count
+
+
+_ESCAPE = re.compile(r'\\(u[0-9a-fA-F]{4}|U[0-9a-fA-F]{8}|.)')
+_ESCAPES = {"t": "\t", "b": "\b", "n": "\n", "r": "\r", "f": "\f", '"': '"', "'": "'", "\\": "\\"}
+
+def unescape(literal: str):
+    def replace(match):
+        escape = match.group(1)
+        if escape[0] in "uU":
+            return chr(int(escape[1:], 16))
+        return _ESCAPES.get(escape, escape)
+    return _ESCAPE.sub(replace, literal)
@@ -1,27 +1,55 @@
 from enum import Enum
 import os
+import re
+import json
 import inspect
 import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from transformers import pipeline
 import torch
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 import openai
 import faiss
 import numpy as np
 from packaging import version
 import transformers
-import requests
-from SPARQLWrapper import SPARQLWrapper, JSON
 import google.genai as genai
 from google.genai import types
 from groq import Groq
-from src.metrics import get_kgaqa_tracker
+from src.metrics import bind_kgaqa_tracker, get_kgaqa_tracker, new_llm_provider_stats, record_latency
+from src.cache import LRUCache, PersistentCache, CacheMiss, hash_key
+from src.sparql_client import SPARQL_CREDENTIALS, get_sparql_client
+from src.document_store import DocumentStore
 
 
 # -----------------------------
 # ----- General utilities -----
 # -----------------------------
 
+def run_concurrently(function, items: list, max_workers: int, semaphore: threading.Semaphore = None):
+    """
+    Apply `function` to every item on a thread pool, results keep the order of `items`.
+    The workers report to the tracker of the calling thread, `semaphore` (if given) bounds the requests in flight
+    across all the pools that share it.
+    """
+    if max_workers <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+    tracker = get_kgaqa_tracker()
+    def run(item):
+        bind_kgaqa_tracker(tracker)
+        try:
+            if semaphore is None:
+                return function(item)
+            with semaphore:
+                return function(item)
+        finally:
+            bind_kgaqa_tracker(None)
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(run, items))
+
 def get_relative_path(relative_path):
     """
     Get the relative path of the current script.
@@ -64,34 +92,212 @@ class SupportedLLMs(Enum):
 LLM_PIPELINES = {}
 
 BASE_URL_VLLM = "YOUT_VLLM_SERVER_URL"
+LLM_POOL_SIZE = 16      # keep-alive connections to the vLLM server
+
+LLM_CLIENTS = {}
+_llm_clients_lock = threading.Lock()
+VLLM_MODEL_ID = None
+
+def get_llm_client(provider: str):
+    """
+    The client of an LLM provider ("gemini", "groq", "gpt" or "vllm"), built on first use and shared by all calls.
+    Every client keeps its own pool of keep-alive connections, for vLLM this is a plain requests session.
+    """
+    with _llm_clients_lock:
+        if provider not in LLM_CLIENTS:
+            if provider == "gemini":
+                LLM_CLIENTS[provider] = genai.Client(api_key="YOUR_GOOGLE_API_KEY")  # Replace with your Google API key
+            elif provider == "groq":
+                LLM_CLIENTS[provider] = Groq(
+                    api_key='YOUR_GROQ_API_KEY',  # Replace with your Groq API key
+                )
+            elif provider == "gpt":
+                LLM_CLIENTS[provider] = openai.OpenAI(
+                    api_key="YOUR_OPENAI_API_KEY", # Replace with your OpenAI API key
+                )
+            elif provider == "vllm":
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=LLM_POOL_SIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers.update({"Content-Type": "application/json"})
+                LLM_CLIENTS[provider] = session
+            else:
+                raise ValueError(f"Unknown LLM provider: {provider}")
+        return LLM_CLIENTS[provider]
             
-def vllm_get_available_model():
-    """Query the vLLM server for the available model."""
-    response = requests.get(f"{BASE_URL_VLLM}/v1/models")
+def vllm_get_available_model(refresh: bool = False):
+    """
+    Query the vLLM server for the available model. The id is fetched once and reused, unless `refresh` is set.
+    """
+    global VLLM_MODEL_ID
+    if VLLM_MODEL_ID is not None and not refresh:
+        return VLLM_MODEL_ID
+    response = get_llm_client("vllm").get(f"{BASE_URL_VLLM}/v1/models")
     if response.status_code == 200:
         models = response.json().get("data", [])
         if models:
-            return models[0]["id"]
+            VLLM_MODEL_ID = models[0]["id"]
+            return VLLM_MODEL_ID
         else:
             raise ValueError("No models found on the vLLM server.")
     else:
         raise RuntimeError(f"Failed to fetch models: {response.status_code} {response.text}")
 
-def llm_call(llm: SupportedLLMs, prompt: str, max_tokens: int = 500, temperature: float = 0.0):
+def record_llm_provider_call(provider: str, seconds: float, completion_tokens: int = None):
+    """
+    Add a call to the per-provider latency and throughput statistics of the tracker.
+    """
+    stats = get_kgaqa_tracker()._llm_provider_stats.setdefault(provider, new_llm_provider_stats())
+    stats["calls"] += 1
+    stats["time"] += seconds
+    if completion_tokens is not None:
+        stats["completion_tokens"] += completion_tokens
+        stats["timed_token_time"] += seconds
+    record_latency(stats["latency_histogram"], seconds)
+
+LLM_SEED = 451 # 0451
+LLM_CACHE = None
+LLM_MAX_IN_FLIGHT = 32      # max concurrent requests to the LLM providers, shared by all the threads of the process
+_llm_in_flight = threading.BoundedSemaphore(LLM_MAX_IN_FLIGHT)
+
+def configure_llm_concurrency(max_in_flight: int):
+    """
+    Set the process-wide window of concurrent LLM requests (batch calls and concurrently answered questions).
+    A self-hosted vLLM server batches the requests it receives together, so a wide window raises its throughput.
+    """
+    global LLM_MAX_IN_FLIGHT, _llm_in_flight
+    LLM_MAX_IN_FLIGHT = max_in_flight
+    _llm_in_flight = threading.BoundedSemaphore(max_in_flight)
+
+def configure_llm_cache(cache_dir: str, max_size_mb: float = None, replay: bool = False):
+    """
+    Enable the persistent LLM response cache shared by every llm_call.
+    
+    :param cache_dir: Directory holding the cache file (shared between runs and processes).
+    :param max_size_mb: Size bound of the cache file, least recently used responses are evicted first.
+    :param replay: Strict replay, responses are only served from the cache and a miss raises CacheMiss.
+    """
+    global LLM_CACHE
+    max_size_bytes = int(max_size_mb * 1024 * 1024) if max_size_mb is not None else None
+    LLM_CACHE = PersistentCache(os.path.join(cache_dir, "llm_cache.sqlite"), max_size_bytes=max_size_bytes, read_only=replay)
+    return LLM_CACHE
+
+def llm_cache_key(llm: SupportedLLMs, prompt: str, max_tokens: int, temperature: float):
+    return hash_key(llm.value, hash_key(prompt), max_tokens, temperature, LLM_SEED)
+
+def answer_marker_stop(marker: str, pattern: str, count: int = 1):
+    """
+    Stop condition for streamed completions: the answer is complete once `pattern` has matched `count` times
+    after the last occurrence of `marker`, e.g., three {n} groups after "FINAL ANSWER".
+    """
+    regex = re.compile(pattern)
+    def stop(text: str):
+        if marker not in text:
+            return False
+        return len(regex.findall(text.split(marker)[-1])) >= count
+    stop.__name__ = f"answer_marker_stop({marker}, {pattern}, {count})"
+    return stop
+
+def consume_llm_stream(pieces, stop_when, close=None):
+    """
+    Accumulate the text pieces of a streamed completion, stopping as soon as `stop_when(text)` holds.
+    
+    :param close: Closes the stream, so that the server stops generating.
+    :return: The text and the number of pieces received (close to the number of completion tokens).
+    """
+    text = ""
+    count = 0
+    for piece in pieces:
+        text += piece
+        count += 1
+        if stop_when(text):
+            get_kgaqa_tracker()._llm_early_stops += 1
+            if close is not None:
+                close()
+            break
+    return text, count
+
+def llm_call(llm: SupportedLLMs, prompt: str, max_tokens: int = 500, temperature: float = 0.0, stop_when=None):
     """
     Call the LLM with the given prompt and additional arguments.
+    Responses are served from the LLM cache, if configured, only cache misses reach the model.
+    
+    :param stop_when: Optional stop condition (see answer_marker_stop). The response is streamed and generation
+                      stops as soon as the condition holds on the text received so far. Ignored by local pipelines.
     """
     get_kgaqa_tracker()._llm_calls += 1
+    start_time = time.time()
+    if LLM_CACHE is not None:
+        key = llm_cache_key(llm, prompt, max_tokens, temperature)
+        if stop_when is not None:
+            # an early stopped response is a prefix of the full one, they must not share an entry
+            key = hash_key(key, stop_when.__name__)
+        try:
+            cached = LLM_CACHE.get(key)
+        except CacheMiss:
+            get_kgaqa_tracker()._llm_cache_misses += 1
+            get_kgaqa_tracker()._llm_time += time.time() - start_time
+            raise CacheMiss(f"LLM prompt not found in replay cache ({llm.value}): {prompt[:200]}")
+        if cached is not None:
+            get_kgaqa_tracker()._llm_cache_hits += 1
+            get_kgaqa_tracker()._llm_time += time.time() - start_time
+            return cached
+        get_kgaqa_tracker()._llm_cache_misses += 1
+    
+    with _llm_in_flight:
+        generated = _llm_generate(llm, prompt, max_tokens, temperature, stop_when)
+    
+    # failed calls return None (or nothing), they are retried on the next run
+    if LLM_CACHE is not None and generated:
+        LLM_CACHE.set(key, generated)
+    return generated
+
+def llm_batch_call(llm: SupportedLLMs, prompts: list, max_tokens: int = 500, temperature: float = 0.0, max_in_flight: int = None):
+    """
+    Call the LLM for many prompts concurrently, so that the server can batch them (continuous batching for vLLM).
+    Every prompt goes through llm_call (cache, metrics), the responses keep the order of `prompts`.
+    
+    :param max_in_flight: Max concurrent requests of this batch, still bounded by the process-wide LLM_MAX_IN_FLIGHT.
+    """
+    max_in_flight = max_in_flight if max_in_flight is not None else LLM_MAX_IN_FLIGHT
+    return run_concurrently(lambda prompt: llm_call(llm, prompt, max_tokens, temperature), prompts, max_in_flight)
+
+async def llm_batch_call_async(llm: SupportedLLMs, prompts: list, max_tokens: int = 500, temperature: float = 0.0, max_in_flight: int = None):
+    """
+    Async variant of llm_batch_call, the calls run on the default executor of the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    window = asyncio.Semaphore(max_in_flight if max_in_flight is not None else LLM_MAX_IN_FLIGHT)
+    tracker = get_kgaqa_tracker()
+    
+    def call(prompt):
+        bind_kgaqa_tracker(tracker)
+        try:
+            return llm_call(llm, prompt, max_tokens, temperature)
+        finally:
+            bind_kgaqa_tracker(None)
+    
+    async def call_in_window(prompt):
+        async with window:
+            return await loop.run_in_executor(None, call, prompt)
+    
+    return list(await asyncio.gather(*(call_in_window(prompt) for prompt in prompts)))
+
+def _llm_generate(llm: SupportedLLMs, prompt: str, max_tokens: int, temperature: float, stop_when=None):
     start_time = time.time()
     try:
         generated = ""  
+        completion_tokens = None
         if "gemini" in llm.value:
-            client = genai.Client(api_key="YOUR_GOOGLE_API_KEY")  # Replace with your Google API key
-            response = client.models.generate_content(
+            provider = "gemini"
+            client = get_llm_client(provider)
+            generate = client.models.generate_content if stop_when is None else client.models.generate_content_stream
+            response = generate(
                 model=llm.value,
                 contents=prompt,
                 config=types.GenerateContentConfig(
-                    seed=451, # 0451
+                    seed=LLM_SEED,
                     max_output_tokens=max_tokens,
                     temperature=temperature,
                     thinking_config=types.ThinkingConfig(thinking_budget=0),
@@ -118,11 +324,15 @@ def llm_call(llm: SupportedLLMs, prompt: str, max_tokens: int = 500, temperature
                         ),
                     ]
                 ))
-            generated = response.text
+            if stop_when is None:
+                generated = response.text
+                if response.usage_metadata is not None:
+                    completion_tokens = response.usage_metadata.candidates_token_count
+            else:
+                generated, completion_tokens = consume_llm_stream((chunk.text or "" for chunk in response), stop_when)
         elif "groq" in llm.value:
-            client = Groq(
-                api_key='YOUR_GROQ_API_KEY',  # Replace with your Groq API key
-            )
+            provider = "groq"
+            client = get_llm_client(provider)
             response = client.chat.completions.create(
             messages=[
                     {"role": "system",
@@ -131,16 +341,21 @@ def llm_call(llm: SupportedLLMs, prompt: str, max_tokens: int = 500, temperature
                     "content": prompt}
                 ],
                 model="meta-llama/llama-4-scout-17b-16e-instruct",
+                stream=stop_when is not None,
             )
-            generated = response.choices[0].message.content
+            if stop_when is None:
+                generated = response.choices[0].message.content
+                if response.usage is not None:
+                    completion_tokens = response.usage.completion_tokens
+            else:
+                generated, completion_tokens = consume_llm_stream((chunk.choices[0].delta.content or "" for chunk in response if chunk.choices), stop_when, response.close)
         elif "gpt" in llm.value:
+            provider = "gpt"
+            client = get_llm_client(provider)
             while True:
                 try:
-                    client = openai.OpenAI(
-                        api_key="YOUR_OPENAI_API_KEY", # Replace with your OpenAI API key
-                    )
                     response = client.chat.completions.create(
-                        seed=451, # 0451
+                        seed=LLM_SEED,
                         model=llm.value,
                         temperature=temperature,
                         max_completion_tokens=max_tokens*2, # FIXME: 2x the max tokens to avoid truncation
@@ -149,20 +364,24 @@ def llm_call(llm: SupportedLLMs, prompt: str, max_tokens: int = 500, temperature
                             "content": "You are a helpful assistant that tries its best to follow the instructions given by the user to generate a satisfying result. Be concise, helpful and try your best to do what the user requests."},
                             {"role": "user",
                             "content": prompt}
-                        ]
+                        ],
+                        stream=stop_when is not None,
                     )
-                    generated = response.choices[0].message.content
+                    if stop_when is None:
+                        generated = response.choices[0].message.content
+                        if response.usage is not None:
+                            completion_tokens = response.usage.completion_tokens
+                    else:
+                        generated, completion_tokens = consume_llm_stream((chunk.choices[0].delta.content or "" for chunk in response if chunk.choices), stop_when, response.close)
                     break
                 except openai.RateLimitError as e:
                     print(f"Rate limit exceeded for {llm.value}. Please try again later.")
                     print(f"Error: {e}")
                     time.sleep(10)
         elif "vllm" in llm.value:
+            provider = "vllm"
             def chat_with_vllm(prompt) -> requests.Response:
                 model_name = vllm_get_available_model()
-                headers = {
-                    "Content-Type": "application/json",
-                }
                 data = {
                     "model": model_name,
                     "messages": [
@@ -171,20 +390,40 @@ def llm_call(llm: SupportedLLMs, prompt: str, max_tokens: int = 500, temperature
                     ],
                     "temperature": 0.1,
                     "max_tokens": max_tokens,
-                    "stream": False
+                    "stream": stop_when is not None
                 }
 
-                response = requests.post(f"{BASE_URL_VLLM}/v1/chat/completions", headers=headers, json=data)
+                response = get_llm_client(provider).post(f"{BASE_URL_VLLM}/v1/chat/completions", json=data, stream=stop_when is not None)
 
                 if response.status_code == 200:
-                    return response.json()
+                    return response
                 else:
                     raise RuntimeError(f"Chat request failed: {response.status_code} {response.text}")
+            
+            def vllm_stream_pieces(response):
+                # server-sent events, one "data: {json}" line per chunk
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data: "):
+                        continue
+                    payload = line[len("data: "):]
+                    if payload == "[DONE]":
+                        break
+                    chunk = json.loads(payload)
+                    if chunk.get("choices"):
+                        yield chunk["choices"][0]["delta"].get("content") or ""
                                 
             response = chat_with_vllm(prompt)
             # print(response)
-            generated = response['choices'][0]['message']['content']
+            if stop_when is None:
+                response = response.json()
+                generated = response['choices'][0]['message']['content']
+                if "usage" in response:
+                    completion_tokens = response['usage']['completion_tokens']
+            else:
+                # closing the connection makes vLLM abort the request
+                generated, completion_tokens = consume_llm_stream(vllm_stream_pieces(response), stop_when, response.close)
         elif "gemma-3" in llm.value:
+            provider = "local"
             if llm.value not in LLM_PIPELINES:
                 LLM_PIPELINES[llm.value] = pipeline(
                     "text-generation",
@@ -215,6 +454,7 @@ def llm_call(llm: SupportedLLMs, prompt: str, max_tokens: int = 500, temperature
             )
             generated = outputs[0]["generated_text"][-1]["content"].strip()
         elif "gemma-2" in llm.value:
+            provider = "local"
             if llm.value not in LLM_PIPELINES:
                 LLM_PIPELINES[llm.value] = pipeline(
                     "text-generation",
@@ -238,7 +478,10 @@ def llm_call(llm: SupportedLLMs, prompt: str, max_tokens: int = 500, temperature
         else:
             print(f"LLM not supported: {llm.value}")
             print(type(llm.value))
+            provider = None
         get_kgaqa_tracker()._llm_time += time.time() - start_time
+        if provider is not None:
+            record_llm_provider_call(provider, time.time() - start_time, completion_tokens)
         return generated
     except Exception as e:
         get_kgaqa_tracker()._llm_time += time.time() - start_time
@@ -249,106 +492,242 @@ def llm_call(llm: SupportedLLMs, prompt: str, max_tokens: int = 500, temperature
 # ----- Embeddings -----
 # ----------------------
 
+EMBED_MEMORY_ITEMS = 50000      # embeddings kept in memory (LRU), shared by every thread of the process
+EMBED_BATCH_SIZE = 64           # texts per forward pass of the embedding model
+
 # Use for BELA environment!   
 transformers_version = transformers.__version__
 if version.parse(transformers_version) >= version.parse("4.50.0"):
     from llama_index.embeddings.huggingface import HuggingFaceEmbedding
     embed_model = HuggingFaceEmbedding(model_name="nomic-ai/nomic-embed-text-v2-moe", trust_remote_code=True,
                                        query_instruction="search_query: ",
-                                       text_instruction="search_document: ")
+                                       text_instruction="search_document: ",
+                                       embed_batch_size=EMBED_BATCH_SIZE)
 else:
     embed_model = None
 
+EMBED_MEMORY_CACHE = LRUCache(EMBED_MEMORY_ITEMS)
+EMBED_CACHE = None
+
+def configure_embed_cache(cache_dir: str, max_size_mb: float = None):
+    """
+    Enable the persistent embedding cache (in addition to the in-memory one), shared between runs and processes.
+    
+    :param cache_dir: Directory holding the cache file.
+    :param max_size_mb: Size bound of the cache file, least recently used embeddings are evicted first.
+    """
+    global EMBED_CACHE
+    max_size_bytes = int(max_size_mb * 1024 * 1024) if max_size_mb is not None else None
+    EMBED_CACHE = PersistentCache(os.path.join(cache_dir, "embed_cache.sqlite"), max_size_bytes=max_size_bytes)
+    return EMBED_CACHE
+
+def embed_cache_key(text: str, is_query: bool):
+    instruction = getattr(embed_model, "query_instruction" if is_query else "text_instruction", None)
+    return hash_key(getattr(embed_model, "model_name", None), instruction, text)
+
+def _supports_query_batches():
+    """
+    Whether many queries can be embedded in one forward pass. llama_index has no public batched query embedding
+    (get_text_embedding_batch applies the document instruction), HuggingFaceEmbedding._embed encodes a batch with
+    the "query" prompt (llama-index-embeddings-huggingface >= 0.2). It is private, so its signature is checked
+    and queries are embedded one at a time with get_query_embedding if it changed.
+    """
+    embed_function = getattr(embed_model, "_embed", None)
+    return embed_function is not None and "prompt_name" in inspect.signature(embed_function).parameters
+
+def _embed_uncached(texts: list, is_query: bool):
+    if not is_query:
+        return embed_model.get_text_embedding_batch(texts)
+    if len(texts) == 1:
+        return [embed_model.get_query_embedding(texts[0])]
+    return embed_model._embed(texts, prompt_name="query")
+
+def embed_batch(texts: list, is_query: bool = True):
+    """
+    Embed many texts, the ones that are not cached (memory, then disk) are embedded with batched forward passes
+    (one text per pass for queries if the model can't batch them, see _supports_query_batches).
+    Cache entries are keyed by the model, the instruction prefix and the text.
+    """
+    tracker = get_kgaqa_tracker()
+    tracker._embed_calls += 1
+    start_time = time.time()
+    
+    embeddings = {}
+    keys = {text: embed_cache_key(text, is_query) for text in texts}
+    for text, key in keys.items():
+        embedding = EMBED_MEMORY_CACHE.get(key)
+        if embedding is None and EMBED_CACHE is not None:
+            embedding = EMBED_CACHE.get(key)
+            if embedding is not None:
+                EMBED_MEMORY_CACHE.set(key, embedding)
+        if embedding is not None:
+            embeddings[text] = embedding
+    misses = [text for text in keys if text not in embeddings]
+    tracker._embed_cache_hits += len(keys) - len(misses)
+    tracker._embed_cache_misses += len(misses)
+    
+    batch_size = EMBED_BATCH_SIZE if not is_query or _supports_query_batches() else 1
+    for start in range(0, len(misses), batch_size):
+        batch = misses[start:start + batch_size]
+        tracker._embed_batches += 1
+        tracker._embed_batch_max = max(tracker._embed_batch_max, len(batch))
+        for text, embedding in zip(batch, _embed_uncached(batch, is_query)):
+            embedding = [float(value) for value in embedding]
+            embeddings[text] = embedding
+            EMBED_MEMORY_CACHE.set(keys[text], embedding)
+            if EMBED_CACHE is not None:
+                EMBED_CACHE.set(keys[text], embedding)
+    
+    tracker._embed_time += time.time() - start_time
+    return [embeddings[text] for text in texts]
+
 def embed(text: str, is_query: bool = True):
-    get_kgaqa_tracker()._embed_calls += 1
-    embed_model._get_text_embedding
-    if is_query:
-        return embed_model.get_query_embedding(text)
-    else:
-        return embed_model.get_text_embedding(text)
+    return embed_batch([text], is_query=is_query)[0]
     
 # ----------------------------
 # ----- SPARQL Execution -----
 # ----------------------------
 
-import time
-from SPARQLWrapper import SPARQLWrapper, JSON
-import socket
-from urllib.error import URLError, HTTPError
-
 def is_server_up(endpoint, test_query="ASK {}"):
     """
     Sends a lightweight test query to check if the SPARQL endpoint is responsive.
     Returns True if the server responds, False otherwise.
     """
-    test_sparql = SPARQLWrapper(endpoint)
-    test_sparql.setCredentials("user", "PASSWORD")
-    test_sparql.setReturnFormat(JSON)
-    test_sparql.setQuery(test_query)
-    test_sparql.setTimeout(10)  # quick timeout
-    try:
-        test_sparql.query().convert()
-        return True
-    except Exception:
-        return False
+    return get_sparql_client(endpoint).is_up(test_query)
 
-def execute_sparql_query(query, endpoint, max_wait_minutes=3, retry_interval=30):
-    get_kgaqa_tracker()._sparql_execs += 1
-    start = time.time()
+class SparqlResult:
+    """
+    Decoded SPARQL JSON result, exposing the same `convert()` as SPARQLWrapper's QueryResult.
+    """
+    def __init__(self, results: dict):
+        self.results = results
+
+    def convert(self):
+        return self.results
 
-    sparql = SPARQLWrapper(endpoint)
-    sparql.setCredentials("user", "PASSWORD")
-    sparql.setReturnFormat(JSON)
-    sparql.setQuery(query)
-    sparql.setTimeout(180)  # 3 minutes max
+SPARQL_CACHE = None
+
+def configure_sparql_cache(cache_dir: str, ttl: float = None, max_size_mb: float = None, replay: bool = False):
+    """
+    Enable the persistent SPARQL result cache shared by every execute_sparql_query call.
+    
+    :param cache_dir: Directory holding the cache file (shared between runs and processes).
+    :param ttl: Seconds after which a cached result is considered stale, None to keep forever.
+    :param max_size_mb: Size bound of the cache file, least recently used results are evicted first.
+    :param replay: Read-only mode, results are only served from the cache and a miss raises CacheMiss.
+    """
+    global SPARQL_CACHE
+    max_size_bytes = int(max_size_mb * 1024 * 1024) if max_size_mb is not None else None
+    SPARQL_CACHE = PersistentCache(os.path.join(cache_dir, "sparql_cache.sqlite"), ttl=ttl, max_size_bytes=max_size_bytes, read_only=replay)
+    return SPARQL_CACHE
+
+def sparql_cache_key(query: str, endpoint: str):
+    # normalize whitespace so that re-indented f-string queries share the same entry
+    return hash_key(endpoint, " ".join(query.split()))
+
+def execute_sparql_query(query, endpoint, timeout=None, credentials=SPARQL_CREDENTIALS):
+    """
+    Execute a query through the pooled client of `endpoint` (or the result cache, if configured).
+    Transient failures are retried with backoff by the client, the last error is re-raised.
+    """
+    start = time.time()
+    
+    if SPARQL_CACHE is not None:
+        key = sparql_cache_key(query, endpoint)
+        try:
+            cached = SPARQL_CACHE.get(key)
+        except CacheMiss:
+            get_kgaqa_tracker()._sparql_cache_misses += 1
+            get_kgaqa_tracker()._sparql_time += time.time() - start
+            raise CacheMiss(f"SPARQL query not found in replay cache: {query}")
+        if cached is not None:
+            get_kgaqa_tracker()._sparql_cache_hits += 1
+            get_kgaqa_tracker()._sparql_time += time.time() - start
+            return SparqlResult(cached)
+        get_kgaqa_tracker()._sparql_cache_misses += 1
+    
+    get_kgaqa_tracker()._sparql_execs += 1
 
-    exception = None
     try:
-        query_result = sparql.query()
-        get_kgaqa_tracker()._sparql_time += time.time() - start
-        return query_result
-    except (HTTPError, URLError, socket.timeout, socket.error) as e:
-        exception = e
-        get_kgaqa_tracker()._sparql_time += time.time() - start
-        print(f"[WARN] Query failed or timed out: {e}")
+        query_result = SparqlResult(get_sparql_client(endpoint, credentials).query(query, timeout=timeout))
     except Exception as e:
-        exception = e
         get_kgaqa_tracker()._sparql_time += time.time() - start
-        print(f"[ERROR] Unexpected failure: {e}")
-
-    # Retry logic: poll the server every `retry_interval` until it becomes responsive
-    print("[INFO] Checking for server recovery...")
-    while not is_server_up(endpoint):
-        print(f"[WAIT] Server still down... retrying in {retry_interval} seconds")
-        time.sleep(retry_interval)
-
-    raise exception  # Re-raise the last exception after retries
+        print(f"[WARN] Query failed or timed out: {e}")
+        raise
+    
+    if SPARQL_CACHE is not None:
+        SPARQL_CACHE.set(key, query_result.results)
+    get_kgaqa_tracker()._sparql_time += time.time() - start
+    return query_result
 
 # ---------------------------
 # ----- FAISS utilities -----
 # ---------------------------
     
 def load_faiss_index(index_dir):
+    """
+    Load a FAISS index and its documents (written by tools/faiss-index-generator).
+    The IVF inverted lists are memory-mapped when the installed FAISS supports it, and the documents of the binary
+    format (docs.bin + docs.idx) are memory-mapped too, old indexes with a docs.txt file are read into a list.
+    """
     print("Loading FAISS index...")
-    index = faiss.read_index(index_dir + "/faiss.index")
+    try:
+        index = faiss.read_index(index_dir + "/faiss.index", faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        index = faiss.read_index(index_dir + "/faiss.index")
+
+    # default search settings of approximate indexes, chosen when the index was built
+    if os.path.exists(index_dir + "/meta.json"):
+        with open(index_dir + "/meta.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is not None and meta.get("nprobe"):
+            ivf.nprobe = meta["nprobe"]
+        if isinstance(index, faiss.IndexHNSW) and meta.get("ef_search"):
+            index.hnsw.efSearch = meta["ef_search"]
 
     print("Loading documents...")
-    with open(index_dir + '/docs.txt', "r", encoding="utf-8") as f:
-        documents = [line.strip() for line in f.readlines()]
+    if DocumentStore.exists(index_dir):
+        documents = DocumentStore(index_dir)
+    else:
+        with open(index_dir + '/docs.txt', "r", encoding="utf-8") as f:
+            documents = [line.strip() for line in f.readlines()]
     
     return index, documents
 
-def search_faiss_index(index, documents, query, k=5, debug=False):
-    query_vector = embed_model.get_query_embedding(query)
-    query_vector = np.array(query_vector).astype("float32").reshape(1, -1)
-    distances, indices = index.search(query_vector, k)
+def search_faiss_index(index, documents, query, k=5, debug=False, nprobe=None):
+    """
+    :param nprobe: inverted lists (IVF) or search depth (HNSW) visited for this search only, the default of the index if None
+    """
+    results = search_faiss_index_batch(index, documents, [query], k=k, nprobe=nprobe, debug=debug)[0]
+    return [document for document, _ in results]
+
+def search_faiss_index_batch(index, documents, queries, k=5, nprobe=None, debug=False):
+    """
+    Search many queries at once: one embedding batch and one index.search with an (n, d) matrix.
+    :return: the (document, distance) pairs of every query, nearest first
+    """
+    if len(queries) == 0:
+        return []
+    query_vectors = np.array(embed_batch(queries, is_query=True)).astype("float32").reshape(len(queries), -1)
+    params = None
+    if nprobe is not None:
+        # passed with the call instead of set on the index, so threads sharing the index don't interfere
+        if faiss.try_extract_index_ivf(index) is not None:
+            params = faiss.SearchParametersIVF(nprobe=nprobe)
+        elif isinstance(index, faiss.IndexHNSW):
+            params = faiss.SearchParametersHNSW(efSearch=nprobe)
+    distances, indices = index.search(query_vectors, k, params=params)
     results = []
-    for idx, dist in zip(indices[0], distances[0]):
-        if idx == -1:
-            continue
-        results.append(documents[idx])
-        if debug:
-            print(f"[Distance: {dist:.4f}] {documents[idx]}")
+    for row_indices, row_distances in zip(indices, distances):
+        row = []
+        for idx, dist in zip(row_indices, row_distances):
+            if idx == -1:
+                continue
+            row.append((documents[idx], float(dist)))
+            if debug:
+                print(f"[Distance: {dist:.4f}] {documents[idx]}")
+        results.append(row)
     
     return results
 
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the sources are imported as src.*, from the neuralqa directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,78 @@
+import pytest
+
+utils = pytest.importorskip("src.utils")
+from src.cache import LRUCache
+from src.metrics import KgaqaTracker, bind_kgaqa_tracker
+
+
+class CountingEmbedding:
+    """
+    Embedding model double recording the texts of every model call.
+    """
+    model_name = "counting"
+    query_instruction = "search_query: "
+    text_instruction = "search_document: "
+
+    def __init__(self):
+        self.calls = []
+
+    def _embed(self, texts, prompt_name=None):
+        self.calls.append((prompt_name, list(texts)))
+        return [[float(len(text))] for text in texts]
+
+    def get_query_embedding(self, text):
+        self.calls.append(("query", [text]))
+        return [float(len(text))]
+
+    def get_text_embedding_batch(self, texts):
+        self.calls.append(("text", list(texts)))
+        return [[float(len(text))] for text in texts]
+
+
+class UnbatchedEmbedding(CountingEmbedding):
+    def _embed(self, texts):
+        raise AssertionError("the signature check must prevent this call")
+
+
+@pytest.fixture
+def tracker(monkeypatch):
+    monkeypatch.setattr(utils, "EMBED_MEMORY_CACHE", LRUCache(1000))
+    monkeypatch.setattr(utils, "EMBED_CACHE", None)
+    tracker = KgaqaTracker()
+    bind_kgaqa_tracker(tracker)
+    yield tracker
+    bind_kgaqa_tracker(None)
+
+
+def test_queries_are_embedded_in_one_call_per_batch(monkeypatch, tracker):
+    model = CountingEmbedding()
+    monkeypatch.setattr(utils, "embed_model", model)
+    monkeypatch.setattr(utils, "EMBED_BATCH_SIZE", 4)
+    questions = [f"question {i}" for i in range(10)]
+
+    embeddings = utils.embed_batch(questions, is_query=True)
+
+    assert embeddings == [[float(len(question))] for question in questions]
+    assert [len(texts) for _, texts in model.calls] == [4, 4, 2]
+    assert all(prompt_name == "query" for prompt_name, _ in model.calls)
+    assert tracker._embed_batches == 3
+    assert tracker._embed_batch_max == 4
+
+
+def test_cached_queries_are_not_embedded_again(monkeypatch, tracker):
+    model = CountingEmbedding()
+    monkeypatch.setattr(utils, "embed_model", model)
+    utils.embed_batch(["a", "b"], is_query=True)
+    utils.embed_batch(["a", "b", "c"], is_query=True)
+
+    assert [texts for _, texts in model.calls] == [["a", "b"], ["c"]]
+
+
+def test_queries_fall_back_to_one_call_per_query(monkeypatch, tracker):
+    model = UnbatchedEmbedding()
+    monkeypatch.setattr(utils, "embed_model", model)
+    utils.embed_batch(["a", "bb", "ccc"], is_query=True)
+
+    assert model.calls == [("query", ["a"]), ("query", ["bb"]), ("query", ["ccc"])]
+    assert tracker._embed_batches == 3
+    assert tracker._embed_batch_max == 1
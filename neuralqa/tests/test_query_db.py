@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+query_db = pytest.importorskip("src.engine.qa.query_db")
+from src import utils
+from src.cache import LRUCache
+from src.metrics import KgaqaTracker, bind_kgaqa_tracker
+
+
+class CountingEmbedding:
+    """
+    Embedding model double recording the texts of every query batch, a question embeds to its one-hot axis.
+    """
+    model_name = "counting"
+    query_instruction = "search_query: "
+    text_instruction = "search_document: "
+
+    def __init__(self, axes):
+        self.axes = axes
+        self.calls = []
+
+    def _embed(self, texts, prompt_name=None):
+        self.calls.append(list(texts))
+        return [self.get_query_embedding(text) for text in texts]
+
+    def get_query_embedding(self, text):
+        return [1.0 if axis == text else 0.0 for axis in self.axes]
+
+
+def test_relevant_queries_of_a_batch_are_embedded_in_one_call(monkeypatch):
+    questions = ["capital of greece", "population of athens", "mayor of athens"]
+    model = CountingEmbedding(questions)
+    monkeypatch.setattr(utils, "embed_model", model)
+    monkeypatch.setattr(utils, "EMBED_MEMORY_CACHE", LRUCache(1000))
+    monkeypatch.setattr(utils, "EMBED_CACHE", None)
+    bind_kgaqa_tracker(KgaqaTracker())
+
+    db = query_db.QueryDb.__new__(query_db.QueryDb)
+    db.entries = [(question, f"SELECT {i}") for i, question in enumerate(questions)]
+    db.matrix = np.eye(len(questions), dtype=np.float32)
+    try:
+        results = db.get_relevant_queries_batch(questions, top_k=1)
+    finally:
+        bind_kgaqa_tracker(None)
+
+    assert model.calls == [questions]
+    assert results == [([question], [f"SELECT {i}"]) for i, question in enumerate(questions)]
@@ -0,0 +1,126 @@
+import os
+import re
+import sys
+import json
+import argparse
+from array import array
+from tqdm import tqdm
+
+# Must match neuralqa/src/bm25_index.py, the queries are tokenized like the documents
+TOKEN_PATTERN = re.compile(r"\w+")
+STOPWORDS = frozenset("a an and are as at be by for from has in is it of on or that the to was were with".split())
+
+def tokenize(text: str):
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+def encode_varint(value: int, out: bytearray):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def write_shard(directory: str, documents: list, lengths: array, postings: dict):
+    """
+    Write the inverted index of a block of documents, the doc ids of the postings are local to the shard.
+    """
+    os.makedirs(directory, exist_ok=True)
+    terms = sorted(postings, key=lambda term: term.encode("utf-8"))
+    terms_idx, postings_idx, df = array("Q", [0]), array("Q", [0]), array("I")
+    with open(os.path.join(directory, "terms.bin"), "wb") as terms_file, open(os.path.join(directory, "postings.bin"), "wb") as postings_file:
+        terms_offset, postings_offset = 0, 0
+        for term in terms:
+            encoded = term.encode("utf-8")
+            terms_file.write(encoded)
+            terms_offset += len(encoded)
+            terms_idx.append(terms_offset)
+
+            doc_ids, tfs = postings[term]
+            data = bytearray()
+            previous = 0
+            for doc_id, tf in zip(doc_ids, tfs):
+                encode_varint(doc_id - previous, data)
+                encode_varint(tf, data)
+                previous = doc_id
+            postings_file.write(data)
+            postings_offset += len(data)
+            postings_idx.append(postings_offset)
+            df.append(len(doc_ids))
+    with open(os.path.join(directory, "terms.idx"), "wb") as f:
+        terms_idx.tofile(f)
+    with open(os.path.join(directory, "postings.idx"), "wb") as f:
+        postings_idx.tofile(f)
+    with open(os.path.join(directory, "df.bin"), "wb") as f:
+        df.tofile(f)
+    with open(os.path.join(directory, "lengths.bin"), "wb") as f:
+        lengths.tofile(f)
+
+    docs_idx = array("Q", [0])
+    with open(os.path.join(directory, "docs.bin"), "wb") as f:
+        offset = 0
+        for document in documents:
+            encoded = document.encode("utf-8")
+            f.write(encoded)
+            offset += len(encoded)
+            docs_idx.append(offset)
+    with open(os.path.join(directory, "docs.idx"), "wb") as f:
+        docs_idx.tofile(f)
+
+def create_bm25_index(args):
+    tqdm_kwargs = {"desc": "Indexing documents", "file": sys.stdout}
+    os.makedirs(args.output, exist_ok=True)
+
+    # ----------------------------------------------------
+    # ----- Index the documents, one shard at a time -----
+    # ----------------------------------------------------
+    shards = []
+    count, total_length = 0, 0
+    documents, lengths, postings = [], array("I"), {}
+
+    def flush():
+        name = f"shard-{len(shards):04d}"
+        write_shard(os.path.join(args.output, name), documents, lengths, postings)
+        shards.append(name)
+
+    with open(args.input, "r", encoding="utf-8") as f:
+        for line in tqdm(f, **tqdm_kwargs):
+            line = line.strip()
+            if not line:
+                continue
+            tokens = tokenize(line)
+            doc_id = len(documents)
+            frequencies = {}
+            for token in tokens:
+                frequencies[token] = frequencies.get(token, 0) + 1
+            for token, tf in frequencies.items():
+                if token not in postings:
+                    postings[token] = (array("I"), array("I"))
+                postings[token][0].append(doc_id)
+                postings[token][1].append(tf)
+            documents.append(line)
+            lengths.append(len(tokens))
+            count += 1
+            total_length += len(tokens)
+
+            # the memory of the builder is bounded by the size of a shard
+            if len(documents) == args.shard_size:
+                flush()
+                documents, lengths, postings = [], array("I"), {}
+    if documents or not shards:
+        flush()
+
+    with open(os.path.join(args.output, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"shards": shards, "count": count, "total_length": total_length, "k1": args.k1, "b": args.b, "format": 1}, f)
+
+    print("Index generation complete!")
+    print(f"{count} documents in {len(shards)} shards saved to {args.output}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sharded BM25 Index Generator")
+    parser.add_argument("--input", type=str, required=True, help="Path to the input text file, one document per line")
+    parser.add_argument("--output", type=str, required=True, help="Path to the output directory")
+    parser.add_argument("--shard_size", type=int, default=2000000, help="Documents per shard, bounds the memory used while building")
+    parser.add_argument("--k1", type=float, default=1.5, help="BM25 term frequency saturation")
+    parser.add_argument("--b", type=float, default=0.75, help="BM25 document length normalization")
+    args = parser.parse_args()
+
+    create_bm25_index(args)
@@ -1,67 +1,131 @@
 import torch
 import argparse
 import sys
+import json
+import random
+from array import array
 from tqdm import tqdm
 import faiss
 import numpy as np
 from sentence_transformers import SentenceTransformer
 import os
 
-def create_faiss_index(args):
-    tqdm_kwargs = {"desc": "Creating documents", "file": sys.stdout}
-    
-    # ------------------------
-    # ----- Prepare data -----
-    # ------------------------
-    print("Preparing data...")
-    raw_data = open(args.input).read()
-    texts = raw_data.split("\n")
-    documents = [text for text in tqdm(texts, **tqdm_kwargs)] # need prefix, could also add this via SentenceTransformer
+def read_documents(filepath):
+    """
+    Stream the documents of the input file, one per line.
+    """
+    with open(filepath, "r", encoding="utf-8") as f:
+        for line in f:
+            yield line.rstrip("\n")
 
-    # --------------------------
-    # ----- Generate embeddings -----
-    # --------------------------
-    print("Generating embeddings...")
-    device = "cuda:1" if torch.cuda.is_available() else "cpu"
-    model = SentenceTransformer("nomic-ai/nomic-embed-text-v2-moe", trust_remote_code=True, device=device)
-    
+def sample_documents(filepath, sample_size, seed=42):
+    """
+    Uniform sample of the documents (reservoir sampling), used to train the IVF-PQ index.
+    """
+    rng = random.Random(seed)
+    sample = []
+    for i, document in enumerate(read_documents(filepath)):
+        if i < sample_size:
+            sample.append(document)
+        else:
+            j = rng.randint(0, i)
+            if j < sample_size:
+                sample[j] = document
+    return sample
+
+def encode(model, documents, device, batch_size):
     embeddings = model.encode(
-        documents, 
-        show_progress_bar=True, 
-        batch_size=512,
+        documents,
+        show_progress_bar=False,
+        batch_size=batch_size,
         device=device,
         prompt_name="passage"
     )
+    return np.array(embeddings).astype("float32")  # FAISS requires float32
+
+def create_index(args, dimension):
+    if args.index_type == "flat":
+        return faiss.IndexFlatL2(dimension)
+    if args.index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, args.hnsw_m)
+        index.hnsw.efConstruction = args.ef_construction
+        return index
+    quantizer = faiss.IndexFlatL2(dimension)
+    return faiss.IndexIVFPQ(quantizer, dimension, args.nlist, args.m, args.nbits)
+
+def create_faiss_index(args):
+    os.makedirs(args.output, exist_ok=True)
 
-    embeddings = np.array(embeddings).astype("float32")  # FAISS requires float32
+    print("Loading model...")
+    device = "cuda:1" if torch.cuda.is_available() else "cpu"
+    model = SentenceTransformer("nomic-ai/nomic-embed-text-v2-moe", trust_remote_code=True, device=device)
+    dimension = model.get_sentence_embedding_dimension()
+    index = create_index(args, dimension)
 
+    # -----------------------------------------
+    # ----- Train the index (IVF-PQ only) -----
+    # -----------------------------------------
+    if not index.is_trained:
+        print(f"Training FAISS index on a sample of {args.train_size} documents...")
+        sample = sample_documents(args.input, args.train_size)
+        index.train(encode(model, sample, device, args.batch_size))
+        del sample
 
-    # --------------------------
-    # ----- Create FAISS index -----
-    # --------------------------
-    print("Creating FAISS index...")
-    dimension = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dimension)
-    index.add(embeddings)
+    # ---------------------------------------------------------
+    # ----- Embed, add and store the documents (streamed) -----
+    # ---------------------------------------------------------
+    print("Adding documents...")
+    count = 0
+    offset = 0
+    with open(f"{args.output}/docs.bin", "wb") as documents_file, open(f"{args.output}/docs.idx", "wb") as offsets_file:
+        array("Q", [0]).tofile(offsets_file)
+        batch = []
+        for document in tqdm(read_documents(args.input), desc="Embedding documents", file=sys.stdout):
+            batch.append(document)
+            if len(batch) == args.batch_size:
+                offset = add_batch(model, index, batch, device, args.batch_size, documents_file, offsets_file, offset)
+                count += len(batch)
+                batch = []
+        if batch:
+            offset = add_batch(model, index, batch, device, args.batch_size, documents_file, offsets_file, offset)
+            count += len(batch)
 
     # ----------------------------------
     # ----- Save the index to disk -----
     # ----------------------------------
     print("Saving index to disk...")
-    os.makedirs(args.output, exist_ok=True)
     faiss.write_index(index, f"{args.output}/faiss.index")
-    
-    with open(f"{args.output}/docs.txt", "w", encoding="utf-8") as f:
-        for doc in documents:
-            f.write(doc + "\n")
+    with open(f"{args.output}/meta.json", "w", encoding="utf-8") as f:
+        json.dump({"count": count, "dimension": dimension, "index_type": args.index_type, "nprobe": args.nprobe, "ef_search": args.ef_search}, f)
 
     print("Index generation complete!")
-    print(f"Index and documents saved to {args.output}")
+    print(f"Index and {count} documents saved to {args.output}")
+
+def add_batch(model, index, batch, device, batch_size, documents_file, offsets_file, offset):
+    index.add(encode(model, batch, device, batch_size))
+    offsets = array("Q")
+    for document in batch:
+        encoded = document.encode("utf-8")
+        documents_file.write(encoded)
+        offset += len(encoded)
+        offsets.append(offset)
+    offsets.tofile(offsets_file)
+    return offset
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="FAISS Dense Index Generator")
     parser.add_argument("--input", type=str, required=True, help="Path to the input text file")
     parser.add_argument("--output", type=str, required=True, help="Path to the output directory")
+    parser.add_argument("--index_type", type=str, default="flat", choices=["flat", "ivfpq", "hnsw"], help="Exact search (flat) or approximate search (ivfpq, hnsw) for large document sets")
+    parser.add_argument("--batch_size", type=int, default=512, help="Documents embedded and added to the index at once")
+    parser.add_argument("--nlist", type=int, default=4096, help="IVF-PQ: number of inverted lists (clusters)")
+    parser.add_argument("--m", type=int, default=64, help="IVF-PQ: number of sub-quantizers, must divide the embedding dimension")
+    parser.add_argument("--nbits", type=int, default=8, help="IVF-PQ: bits per sub-quantizer code")
+    parser.add_argument("--nprobe", type=int, default=32, help="IVF-PQ: default number of lists visited per search (stored with the index)")
+    parser.add_argument("--train_size", type=int, default=200000, help="IVF-PQ: documents sampled to train the quantizers")
+    parser.add_argument("--hnsw_m", type=int, default=32, help="HNSW: neighbors per node")
+    parser.add_argument("--ef_construction", type=int, default=200, help="HNSW: search depth while building")
+    parser.add_argument("--ef_search", type=int, default=128, help="HNSW: default search depth (stored with the index)")
     args = parser.parse_args()
 
     create_faiss_index(args)
@@ -1,4 +1,6 @@
 import argparse
+import os
+from array import array
 import faiss
 import numpy as np
 from sentence_transformers import SentenceTransformer
@@ -11,8 +13,16 @@ def load_faiss_index(index_dir):
     index = faiss.read_index(index_dir + "/faiss.index")
 
     print("Loading documents...")
-    with open(index_dir + '/docs.txt', "r", encoding="utf-8") as f:
-        documents = [line.strip() for line in f.readlines()]
+    if os.path.exists(index_dir + "/docs.bin"):
+        offsets = array("Q")
+        with open(index_dir + "/docs.idx", "rb") as f:
+            offsets.frombytes(f.read())
+        with open(index_dir + "/docs.bin", "rb") as f:
+            data = f.read()
+        documents = [data[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+    else:
+        with open(index_dir + '/docs.txt', "r", encoding="utf-8") as f:
+            documents = [line.strip() for line in f.readlines()]
     
     return index, documents
 
@@ -0,0 +1,133 @@
+import os
+import re
+import sys
+import json
+import heapq
+import argparse
+import tempfile
+from array import array
+from tqdm import tqdm
+
+# Label predicates read from N-Triples dumps
+LABEL_PREDICATES = {
+    "http://www.w3.org/2000/01/rdf-schema#label",
+    "http://rdf.freebase.com/ns/type.object.name",
+}
+
+_NTRIPLE = re.compile(r'^<([^>]+)>\s+<([^>]+)>\s+"((?:[^"\\]|\\.)*)"(?:@([a-zA-Z\-]+)|\^\^<[^>]+>)?\s*\.\s*$')
+_ESCAPE = re.compile(r'\\(u[0-9a-fA-F]{4}|U[0-9a-fA-F]{8}|.)')
+_ESCAPES = {"t": "\t", "b": "\b", "n": "\n", "r": "\r", "f": "\f", '"': '"', "'": "'", "\\": "\\"}
+
+def unescape(literal: str):
+    def replace(match):
+        escape = match.group(1)
+        if escape[0] in "uU":
+            return chr(int(escape[1:], 16))
+        return _ESCAPES.get(escape, escape)
+    return _ESCAPE.sub(replace, literal)
+
+def read_labels(filepath: str, lang: str):
+    """
+    Yield (uri, label) pairs of an N-Triples dump (label predicates only) or of a TSV file (uri <tab> label).
+    Literals with a language tag other than `lang` are skipped.
+    """
+    is_tsv = filepath.endswith(".tsv")
+    with open(filepath, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if len(line) == 0:
+                continue
+            if is_tsv:
+                parts = line.split("\t")
+                if len(parts) < 2:
+                    continue
+                uri, label = parts[0].strip("<>"), parts[1]
+            else:
+                match = _NTRIPLE.match(line)
+                if match is None or match.group(2) not in LABEL_PREDICATES:
+                    continue
+                if match.group(4) is not None and match.group(4).lower() != lang:
+                    continue
+                uri, label = match.group(1), unescape(match.group(3))
+            label = label.replace("\t", " ").replace("\r", " ").replace("\n", " ")
+            yield uri, label
+
+def write_run(pairs, directory: str):
+    """
+    Write a sorted run of pairs to a temporary TSV file, used for the external sort.
+    Sorted by URI only (stable), the labels of a URI keep their input order.
+    """
+    pairs.sort(key=lambda pair: pair[0].encode("utf-8"))
+    run = tempfile.NamedTemporaryFile(mode="w", dir=directory, delete=False, encoding="utf-8", newline="\n", suffix=".run")
+    for uri, label in pairs:
+        run.write(f"{uri}\t{label}\n")
+    run.close()
+    return run.name
+
+def read_run(filepath: str):
+    # only "\n" ends a line of a run, whatever the platform
+    with open(filepath, "r", encoding="utf-8", newline="\n") as f:
+        for line in f:
+            uri, label = line.rstrip("\n").split("\t", 1)
+            yield uri.encode("utf-8"), uri, label
+
+def create_label_store(args):
+    tqdm_kwargs = {"desc": "Reading labels", "file": sys.stdout}
+    os.makedirs(args.output, exist_ok=True)
+
+    # ---------------------------------------
+    # ----- Sorted runs (external sort) -----
+    # ---------------------------------------
+    print("Sorting labels...")
+    runs = []
+    pairs = []
+    for filepath in args.input:
+        for uri, label in tqdm(read_labels(filepath, args.lang), **tqdm_kwargs):
+            pairs.append((uri, label))
+            if len(pairs) >= args.chunk_size:
+                runs.append(write_run(pairs, args.output))
+                pairs = []
+    if len(pairs) > 0:
+        runs.append(write_run(pairs, args.output))
+
+    # ------------------------------
+    # ----- Merge and write out -----
+    # ------------------------------
+    print(f"Merging {len(runs)} sorted runs...")
+    keys_idx, labels_idx = array("Q", [0]), array("Q", [0])
+    count = 0
+    previous = None
+    with open(os.path.join(args.output, "keys.bin"), "wb") as keys_file, open(os.path.join(args.output, "labels.bin"), "wb") as labels_file:
+        # merged on the key only, equal keys come from the earlier runs first, i.e. in input order
+        for key, uri, label in heapq.merge(*[read_run(run) for run in runs], key=lambda entry: entry[0]):
+            if key == previous: # keep the first label of every URI
+                continue
+            previous = key
+            label = label.encode("utf-8")
+            keys_file.write(key)
+            labels_file.write(label)
+            keys_idx.append(keys_idx[-1] + len(key))
+            labels_idx.append(labels_idx[-1] + len(label))
+            count += 1
+    with open(os.path.join(args.output, "keys.idx"), "wb") as f:
+        keys_idx.tofile(f)
+    with open(os.path.join(args.output, "labels.idx"), "wb") as f:
+        labels_idx.tofile(f)
+    with open(os.path.join(args.output, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"count": count, "format": 1, "lang": args.lang}, f)
+
+    for run in runs:
+        os.remove(run)
+
+    print("Label store generation complete!")
+    print(f"{count} labels saved to {args.output}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline URI label store generator")
+    parser.add_argument("--input", type=str, nargs="+", required=True, help="N-Triples dumps (rdfs:label, type.object.name) or .tsv files (uri <tab> label)")
+    parser.add_argument("--output", type=str, required=True, help="Path to the output directory")
+    parser.add_argument("--lang", type=str, default="en", help="Language of the labels to keep")
+    parser.add_argument("--chunk_size", type=int, default=5000000, help="Labels sorted in memory at once")
+    args = parser.parse_args()
+
+    create_label_store(args)
@@ -0,0 +1,87 @@
+import os
+import re
+import sys
+import json
+import argparse
+from array import array
+from tqdm import tqdm
+
+_TERM = r'(<[^>]*>|_:\S+|"(?:[^"\\]|\\.)*"(?:@[a-zA-Z\-]+|\^\^<[^>]+>)?)'
+_NTRIPLE = re.compile(r'^(<[^>]*>|_:\S+)\s+(<[^>]*>)\s+' + _TERM + r'\s*\.\s*$')
+
+# (column order of the permutation, file name), the columns are (subject, predicate, object)
+PERMUTATIONS = [((0, 1, 2), "spo.bin"), ((1, 2, 0), "pos.bin"), ((2, 0, 1), "osp.bin")]
+
+def read_triples(filepaths: list):
+    """
+    Yield the (subject, predicate, object) terms of N-Triples dumps, in N-Triples syntax.
+    """
+    for filepath in filepaths:
+        with open(filepath, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                match = _NTRIPLE.match(line.strip())
+                if match is not None:
+                    yield match.group(1), match.group(2), match.group(3)
+
+def create_triple_store(args):
+    tqdm_kwargs = {"file": sys.stdout}
+    os.makedirs(args.output, exist_ok=True)
+
+    # ----------------------
+    # ----- Dictionary -----
+    # ----------------------
+    print("Collecting terms...")
+    terms = set()
+    for triple in tqdm(read_triples(args.input), desc="Reading terms", **tqdm_kwargs):
+        terms.update(triple)
+    terms = sorted(term.encode("utf-8") for term in terms)
+    term_ids = {}
+    terms_idx = array("Q", [0])
+    with open(os.path.join(args.output, "terms.bin"), "wb") as f:
+        for i, term in enumerate(terms):
+            f.write(term)
+            terms_idx.append(terms_idx[-1] + len(term))
+            term_ids[term.decode("utf-8")] = i
+    with open(os.path.join(args.output, "terms.idx"), "wb") as f:
+        terms_idx.tofile(f)
+    del terms
+
+    # ---------------------------
+    # ----- Encoded triples -----
+    # ---------------------------
+    print("Encoding triples...")
+    encoded = array("I")
+    for s, p, o in tqdm(read_triples(args.input), desc="Encoding triples", **tqdm_kwargs):
+        encoded.extend((term_ids[s], term_ids[p], term_ids[o]))
+    del term_ids
+
+    # ------------------------
+    # ----- Permutations -----
+    # ------------------------
+    count = None
+    for order, name in PERMUTATIONS:
+        print(f"Sorting {name}...")
+        a, b, c = order
+        # every row is packed into one integer, the duplicate triples collapse
+        keys = sorted(set((encoded[row + a] << 64) | (encoded[row + b] << 32) | encoded[row + c] for row in range(0, len(encoded), 3)))
+        permutation = array("I")
+        for key in keys:
+            permutation.extend((key >> 64, (key >> 32) & 0xFFFFFFFF, key & 0xFFFFFFFF))
+        with open(os.path.join(args.output, name), "wb") as f:
+            permutation.tofile(f)
+        count = len(keys)
+        del keys, permutation
+
+    with open(os.path.join(args.output, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"terms": len(terms_idx) - 1, "triples": count, "format": 1}, f)
+
+    print("Triple store generation complete!")
+    print(f"{count} triples and {len(terms_idx) - 1} terms saved to {args.output}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline dictionary-encoded triple store generator")
+    parser.add_argument("--input", type=str, nargs="+", required=True, help="N-Triples dumps of the knowledge graph")
+    parser.add_argument("--output", type=str, required=True, help="Path to the output directory")
+    args = parser.parse_args()
+
+    create_triple_store(args)